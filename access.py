@@ -0,0 +1,42 @@
+import argparse
+import hashlib
+import hmac
+
+import config
+
+# Signed links to the dashboard of an event for the multi-event mode: ?token=<event_id>.<signature>,
+# where the signature is an HMAC-SHA256 of the event ID with BLT_SMART_EVENTS_EVENT_TOKEN_SECRET.
+#
+#   python access.py 208150 208151   # prints the query string of each event
+
+
+def signature(event_id, secret):
+    return hmac.new(secret.encode('utf-8'), str(event_id).encode('utf-8'), hashlib.sha256).hexdigest()
+
+
+def sign_event(event_id, secret=None):
+    secret = secret or config.EVENT_TOKEN_SECRET
+    return f'{event_id}.{signature(event_id, secret)}'
+
+
+# Event ID of a token, or None when the token is malformed or its signature does not match
+def verify_token(token, secret=None):
+    secret = secret or config.EVENT_TOKEN_SECRET
+    event_id, _, sign = str(token).partition('.')
+    if not event_id.isdigit() or not hmac.compare_digest(sign, signature(event_id, secret)):
+        return None
+    return event_id
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Print signed dashboard links for the multi-event mode')
+    parser.add_argument('event_ids', nargs='+')
+    args = parser.parse_args()
+    if not config.EVENT_TOKEN_SECRET:
+        parser.error('BLT_SMART_EVENTS_EVENT_TOKEN_SECRET is not set')
+    for event_id in args.event_ids:
+        print(f'{event_id}: ?token={sign_event(event_id)}')
+
+
+if __name__ == '__main__':
+    main()
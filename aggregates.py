@@ -0,0 +1,277 @@
+import argparse
+import json
+import logging
+import glob
+import os
+import shutil
+
+import pandas as pd
+import config
+import backends
+
+logger = logging.getLogger(__name__)
+
+# Dimensions of the bookings cube, shared by utils.load_bookings_cube and the pre-aggregation job.
+# DIAS_A_LA_VENTA and PAYMENT_METHOD are null for the bookings left out of those charts.
+SALE_START = "coalesce(e.first_booking_intended_at, e.created_at)"
+DAYS_TO_SALE = f"""timestampdiff(
+                    day,
+                    convert_timezone('America/Mexico_City', {SALE_START}),
+                    convert_timezone('America/Mexico_City', cb.paid_at)
+                    )"""
+BOOKINGS_CUBE_DIMENSIONS = f"""case
+                    when cb.paid_at > {SALE_START} and {DAYS_TO_SALE} between 0 and 180 then {DAYS_TO_SALE}
+                end as dias_a_la_venta,
+                dayname(convert_timezone('America/Mexico_City', cb.paid_at)) as dia,
+                case
+                    when cb.paid_at <= coalesce(e.activated_at, e.created_at) or cb.payment_method is null then null
+                    when split_part(cb.payment_method, '::', 2) in ('PosCard', 'PosCash') then 'Insiders'
+                    when split_part(cb.payment_method, '::', 2) in ('Paypal', 'BoletiaDeposit', 'Deposit', 'TicketBooth', 'Innova') then 'Inactivos'
+                    ELSE split_part(cb.payment_method, '::', 2)
+                end as payment_method"""
+BOOKINGS_CUBE_KEYS = ['EVENT_ID', 'DIAS_A_LA_VENTA', 'DIA', 'PAYMENT_METHOD']
+
+FUNNEL_STAGE = """case
+                    when f.PAGE_PATH like '%/finish' then 'Pago'
+                    when f.PAGE_PATH like '%/pay' then 'Checkout'
+                    when f.PAGE_PATH like '%/info' then 'Info'
+                    else 'Inicio'
+                end"""
+FUNNEL_PATHS = """f.PAGE_PATH in (
+                                  f.SUBDOMAIN || '.boletia.com/',
+                                  f.SUBDOMAIN || '.boletia.com/info',
+                                  f.SUBDOMAIN || '.boletia.com/pay',
+                                  f.SUBDOMAIN || '.boletia.com/finish')"""
+
+# Tables that are already per-event rollups in the warehouse, copied as they are
+DEMOGRAPHIC_TABLES = {
+    'customers_by_age': 'CUSTOMER_DEMOGRAPHICS_AGE',
+    'customers_by_gender': 'CUSTOMER_DEMOGRAPHICS_GENDER',
+    'customers_by_gender_age': 'CUSTOMER_DEMOGRAPHICS_GENDER_AGE',
+    'bookings_by_city': 'CUSTOMER_DEMOGRAPHICS_CITY',
+}
+
+# Funnel tables and the breakdown column of each one
+FUNNEL_TABLES = {
+    'pageviews': ('SALES_FUNNELS', None),
+    'pageviews_by_medium': ('SALES_FUNNELS_BY_MEDIUM', 'MEDIUM'),
+    'pageviews_by_source_medium': ('SALES_FUNNELS_BY_SOURCE_MEDIUM', 'SOURCE_MEDIUM'),
+}
+
+
+# Local store of per-event aggregates in Parquet, partitioned by EVENT_BUCKET = EVENT_ID % buckets:
+#   <root>/<table>/EVENT_BUCKET=<n>/part.parquet
+#   <root>/_state.json  (bucket count, paid_at watermark and the columns of every table)
+# Every change is staged next to the files it replaces and committed with the new state through
+# <root>/_journal.json, so a crash leaves the store either as it was or finished by recover().
+class AggregateStore:
+
+    def __init__(self, root, buckets=None):
+        self.root = root
+        self.state = self.load_state()
+        self.buckets = self.state.get('buckets') or buckets or config.AGGREGATE_BUCKETS
+        self.state['buckets'] = self.buckets
+
+    def load_state(self):
+        path = os.path.join(self.root, '_state.json')
+        if not os.path.isfile(path):
+            return {'tables': {}}
+        with open(path) as f:
+            return json.load(f)
+
+    def save_state(self):
+        self.write_json('_state.json', self.state)
+
+    def write_json(self, name, data):
+        os.makedirs(self.root, exist_ok=True)
+        path = os.path.join(self.root, name)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(data, f, indent=2)
+        os.replace(path + '.tmp', path)
+
+    # Swap the staged files in (`renames` are (source, target) pairs, applied in order) and save the
+    # state as one step: the journal with both is written first, the old copies are deleted last
+    def commit(self, renames, cleanup=()):
+        journal = {
+            'renames': [[os.path.relpath(src, self.root), os.path.relpath(dst, self.root)] for src, dst in renames],
+            'cleanup': [os.path.relpath(path, self.root) for path in cleanup],
+            'state': self.state,
+        }
+        self.write_json('_journal.json', journal)
+        self._apply(journal)
+
+    # Every step can be repeated: a rename whose source is gone was already applied
+    def _apply(self, journal):
+        for src, dst in journal['renames']:
+            src, dst = os.path.join(self.root, src), os.path.join(self.root, dst)
+            if os.path.exists(src):
+                os.replace(src, dst)
+        self.state = journal['state']
+        self.buckets = self.state['buckets']
+        self.save_state()
+        for path in journal['cleanup']:
+            shutil.rmtree(os.path.join(self.root, path), ignore_errors=True)
+        os.remove(os.path.join(self.root, '_journal.json'))
+
+    # Finish the commit of a run that crashed after writing its journal, or drop the files staged by a
+    # run that crashed before it. Only the aggregation job calls it, never the app that reads the store.
+    def recover(self):
+        path = os.path.join(self.root, '_journal.json')
+        if os.path.isfile(path):
+            with open(path) as f:
+                journal = json.load(f)
+            logger.info('Completing an interrupted commit of the aggregate store')
+            self._apply(journal)
+        for leftover in glob.glob(os.path.join(self.root, '*', 'EVENT_BUCKET=*', '*.pending')):
+            os.remove(leftover)
+        for leftover in glob.glob(os.path.join(self.root, '*.staging')) + glob.glob(os.path.join(self.root, '*.old')):
+            shutil.rmtree(leftover, ignore_errors=True)
+
+    def has(self, table):
+        return table in self.state['tables']
+
+    def part_path(self, table, bucket, root=None):
+        return os.path.join(root or os.path.join(self.root, table), f'EVENT_BUCKET={bucket}', 'part.parquet')
+
+    # Rows of `table` for the given events
+    def read(self, table, event_ids):
+        ids = sorted({int(i) for i in event_ids})
+        frames = []
+        for bucket in sorted({i % self.buckets for i in ids}):
+            path = self.part_path(table, bucket)
+            if os.path.isfile(path):
+                frames.append(pd.read_parquet(path, filters=[('EVENT_ID', 'in', ids)]))
+        if not frames:
+            return pd.DataFrame(columns=self.state['tables'].get(table, []))
+        return pd.concat(frames, ignore_index=True)
+
+    def _write_part(self, df, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        df.to_parquet(path + '.tmp', index=False)
+        os.replace(path + '.tmp', path)
+
+    # Replace the whole table with `df`, committed with the `state` updates. The old table is moved
+    # aside before the new one takes its place and deleted afterwards, never before.
+    def replace(self, table, df, **state):
+        final = os.path.join(self.root, table)
+        staging = final + '.staging'
+        old = final + '.old'
+        shutil.rmtree(staging, ignore_errors=True)
+        shutil.rmtree(old, ignore_errors=True)
+        for bucket, part in df.groupby(df['EVENT_ID'].astype('int64') % self.buckets):
+            self._write_part(part, self.part_path(table, bucket, staging))
+        os.makedirs(staging, exist_ok=True)
+        self.state['tables'][table] = list(df.columns)
+        self.state.update(state)
+        self.commit([(final, old), (staging, final)], cleanup=[old])
+
+    # Add the counts in `df` to the stored ones, rewriting only the buckets it touches. All of them
+    # are staged first and swapped in together with the `state` updates (the watermark).
+    def merge_counts(self, table, df, keys, value, **state):
+        renames = []
+        for bucket, part in df.groupby(df['EVENT_ID'].astype('int64') % self.buckets):
+            path = self.part_path(table, bucket)
+            if os.path.isfile(path):
+                part = pd.concat([pd.read_parquet(path), part], ignore_index=True)
+            part = part.groupby(keys, dropna=False, as_index=False)[value].sum()
+            self._write_part(part, path + '.pending')
+            renames.append((path + '.pending', path))
+        if table not in self.state['tables']:
+            self.state['tables'][table] = keys + [value]
+        self.state.update(state)
+        self.commit(renames)
+
+
+def to_watermark(ts):
+    ts = pd.Timestamp(ts)
+    ts = ts.tz_localize('UTC') if ts.tzinfo is None else ts.tz_convert('UTC')
+    return ts.isoformat(sep=' ')
+
+
+# New bookings since the last watermark, aggregated per event at the bookings cube grain
+def refresh_bookings(backend, store, full=False):
+    watermark = None if full else store.state.get('bookings_watermark')
+    where = f"where cb.paid_at > cast('{watermark}' as timestamp with time zone)" if watermark else ''
+    sql = f"""
+            select
+                cb.event_id,
+                {BOOKINGS_CUBE_DIMENSIONS},
+                count(*) as compras,
+                max(cb.paid_at) as max_paid_at
+            from PROD.EVENTS.COMPLETED_BOOKINGS cb
+            left join prod.events.events e on e.event_id = cb.event_id
+            {where}
+            group by 1, 2, 3, 4
+            """
+    df = backend.query(sql, max_rows=0, max_bytes=0)
+    if len(df) == 0:
+        logger.info('No new bookings since %s', watermark)
+        return 0
+    new_watermark = to_watermark(df['MAX_PAID_AT'].max())
+    df = df.drop(columns=['MAX_PAID_AT'])
+    # The watermark is committed with the buckets, so a crash never merges the same bookings twice
+    if full or not store.has('bookings_cube'):
+        store.replace('bookings_cube', df, bookings_watermark=new_watermark)
+    else:
+        store.merge_counts('bookings_cube', df, BOOKINGS_CUBE_KEYS, 'COMPRAS', bookings_watermark=new_watermark)
+    logger.info('Aggregated %s booking groups, watermark %s', len(df), new_watermark)
+    return len(df)
+
+
+# Demographic rollups have no paid_at column to follow, they are small and copied in full
+def refresh_demographics(backend, store):
+    for table, source in DEMOGRAPHIC_TABLES.items():
+        df = backend.query(f"select * from EVENTS.{source}", max_rows=0, max_bytes=0)
+        store.replace(table, df)
+        logger.info('Copied %s rows of %s', len(df), source)
+
+
+# Funnel pageviews of each event, keeping only the four stages the dashboard shows
+def refresh_funnels(backend, store):
+    for table, (source, breakdown) in FUNNEL_TABLES.items():
+        breakdown_column = f'f.{breakdown},' if breakdown else ''
+        sql = f"""select
+                e.EVENT_ID,
+                {FUNNEL_STAGE} as PAGE_PATH,
+                {breakdown_column}
+                f.PAGEVIEWS
+                from EVENTS.{source} f
+                join EVENTS.EVENTS e on e.SUBDOMAIN = f.SUBDOMAIN
+                where {FUNNEL_PATHS}
+                """
+        df = backend.query(sql, max_rows=0, max_bytes=0)
+        store.replace(table, df)
+        logger.info('Copied %s rows of %s', len(df), source)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Materialize per-event aggregates of the dashboard into a local Parquet store')
+    parser.add_argument('--store', default=config.AGGREGATE_STORE or 'aggregates',
+                        help='Directory of the aggregate store')
+    parser.add_argument('--full', action='store_true',
+                        help='Rebuild the bookings aggregates from scratch instead of since the last watermark')
+    parser.add_argument('--only', choices=['bookings', 'demographics', 'funnels'], action='append',
+                        help='Refresh only these aggregates (can be repeated)')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    backend = backends.create_backend()
+    store = AggregateStore(args.store)
+    store.recover()
+    only = args.only or ['bookings', 'demographics', 'funnels']
+    try:
+        # Every table is committed with the state as soon as it is written, so the job can be rerun
+        # after a failure at any point
+        if 'bookings' in only:
+            refresh_bookings(backend, store, full=args.full)
+        if 'demographics' in only:
+            refresh_demographics(backend, store)
+        if 'funnels' in only:
+            refresh_funnels(backend, store)
+    finally:
+        backend.close()
+
+
+if __name__ == '__main__':
+    main()
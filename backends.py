@@ -0,0 +1,224 @@
+import os
+import re
+import threading
+import time
+from contextlib import closing
+
+import numpy as np
+import pandas as pd
+import config
+from pool import ConnectionPool
+
+
+# Tables read by the dashboard, all of them under the EVENTS schema
+TABLES = [
+    'EVENTS',
+    'COMPLETED_BOOKINGS',
+    'CUSTOMER_DEMOGRAPHICS_AGE',
+    'CUSTOMER_DEMOGRAPHICS_GENDER',
+    'CUSTOMER_DEMOGRAPHICS_GENDER_AGE',
+    'CUSTOMER_DEMOGRAPHICS_CITY',
+    'SALES_FUNNELS',
+    'SALES_FUNNELS_BY_MEDIUM',
+    'SALES_FUNNELS_BY_SOURCE_MEDIUM',
+]
+
+
+class QueryTooLarge(RuntimeError):
+    pass
+
+
+# Integer columns whose values fit in 32 bits are stored as int32
+def downcast(df):
+    for column in df.columns:
+        values = df[column]
+        if values.dtype == np.int64 and len(values) > 0 and \
+                values.min() >= np.iinfo(np.int32).min and values.max() <= np.iinfo(np.int32).max:
+            df[column] = values.astype(np.int32)
+    return df
+
+
+# Base class for the data backends, every loader in utils goes through query().
+# Subclasses stream the result of a query as Arrow batches from batches(); query() converts
+# them to pandas one at a time, so the Arrow copy of the whole result is never held in memory,
+# and stops as soon as the result goes over max_rows / max_bytes (None for the configured
+# limits, 0 for no limit). When given, `stats` is filled with the warehouse query ID, execute
+# and fetch seconds, rows and bytes of the result.
+class Backend:
+    name = None
+
+    def __init__(self):
+        # Number of queries sent to the data source, read by the benchmarks
+        self.query_count = 0
+        self.count_lock = threading.Lock()
+
+    def batches(self, sql, stats):
+        raise NotImplementedError
+
+    def query(self, sql, max_rows=None, max_bytes=None, stats=None):
+        max_rows = config.MAX_QUERY_ROWS if max_rows is None else max_rows
+        max_bytes = config.MAX_QUERY_BYTES if max_bytes is None else max_bytes
+        with self.count_lock:
+            self.query_count += 1
+        stats = {} if stats is None else stats
+        stats.update(query_id=None, execute_seconds=0.0)
+        frames = []
+        rows = size = 0
+        start = time.perf_counter()
+        with closing(self.batches(sql, stats)) as batches:
+            for batch in batches:
+                rows += batch.num_rows
+                size += batch.nbytes
+                if max_rows and rows > max_rows:
+                    raise QueryTooLarge(
+                        f'Query result has more than {max_rows} rows (BLT_SMART_EVENTS_MAX_QUERY_ROWS)')
+                if max_bytes and size > max_bytes:
+                    raise QueryTooLarge(
+                        f'Query result is larger than {max_bytes} bytes (BLT_SMART_EVENTS_MAX_QUERY_BYTES)')
+                frames.append(downcast(batch.to_pandas()))
+        stats.update(fetch_seconds=time.perf_counter() - start - stats['execute_seconds'], rows=rows, bytes=size)
+        if len(frames) == 1:
+            return frames[0]
+        return pd.concat(frames, ignore_index=True)
+
+    def close(self):
+        pass
+
+
+# Snowflake warehouse backend (production). Each query checks out its own
+# connection and cursor from a bounded pool shared by all sessions.
+class SnowflakeBackend(Backend):
+    name = 'SNOWFLAKE'
+
+    def __init__(self):
+        super().__init__()
+        self.pool = ConnectionPool(
+            self.connect,
+            size=config.POOL_SIZE,
+            idle_timeout=config.POOL_IDLE_TIMEOUT,
+            checkout_timeout=config.POOL_CHECKOUT_TIMEOUT,
+            health_check_interval=config.POOL_HEALTH_CHECK_INTERVAL
+        )
+
+    def connect(self):
+        import snowflake.connector
+        return snowflake.connector.connect(
+            user=config.USER,
+            password=config.PASSWORD,
+            account=config.ACCOUNT,
+            warehouse=config.WAREHOUSE,
+            database=config.DATABASE,
+            schema=config.SCHEMA
+        )
+
+    def batches(self, sql, stats):
+        import pyarrow as pa
+        with self.pool.cursor() as cur:
+            start = time.perf_counter()
+            cur.execute(sql)
+            stats.update(query_id=cur.sfqid, execute_seconds=time.perf_counter() - start)
+            empty = True
+            for batch in cur.fetch_arrow_batches():
+                empty = False
+                yield batch
+            if empty:
+                # Empty results come with no batches, only the column names
+                yield pa.table({column[0]: pa.array([]) for column in cur.description})
+
+    def close(self):
+        self.pool.close()
+
+
+# Snowflake functions used by the loaders that DuckDB spells differently.
+# Timestamps are stored as naive UTC in the local files, like Snowflake's TIMESTAMP_NTZ.
+DUCKDB_MACROS = [
+    """create or replace macro sf_convert_timezone(target_tz, ts) as
+        timezone(target_tz, timezone('UTC', ts)),
+        (source_tz, target_tz, ts) as timezone(target_tz, timezone(source_tz, ts))""",
+    "create or replace macro sf_dayname(ts) as strftime(ts, '%a')",
+]
+
+DUCKDB_REWRITES = [
+    (re.compile(r'\bconvert_timezone\s*\(', re.IGNORECASE), 'sf_convert_timezone('),
+    (re.compile(r'\bdayname\s*\(', re.IGNORECASE), 'sf_dayname('),
+    (re.compile(r'\btimestampdiff\s*\(\s*(\w+)\s*,', re.IGNORECASE), r"date_diff('\1',"),
+    # Snowflake names VALUES columns $1, $2... while DuckDB names them col0, col1...
+    (re.compile(r'\$(\d+)'), lambda m: f'col{int(m.group(1)) - 1}'),
+]
+
+
+# Local backend that serves the same tables from Parquet files through DuckDB.
+# Each table is read from <data_dir>/<TABLE>/*.parquet (or <data_dir>/<TABLE>.parquet)
+# and exposed both as EVENTS.<TABLE> and PROD.EVENTS.<TABLE>.
+class DuckDBBackend(Backend):
+    name = 'DUCKDB'
+    batch_rows = 1_000_000
+
+    def __init__(self, data_dir):
+        import duckdb
+        super().__init__()
+        self.data_dir = data_dir
+        self.con = duckdb.connect()
+        self.lock = threading.Lock()
+        self.con.execute("attach ':memory:' as prod")
+        self.con.execute("use prod")
+        self.con.execute("create schema if not exists events")
+        for macro in DUCKDB_MACROS:
+            self.con.execute(macro)
+        for table in TABLES:
+            source = self.table_source(table)
+            if source is None:
+                continue
+            self.con.execute(
+                f"create or replace view events.{table} as select * from read_parquet('{source}')")
+
+    def table_source(self, table):
+        folder = os.path.join(self.data_dir, table)
+        if os.path.isdir(folder):
+            return os.path.join(folder, '*.parquet')
+        file = f'{folder}.parquet'
+        if os.path.isfile(file):
+            return file
+        return None
+
+    def translate(self, sql):
+        for pattern, replacement in DUCKDB_REWRITES:
+            sql = pattern.sub(replacement, sql)
+        return sql
+
+    def batches(self, sql, stats):
+        # DuckDB connections are not thread safe, each query gets its own cursor
+        with self.lock:
+            cur = self.con.cursor()
+        try:
+            cur.execute("use prod")
+            cur.execute("set TimeZone = 'UTC'")
+            start = time.perf_counter()
+            reader = cur.execute(self.translate(sql)).fetch_record_batch(self.batch_rows)
+            stats['execute_seconds'] = time.perf_counter() - start
+            empty = True
+            for batch in reader:
+                empty = False
+                yield batch
+            if empty:
+                yield reader.schema.empty_table()
+        finally:
+            cur.close()
+
+    def query(self, sql, max_rows=None, max_bytes=None, stats=None):
+        df = super().query(sql, max_rows, max_bytes, stats)
+        # Snowflake returns unquoted identifiers in upper case
+        df.columns = [c.upper() for c in df.columns]
+        return df
+
+    def close(self):
+        self.con.close()
+
+
+def create_backend(name=None):
+    name = (name or config.BACKEND).upper()
+    if name == 'SNOWFLAKE':
+        return SnowflakeBackend()
+    if name == 'DUCKDB':
+        return DuckDBBackend(config.LOCAL_DATA_DIR)
+    raise ValueError(f"Unknown data backend '{name}', expected SNOWFLAKE or DUCKDB")
@@ -0,0 +1,247 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# Headless benchmark of the dashboard pages against the DuckDB backend and synthetic data.
+# Every page is run with Streamlit's AppTest: a cold run (every cache of the process empty) and a
+# few warm reruns of the same session, recording latency, queries sent to the backend and peak memory.
+# Each cold run happens in a fresh process and the gate uses the median of several of them, since a
+# single timing is too noisy to compare.
+# Results are compared with benchmarks/baseline.json and the run fails on regressions.
+#
+#   python benchmarks/run.py                     # compare with the baseline
+#   python benchmarks/run.py --update-baseline   # record a new baseline on this machine
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE = os.path.join(ROOT, 'benchmarks', 'baseline.json')
+PAGES = [
+    'smart_events.py',
+    'pages/02_Demográfica.py',
+    'pages/03_Proceso_de_compra.py',
+    'pages/04_Fuentes.py',
+]
+# State the main page leaves in the session for the other pages
+SESSION_KEYS = ['event_id', 'price_threshold', 'event_context']
+
+sys.path.insert(0, ROOT)
+import synthetic  # noqa: E402
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark the dashboard pages headlessly')
+    parser.add_argument('--data-dir', help='Use the synthetic data already in this directory')
+    parser.add_argument('--events', type=int, default=500, help='Synthetic events to generate')
+    parser.add_argument('--bookings', type=int, default=200_000, help='Synthetic bookings to generate')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--cold-runs', type=int, default=5,
+                        help='Cold runs of every page, each in a fresh process')
+    parser.add_argument('--warm-runs', type=int, default=3, help='Warm reruns after every cold run')
+    parser.add_argument('--timeout', type=float, default=120, help='Seconds a single run may take')
+    parser.add_argument('--time-tolerance', type=float, default=0.5,
+                        help='Allowed relative increase of latency over the baseline')
+    parser.add_argument('--memory-tolerance', type=float, default=0.25,
+                        help='Allowed relative increase of memory over the baseline')
+    parser.add_argument('--update-baseline', action='store_true', help='Write the results as the new baseline')
+    parser.add_argument('--output', help='Also write the results to this file')
+    # Internal: measure a single page in this process and write its results to --result-file
+    parser.add_argument('--page', help=argparse.SUPPRESS)
+    parser.add_argument('--result-file', help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+# The app reads its settings from the environment when config is first imported
+def configure(data_dir, work_dir):
+    os.environ.update({
+        'BLT_SMART_EVENTS_BACKEND': 'DUCKDB',
+        'BLT_SMART_EVENTS_LOCAL_DATA_DIR': data_dir,
+        'BLT_SMART_EVENTS_AGGREGATE_STORE': '',
+        'BLT_SMART_EVENTS_TARGET': 'PROD',
+        'BLT_SMART_EVENTS_EVENT_ID': str(synthetic.TARGET_EVENT_ID),
+        'BLT_SMART_EVENTS_SIMILAR_EVENTS': '',
+        'BLT_SMART_EVENTS_GEOCODER': 'NONE',
+        'BLT_SMART_EVENTS_GAZETTEER_PATH': os.path.join(work_dir, 'gazetteer.sqlite'),
+    })
+    os.chdir(ROOT)
+
+
+def run_page(page, session, timeout):
+    from streamlit.testing.v1 import AppTest
+    app = AppTest.from_file(os.path.join(ROOT, page), default_timeout=timeout)
+    for key, value in session.items():
+        app.session_state[key] = value
+    app.run()
+    check(app, page)
+    return app
+
+
+def check(app, page):
+    if len(app.exception) > 0:
+        raise RuntimeError(f'{page} failed: {app.exception[0].message}')
+
+
+def timed(utils, run):
+    queries = utils.backend.query_count
+    start = time.perf_counter()
+    result = run()
+    return result, time.perf_counter() - start, utils.backend.query_count - queries
+
+
+# Empty every cache the process holds, as in a freshly started server: query results, memoized
+# figures, the similar events index, the gazetteer and aggregate store loaded in memory and the
+# backend connection with its buffers. Only the imported modules stay.
+def reset_caches(utils):
+    utils.query_cache.clear()
+    utils.charts.figure_cache.clear()
+    utils.similar_index.clear()
+    utils.gazetteer = utils.geocoding.Gazetteer(utils.config.GAZETTEER_PATH, utils.geocoding.create_geocoder())
+    if utils.aggregate_store is not None:
+        utils.aggregate_store = utils.aggregates.AggregateStore(utils.config.AGGREGATE_STORE)
+    utils.backend.close()
+    utils.backend = utils.backends.create_backend()
+
+
+# Peak resident set size of this process in bytes (ru_maxrss is in KiB on Linux, bytes on macOS)
+def max_rss_bytes():
+    import resource
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+# One cold run and the warm reruns of `page`, in this process. The main page is run first, for the
+# session state it leaves to the other pages and so that no measurement pays for the imports.
+def measure_page(utils, page, args):
+    app = run_page(PAGES[0], {}, args.timeout)
+    session = {key: app.session_state[key] for key in SESSION_KEYS} if page != PAGES[0] else {}
+
+    reset_caches(utils)
+    app, cold, cold_queries = timed(utils, lambda: run_page(page, session, args.timeout))
+    warm, warm_queries = [], 0
+    for _ in range(args.warm_runs):
+        _, seconds, queries = timed(utils, lambda: app.run())
+        check(app, page)
+        warm.append(seconds)
+        warm_queries += queries
+
+    # Python heap peak of a cold run, measured apart because tracing slows the run down. It leaves
+    # out the Arrow and DuckDB buffers, which the peak RSS of the process does count.
+    reset_caches(utils)
+    tracemalloc.start()
+    run_page(page, session, args.timeout)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'cold_seconds': cold,
+        'warm_seconds': warm,
+        'cold_queries': cold_queries,
+        'warm_queries': warm_queries // len(warm) if warm else None,
+        'python_heap_peak_bytes': peak,
+        'max_rss_bytes': max_rss_bytes(),
+    }
+
+
+# Measure `page` in a fresh process, so nothing of a previous run is left in memory
+def run_child(page, data_dir, args):
+    with tempfile.TemporaryDirectory(prefix='smart-events-bench-run-') as work_dir:
+        result_file = os.path.join(work_dir, 'result.json')
+        subprocess.run([sys.executable, os.path.abspath(__file__), '--page', page, '--data-dir', data_dir,
+                        '--warm-runs', str(args.warm_runs), '--timeout', str(args.timeout),
+                        '--result-file', result_file], check=True, stdout=subprocess.DEVNULL)
+        with open(result_file) as f:
+            return json.load(f)
+
+
+# Medians over the cold runs of a page. Query counts do not depend on timing, so the highest count
+# of any run is kept.
+def summarize(runs):
+    warm = [seconds for run in runs for seconds in run['warm_seconds']]
+    return {
+        'cold_seconds': round(statistics.median(run['cold_seconds'] for run in runs), 4),
+        'warm_seconds': round(statistics.median(warm), 4) if warm else None,
+        'cold_queries': max(run['cold_queries'] for run in runs),
+        'warm_queries': max(run['warm_queries'] for run in runs) if warm else None,
+        'python_heap_peak_bytes': int(statistics.median(run['python_heap_peak_bytes'] for run in runs)),
+        'max_rss_bytes': int(statistics.median(run['max_rss_bytes'] for run in runs)),
+    }
+
+
+# Regressions of `results` against `baseline`: slower or bigger than the tolerances allow, or any
+# query more than before. Latency depends on the load of the machine, so it gets the wider tolerance;
+# query counts are exact.
+def compare(results, baseline, time_tolerance, memory_tolerance):
+    failures = []
+    for page, current in results['pages'].items():
+        previous = baseline['pages'].get(page)
+        if previous is None:
+            continue
+        for metric, tolerance in [('cold_seconds', time_tolerance), ('warm_seconds', time_tolerance),
+                                  ('python_heap_peak_bytes', memory_tolerance), ('max_rss_bytes', memory_tolerance)]:
+            if previous.get(metric) and current.get(metric) and current[metric] > previous[metric] * (1 + tolerance):
+                failures.append(f'{page}: {metric} {current[metric]} > {previous[metric]} (+{tolerance:.0%})')
+        for metric in ['cold_queries', 'warm_queries']:
+            if previous.get(metric) is not None and current[metric] > previous[metric]:
+                failures.append(f'{page}: {metric} {current[metric]} > {previous[metric]}')
+    return failures
+
+
+def main():
+    args = parse_args()
+    if args.page is not None:
+        with tempfile.TemporaryDirectory(prefix='smart-events-bench-page-') as work_dir:
+            configure(os.path.abspath(args.data_dir), work_dir)
+            import utils
+            result = measure_page(utils, args.page, args)
+        with open(args.result_file, 'w') as f:
+            json.dump(result, f)
+        return 0
+
+    work_dir = tempfile.mkdtemp(prefix='smart-events-bench-')
+    data = {'events': args.events, 'bookings': args.bookings, 'seed': args.seed}
+    data_dir = args.data_dir
+    if data_dir is None:
+        data_dir = os.path.join(work_dir, 'data')
+        synthetic.generate(data_dir, **data)
+    data_dir = os.path.abspath(data_dir)
+
+    results = {
+        'data': data if args.data_dir is None else {'data_dir': data_dir},
+        'cold_runs': args.cold_runs,
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'pages': {},
+    }
+    for page in PAGES:
+        runs = [run_child(page, data_dir, args) for _ in range(args.cold_runs)]
+        results['pages'][page] = summarize(runs)
+        print(f'{page}: {json.dumps(results["pages"][page])}')
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+    if args.update_baseline:
+        with open(BASELINE, 'w') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f'Baseline written to {BASELINE}')
+        return 0
+    if not os.path.isfile(BASELINE):
+        print('No baseline yet, record one with --update-baseline')
+        return 0
+    with open(BASELINE) as f:
+        baseline = json.load(f)
+    if baseline.get('data') != results['data']:
+        print(f'The baseline was recorded with other data ({baseline.get("data")}), not comparing')
+        return 0
+    failures = compare(results, baseline, args.time_tolerance, args.memory_tolerance)
+    for failure in failures:
+        print(f'REGRESSION {failure}')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
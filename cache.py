@@ -0,0 +1,182 @@
+import hashlib
+import sys
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+import numpy as np
+import pandas as pd
+
+
+# Same query text regardless of indentation and line breaks
+def normalize_sql(sql):
+    return ' '.join(sql.split())
+
+
+def fingerprint(sql, params=()):
+    key = normalize_sql(sql) + '\x00' + repr(tuple(params))
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+# Approximate memory held by a cached value
+def sizeof(value):
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, (pd.Series, pd.Index)):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, np.ndarray):
+        return int(value.nbytes)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(sizeof(k) + sizeof(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(sizeof(v) for v in value)
+    if hasattr(value, 'to_plotly_json'):
+        # Plotly figures, sized by their JSON since their traces point back to the figure
+        return len(value.to_json())
+    if hasattr(value, '__dict__'):
+        # Objects built from frames and arrays, like the sales curves or an event context
+        return sys.getsizeof(value) + sizeof(vars(value))
+    return sys.getsizeof(value)
+
+
+# Partition of the results shared by several events (similar event cohorts)
+SHARED = 'shared'
+
+
+# Process-wide query result cache shared by all sessions.
+# Entries expire after their own TTL. Every entry belongs to a partition (an event, or SHARED for
+# cohort data) and once the cached results go over `max_bytes` the least recently used entry of
+# the largest partition is evicted, so one busy event cannot push every other event out.
+class QueryCache:
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = {}  # key -> (value, size, expires_at, partition)
+        self.partitions = {}  # partition -> keys of its entries, least recently used first
+        self.partition_bytes = defaultdict(int)
+        self.bytes = 0
+        self.inflight = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, default=None):
+        with self.lock:
+            return self._get(key, default)
+
+    def put(self, key, value, ttl, partition=SHARED):
+        size = sizeof(value)
+        with self.lock:
+            self._put(key, value, size, ttl, partition)
+
+    # Return the cached value for `key` or compute it with `load()`.
+    # Concurrent misses on the same key wait for a single load instead of repeating the query.
+    # Every call counts once: a hit, or a miss recorded before it waits, and the value it then
+    # gets from the load of another call also counts as coalesced.
+    def get_or_load(self, key, load, ttl, partition=SHARED):
+        missing = object()
+        waited = False
+        while True:
+            with self.lock:
+                value = self._lookup(key, missing)
+                if value is not missing:
+                    if waited:
+                        self.coalesced += 1
+                    else:
+                        self.hits += 1
+                    return value
+                if not waited:
+                    self.misses += 1
+                pending = self.inflight.get(key)
+                if pending is None:
+                    pending = self.inflight[key] = threading.Event()
+                    break
+            pending.wait()
+            waited = True
+
+        try:
+            value = load()
+            size = sizeof(value)
+            with self.lock:
+                self._put(key, value, size, ttl, partition)
+            return value
+        finally:
+            with self.lock:
+                del self.inflight[key]
+            pending.set()
+
+    def invalidate(self, key):
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.partitions.clear()
+            self.partition_bytes.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'partitions': len(self.partitions),
+            }
+
+    def _get(self, key, default):
+        missing = object()
+        value = self._lookup(key, missing)
+        if value is missing:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    # Cached value of `key`, or `default` when it is missing or expired, without counting the lookup
+    def _lookup(self, key, default):
+        entry = self.entries.get(key)
+        if entry is not None and entry[2] <= time.monotonic():
+            self._remove(key)
+            self.expirations += 1
+            entry = None
+        if entry is None:
+            return default
+        self.partitions[entry[3]].move_to_end(key)
+        return entry[0]
+
+    def _put(self, key, value, size, ttl, partition):
+        if size > self.max_bytes:
+            return
+        if key in self.entries:
+            self._remove(key)
+        self.entries[key] = (value, size, time.monotonic() + ttl, partition)
+        self.partitions.setdefault(partition, OrderedDict())[key] = None
+        self.partition_bytes[partition] += size
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            largest = max(self.partition_bytes, key=self.partition_bytes.get)
+            self._remove(next(iter(self.partitions[largest])))
+            self.evictions += 1
+
+    def _remove(self, key):
+        _, size, _, partition = self.entries.pop(key)
+        keys = self.partitions[partition]
+        del keys[key]
+        self.bytes -= size
+        self.partition_bytes[partition] -= size
+        if not keys:
+            del self.partitions[partition]
+            del self.partition_bytes[partition]
@@ -0,0 +1,56 @@
+import hashlib
+import json
+
+import pandas as pd
+import plotly.express as px
+import streamlit as st
+
+import cache
+import config
+
+# Figures of the pages, built from a declarative spec (plotly express function, its arguments and
+# the layout updates) and memoized by spec and data fingerprint. The cached Figure itself is handed to
+# st.plotly_chart, which only serializes it and never changes it, so a rerun with the same data
+# neither builds the figure again nor validates it back from JSON.
+
+TRANSPARENT = {
+    'plot_bgcolor': 'rgba(0, 0, 0, 0)',
+    'paper_bgcolor': 'rgba(0, 0, 0, 0)',
+}
+GRID_COLOR = 'rgba(0,0,0,0.1)'
+
+figure_cache = cache.QueryCache(config.CHART_CACHE_MAX_BYTES)
+
+
+# Hash of the columns, dtypes, index and values of a data frame
+def fingerprint(df):
+    digest = hashlib.sha1(repr([(str(c), str(t)) for c, t in df.dtypes.items()]).encode('utf-8'))
+    digest.update(pd.util.hash_pandas_object(df, index=True).values.tobytes())
+    return digest.hexdigest()
+
+
+# Figure of `px.<kind>(df, **arguments)` with the transparent background, `layout` on top of
+# it, the y axis grid unless `grid` is False, the `geos` updates of maps and the `traces` updates,
+# a list of (selector, updates) pairs such as ({'name': 'Percentil 90'}, {'fill': 'tonexty'})
+def figure(kind, df, layout=None, grid=True, geos=None, traces=None, **arguments):
+    spec = {'kind': kind, 'arguments': arguments, 'layout': layout, 'grid': grid, 'geos': geos,
+            'traces': traces}
+    key = ('figure', fingerprint(df), json.dumps(spec, sort_keys=True, default=str))
+
+    def build():
+        fig = getattr(px, kind)(df, **arguments)
+        fig.update_layout({**TRANSPARENT, **(layout or {})})
+        if grid:
+            fig.update_yaxes(gridcolor=GRID_COLOR)
+        if geos:
+            fig.update_geos(geos)
+        for selector, updates in traces or []:
+            fig.update_traces(updates, selector=selector)
+        return fig
+
+    return figure_cache.get_or_load(key, build, float('inf'))
+
+
+def plotly_chart(kind, df, layout=None, grid=True, geos=None, traces=None, **arguments):
+    fig = figure(kind, df, layout=layout, grid=grid, geos=geos, traces=traces, **arguments)
+    st.plotly_chart(fig, use_container_width=True)
@@ -9,6 +9,71 @@ WAREHOUSE = str(os.getenv("SNOWFLAKE_WAREHOUSE", ''))
 DATABASE = str(os.getenv("SNOWFLAKE_DATABASE", ''))
 SCHEMA = str(os.getenv("SNOWFLAKE_SCHEMA", ''))
 
+# Data backend: SNOWFLAKE for the warehouse, DUCKDB to serve the same tables from local Parquet files
+
+BACKEND = str(os.getenv("BLT_SMART_EVENTS_BACKEND", 'SNOWFLAKE'))
+LOCAL_DATA_DIR = str(os.getenv("BLT_SMART_EVENTS_LOCAL_DATA_DIR", 'data'))
+
+# Local store of per-event aggregates written by aggregates.py, the loaders read from it when set
+
+AGGREGATE_STORE = str(os.getenv("BLT_SMART_EVENTS_AGGREGATE_STORE", ''))
+AGGREGATE_BUCKETS = int(os.getenv("BLT_SMART_EVENTS_AGGREGATE_BUCKETS", "64"))
+
+# Roll the funnel by medium up from the funnel by source/medium instead of reading its own table
+
+FUNNEL_MEDIUM_ROLLUP = os.getenv("BLT_SMART_EVENTS_FUNNEL_MEDIUM_ROLLUP", "1") not in ('0', 'false', 'False')
+
+# Snowflake connection pool shared by all the sessions of the process (timeouts in seconds)
+
+POOL_SIZE = int(os.getenv("BLT_SMART_EVENTS_POOL_SIZE", "8"))
+POOL_IDLE_TIMEOUT = float(os.getenv("BLT_SMART_EVENTS_POOL_IDLE_TIMEOUT", "600"))
+POOL_CHECKOUT_TIMEOUT = float(os.getenv("BLT_SMART_EVENTS_POOL_CHECKOUT_TIMEOUT", "30"))
+POOL_HEALTH_CHECK_INTERVAL = float(os.getenv("BLT_SMART_EVENTS_POOL_HEALTH_CHECK_INTERVAL", "60"))
+
+# Ceiling of a single query result (0 for no limit). Results are fetched in Arrow batches and
+# a query that goes over either limit fails instead of filling the memory of the process
+
+MAX_QUERY_ROWS = int(os.getenv("BLT_SMART_EVENTS_MAX_QUERY_ROWS", "5000000"))
+MAX_QUERY_BYTES = int(os.getenv("BLT_SMART_EVENTS_MAX_QUERY_BYTES", str(1024 * 1024 * 1024)))
+
+# Query result cache: default TTL in seconds and memory budget in bytes for all the cached results
+
+CACHE_TTL = float(os.getenv("BLT_SMART_EVENTS_CACHE_TTL", "900"))
+CACHE_MAX_BYTES = int(os.getenv("BLT_SMART_EVENTS_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+# Memory budget in bytes for the figures memoized by charts.py
+
+CHART_CACHE_MAX_BYTES = int(os.getenv("BLT_SMART_EVENTS_CHART_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# Seconds between rebuilds of the in-memory similar events index
+SIMILAR_INDEX_REFRESH = float(os.getenv("BLT_SMART_EVENTS_SIMILAR_INDEX_REFRESH", "3600"))
+
+# Geocoding of the buyers' cities: local gazetteer file and the geocoder used for the cities
+# it does not know yet (NOMINATIM, or NONE to work fully offline)
+
+GAZETTEER_PATH = str(os.getenv("BLT_SMART_EVENTS_GAZETTEER_PATH", 'gazetteer.sqlite'))
+GEOCODER = str(os.getenv("BLT_SMART_EVENTS_GEOCODER", 'NOMINATIM'))
+GEOCODE_MIN_INTERVAL = float(os.getenv("BLT_SMART_EVENTS_GEOCODE_MIN_INTERVAL", "1.0"))
+
+# Most markers drawn on the buyers' map, nearby cities are grouped beyond it
+
+MAP_MAX_MARKERS = int(os.getenv("BLT_SMART_EVENTS_MAP_MAX_MARKERS", "300"))
+
+# Threads used to run the queries of a page concurrently
+PREFETCH_WORKERS = int(os.getenv("BLT_SMART_EVENTS_PREFETCH_WORKERS", "8"))
+
+# Cache prewarming at process start: a comma separated list of event IDs, ON_SALE for every event
+# on sale, or empty to disable it. With an interval (seconds) the events are warmed again on that
+# schedule, it should be shorter than CACHE_TTL to keep them warm.
+
+PREWARM_EVENTS = str(os.getenv("BLT_SMART_EVENTS_PREWARM_EVENTS", ''))
+PREWARM_WORKERS = int(os.getenv("BLT_SMART_EVENTS_PREWARM_WORKERS", "4"))
+PREWARM_INTERVAL = float(os.getenv("BLT_SMART_EVENTS_PREWARM_INTERVAL", "0"))
+
+# Port of the Prometheus /metrics endpoint served in PROD, only when set (unset or 0: no endpoint)
+
+METRICS_PORT = int(os.getenv("BLT_SMART_EVENTS_METRICS_PORT") or "0")
+
 # Environment variables for controlling whether this is a production deployment
 
 TARGET = str(os.getenv("BLT_SMART_EVENTS_TARGET", 'DEV'))
@@ -16,10 +81,17 @@ EVENT_ID = str(os.getenv("BLT_SMART_EVENTS_EVENT_ID", ''))
 PRICE_RANGE = float(os.getenv("BLT_SMART_EVENTS_PRICE_RANGE", "0.1"))
 SIMILAR_EVENTS = str(os.getenv("BLT_SMART_EVENTS_SIMILAR_EVENTS", ''))
 
+# Multi-event mode (PROD and DEMO): one process serves any event, chosen with ?event_id=<id> in the URL
+# or, when a secret is set, only with a signed ?token=<id>.<signature> (see access.py)
+
+MULTI_EVENT = os.getenv("BLT_SMART_EVENTS_MULTI_EVENT", "0") in ('1', 'true', 'True')
+EVENT_TOKEN_SECRET = str(os.getenv("BLT_SMART_EVENTS_EVENT_TOKEN_SECRET", ''))
+
 # Constants
 ORANGE = '#FF8766'
 BLUE = '#5E9FEC'
 ORANGE_TRANS = '#FFDAD1'
+BLUE_TRANS = '#CFE2F9'
 GREY_LIGHT = '#353F48'
 WHITE1 = '#FAFAFA'
 GREY_DARK = '#545763'
@@ -0,0 +1,22 @@
+from types import MappingProxyType
+
+
+# What the pages know about the event of a session: its metadata, the similar events and, in DEV,
+# the superset of similar events of the widest price band. A context is built once per event and
+# price threshold and shared by every session viewing that event, so it is never modified after it
+# is built: the metadata is a read-only mapping, the IDs are tuples and pages must not change the
+# similar events frame in place.
+class EventContext:
+
+    def __init__(self, event_id, price_threshold, event_data, similar_events, similar_superset=None):
+        self.event_id = str(event_id)
+        self.price_threshold = price_threshold
+        self.event_data = MappingProxyType(dict(event_data)) if event_data is not None else None
+        self.similar_events = similar_events
+        self.similar_ids = tuple(similar_events['EVENT_ID'].astype(str))
+        self.similar_superset = tuple(similar_superset) if similar_superset is not None else None
+
+    # The context is only valid for the event and price threshold it was built for
+    @property
+    def key(self):
+        return self.event_id, self.price_threshold
@@ -0,0 +1,81 @@
+import numpy as np
+import pandas as pd
+
+# Days since the start of the sale covered by the bookings cube (DIAS_A_LA_VENTA 0 to 180)
+DAYS = 181
+PERCENTILES = [10, 50, 90]
+
+
+# Dense (event x day) matrix of cumulative sales curves built once from daily bookings
+# (DIAS_A_LA_VENTA, COMPRAS and optionally a group column such as EVENT_ID). Every curve is the share
+# of the event's bookings in the window sold by each day, in %, so events of any size weigh the same.
+# Percentile bands and the position of an event within a cohort are computed with array operations.
+class SalesCurves:
+
+    def __init__(self, events, curves, last_days):
+        self.events = pd.Index(events)
+        self.curves = curves
+        self.last_days = last_days
+
+    @classmethod
+    def from_frame(cls, df, group_by='EVENT_ID', days=DAYS, name='Este evento'):
+        if group_by is None:
+            event = np.zeros(len(df), dtype=np.intp)
+            events = [name]
+        else:
+            event, events = pd.factorize(df[group_by], sort=True)
+        day = df['DIAS_A_LA_VENTA'].astype('float64').to_numpy()
+        bookings = pd.to_numeric(df['COMPRAS'], errors='coerce').fillna(0).to_numpy(dtype=np.float64)
+        valid = (event >= 0) & (day >= 0) & (day < days)
+        sales = np.bincount(event[valid] * days + day[valid].astype(np.intp), weights=bookings[valid],
+                            minlength=len(events) * days).reshape(len(events), days)
+        cumulative = sales.cumsum(axis=1)
+        totals = cumulative[:, -1]
+        sold = totals > 0
+        curves = cumulative[sold] * 100.0 / totals[sold, None]
+        # Last day with sales, the curve of an event still on sale is not drawn past it
+        last_days = days - 1 - np.argmax(sales[sold, ::-1] > 0, axis=1)
+        return cls(np.asarray(events)[sold], curves, last_days)
+
+    def __len__(self):
+        return len(self.events)
+
+    @property
+    def days(self):
+        return self.curves.shape[1]
+
+    # Curves of the first `day` + 1 days, each one as the share of what the event had sold by `day`,
+    # so a cohort of finished events compares like-for-like with an event still on sale. Events
+    # without sales by then are left out.
+    def truncated(self, day):
+        day = min(int(day), self.days - 1)
+        sold = self.curves[:, day] > 0
+        curves = self.curves[sold, :day + 1] * 100.0 / self.curves[sold, day, None]
+        return SalesCurves(self.events[sold], curves, np.minimum(self.last_days[sold], day))
+
+    # Percentiles of the curves on every day, one row per percentile
+    def bands(self, percentiles=PERCENTILES):
+        return np.percentile(self.curves, percentiles, axis=0)
+
+    # First day by which each event had sold half of its bookings
+    def half_sold_days(self):
+        return np.argmax(self.curves >= 50, axis=1)
+
+    # Share of the events that took longer than `day` to sell half of their bookings, in %
+    def slower_than(self, day):
+        return float(np.mean(self.half_sold_days() > day) * 100) if len(self) else 0.0
+
+    # Data for the sales curves chart: the p10 and p90 band and the median of the cohort, plus
+    # the curve of `event` (the first curve of another SalesCurves) up to its last day with sales
+    def plot_frame(self, event=None):
+        low, median, high = self.bands()
+        days = np.arange(self.days)
+        parts = [pd.DataFrame({'DIAS_A_LA_VENTA': days, 'VENTAS': values, 'CURVA': label})
+                 for label, values in [('Percentil 10', low), ('Percentil 90', high), ('Mediana de similares', median)]]
+        if event is not None and len(event) > 0:
+            last_day = event.last_days[0]
+            parts.append(pd.DataFrame({'DIAS_A_LA_VENTA': days[:last_day + 1],
+                                       'VENTAS': event.curves[0, :last_day + 1], 'CURVA': 'Este evento'}))
+        df = pd.concat(parts, ignore_index=True)
+        df['VENTAS'] = df['VENTAS'].round(2)
+        return df
@@ -0,0 +1,91 @@
+import logging
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = ['EVENT_ID', 'NAME', 'SUBCATEGORY', 'CITY', 'STATE', 'AVERAGE_TICKET_PRICE', 'CHANNEL_TYPE']
+
+
+# In-process index of the events that can be used as similar events (finished and with sales).
+# Events are grouped by (SUBCATEGORY, CHANNEL_TYPE) and sorted by average ticket price, so the
+# price band of a lookup is found with two binary searches instead of a warehouse self-join.
+# `load` returns the candidate events; the index is rebuilt in the background every
+# `refresh_interval` seconds while lookups keep using the previous version.
+class SimilarEventsIndex:
+
+    def __init__(self, load, refresh_interval=3600):
+        self.load = load
+        self.refresh_interval = refresh_interval
+        self.groups = None
+        self.loaded_at = 0.0
+        self.refreshing = False
+        self.lock = threading.Lock()
+        self.first_load = threading.Lock()
+
+    def build(self, df):
+        df = df.dropna(subset=['SUBCATEGORY', 'CHANNEL_TYPE', 'AVERAGE_TICKET_PRICE'])
+        df = df.astype({'AVERAGE_TICKET_PRICE': float}).sort_values('AVERAGE_TICKET_PRICE', kind='stable')
+        groups = {}
+        for key, group in df.groupby(['SUBCATEGORY', 'CHANNEL_TYPE'], sort=False):
+            group = group[COLUMNS].reset_index(drop=True)
+            groups[key] = (group['AVERAGE_TICKET_PRICE'].to_numpy(), group)
+        return groups
+
+    def refresh(self):
+        groups = self.build(self.load())
+        with self.lock:
+            self.groups = groups
+            self.loaded_at = time.monotonic()
+            self.refreshing = False
+
+    # Forget the loaded index, the next lookup loads it again
+    def clear(self):
+        with self.lock:
+            self.groups = None
+            self.loaded_at = 0.0
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh()
+        except Exception:
+            logger.exception('Could not refresh the similar events index')
+            with self.lock:
+                self.refreshing = False
+
+    def current(self):
+        with self.lock:
+            groups = self.groups
+            stale = time.monotonic() - self.loaded_at > self.refresh_interval
+            if groups is not None and stale and not self.refreshing:
+                self.refreshing = True
+                threading.Thread(target=self._refresh_in_background,
+                                 name='similar-events-index', daemon=True).start()
+        if groups is None:
+            # First lookup of the process waits for the index, loaded only once
+            with self.first_load:
+                with self.lock:
+                    groups = self.groups
+                if groups is None:
+                    self.refresh()
+                    with self.lock:
+                        groups = self.groups
+        return groups
+
+    # Events with the same subcategory and channel type whose average ticket price is within
+    # +/- price_threshold of `price`, leaving out `exclude_id`
+    def lookup(self, subcategory, channel_type, price, price_threshold, exclude_id=None):
+        entry = self.current().get((subcategory, channel_type))
+        if entry is None or price is None or pd.isna(price):
+            return pd.DataFrame(columns=COLUMNS)
+        prices, events = entry
+        price = float(price)
+        low = np.searchsorted(prices, price * (1.0 - price_threshold), side='left')
+        high = np.searchsorted(prices, price * (1.0 + price_threshold), side='right')
+        df = events.iloc[low:high]
+        if exclude_id is not None:
+            df = df[df['EVENT_ID'].astype(str) != str(exclude_id)]
+        return df.reset_index(drop=True)
@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+import schemas
+
+# Funnel stages in order, as defined by the funnel schemas
+STAGES = list(schemas.STAGES.categories)
+
+
+# Dense (group x stage) matrix of pageviews built once from a funnel table
+# (PAGE_PATH, PAGEVIEWS and optionally a group column such as MEDIUM or SOURCE_MEDIUM).
+# Counts and conversion rates of every group are computed with array operations.
+class FunnelMatrix:
+
+    def __init__(self, groups, counts, rows):
+        self.groups = pd.Index(groups)
+        self.counts = counts
+        self.rows = rows
+        self.positions = {group: i for i, group in enumerate(self.groups)}
+
+    @classmethod
+    def from_frame(cls, df, group_by=None, name='General'):
+        stage = pd.Categorical(df['PAGE_PATH'], categories=STAGES).codes
+        if group_by is None:
+            group = np.zeros(len(df), dtype=np.intp)
+            groups = [name]
+        else:
+            group, groups = pd.factorize(df[group_by], sort=False)
+        valid = (stage >= 0) & (group >= 0)
+        counts = np.zeros((len(groups), len(STAGES)), dtype=np.int64)
+        pageviews = pd.to_numeric(df['PAGEVIEWS'], errors='coerce').fillna(0).to_numpy(dtype=np.int64)
+        np.add.at(counts, (group[valid], stage[valid]), pageviews[valid])
+        rows = np.bincount(group[group >= 0], minlength=len(groups))
+        return cls(groups, counts, rows)
+
+    def position(self, group):
+        return self.positions[group]
+
+    # Users that start the funnel (Inicio) and that finish it (Pago)
+    @property
+    def users(self):
+        return self.counts[:, 0]
+
+    @property
+    def sales(self):
+        return self.counts[:, -1]
+
+    # Share of the users of each stage over the users that started the funnel, in %
+    def stage_percentages(self):
+        users = self.users[:, None].astype(float)
+        return np.divide(self.counts * 100.0, users, out=np.zeros(self.counts.shape), where=users > 0)
+
+    # Pago / Inicio, in %
+    def conversion_rates(self):
+        return self.stage_percentages()[:, -1]
+
+    # Numeric funnel table: one row per group with the users of every stage and the
+    # conversion rate ('Tasa de conversión', in %). Formatting is left to the page that shows it.
+    def table(self):
+        df = pd.DataFrame(self.counts, index=self.groups.copy(), columns=STAGES)
+        df['Tasa de conversión'] = self.conversion_rates()
+        return df
+
+    # Data for the funnel bar chart of a group: the users of every stage ('Etapa actual') plus
+    # the users lost since the previous stage stacked on top ('Diferencia con etapa anterior')
+    def plot_frame(self, position):
+        counts = self.counts[position]
+        return pd.DataFrame({
+            'PAGE_PATH': STAGES + STAGES[1:],
+            'PAGEVIEWS': np.concatenate([counts, counts[:-1] - counts[1:]]),
+            'DATOS': ['Etapa actual'] * len(STAGES) + ['Diferencia con etapa anterior'] * (len(STAGES) - 1),
+        })
@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+
+# Level of detail of the buyers' map: the located cities of an event are snapped to a lat/lon grid,
+# with the finest cell size that keeps the markers within a budget, so the map payload does not
+# grow with the number of cities. Drilling down to a country or a state keeps fewer cities, which
+# then fit in finer cells, down to one marker per city.
+
+# Cell sizes in degrees, from the finest
+CELL_SIZES = [0.1 * 2 ** i for i in range(12)]
+
+
+# Rows of `df` in the drill-down selection: a country and, within it, a state (None for all)
+def drill_down(df, country=None, state=None):
+    if country is not None:
+        df = df[df['COUNTRY'].astype(str) == country]
+        if state is not None:
+            df = df[df['STATE'].astype(str) == state]
+    return df
+
+
+def cell_codes(lat, lon, size):
+    rows = np.floor((lat + 90) / size).astype('int64')
+    cols = np.floor((lon + 180) / size).astype('int64')
+    return rows * (int(np.ceil(360 / size)) + 1) + cols
+
+
+# Markers for a frame with CITY, LAT, LON and TOTAL_BOOKINGS: at most `max_markers`, each one at the
+# bookings weighted center of its cities, labeled with its top city and how many more it holds
+def cluster(df, max_markers):
+    points = df.dropna(subset=['LAT', 'LON']).sort_values('TOTAL_BOOKINGS', ascending=False, kind='stable')
+    lat = points['LAT'].to_numpy(dtype=float)
+    lon = points['LON'].to_numpy(dtype=float)
+    cells = np.arange(len(points))
+    if len(points) > max_markers:
+        for size in CELL_SIZES:
+            cells = cell_codes(lat, lon, size)
+            if len(np.unique(cells)) <= max_markers:
+                break
+
+    bookings = points['TOTAL_BOOKINGS'].to_numpy()
+    weights = np.clip(bookings.astype(float), 1, None)
+    markers = pd.DataFrame({
+        'CELL': cells,
+        'CITY': points['CITY'].astype(str).to_numpy(),
+        'WEIGHT': weights,
+        'LAT': lat * weights,
+        'LON': lon * weights,
+        'TOTAL_BOOKINGS': bookings,
+    }).groupby('CELL', sort=False).agg(
+        LABEL=('CITY', 'first'),
+        CITIES=('CITY', 'size'),
+        WEIGHT=('WEIGHT', 'sum'),
+        LAT=('LAT', 'sum'),
+        LON=('LON', 'sum'),
+        TOTAL_BOOKINGS=('TOTAL_BOOKINGS', 'sum'),
+    ).reset_index(drop=True)
+    markers['LAT'] /= markers['WEIGHT']
+    markers['LON'] /= markers['WEIGHT']
+    grouped = markers['CITIES'] > 1
+    markers.loc[grouped, 'LABEL'] = markers.loc[grouped, 'LABEL'] + ' y ' + \
+        (markers.loc[grouped, 'CITIES'] - 1).astype(str) + ' más'
+    return markers[['LABEL', 'LAT', 'LON', 'TOTAL_BOOKINGS', 'CITIES']]
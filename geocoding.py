@@ -0,0 +1,195 @@
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+import unicodedata
+from contextlib import contextmanager
+
+import pandas as pd
+import config
+
+logger = logging.getLogger(__name__)
+
+SEED_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'resources', 'gazetteer_seed.csv')
+
+
+# Lookup key for a city or country name: lower case, no accents, single spaces
+def normalize_place(names):
+    names = pd.Series(names, dtype='object').fillna('').astype(str)
+    names = names.map(lambda name: unicodedata.normalize('NFKD', name)
+                      .encode('ascii', 'ignore').decode('ascii'))
+    return names.str.lower().str.split().str.join(' ')
+
+
+# Geocoder that never resolves anything, for fully offline deployments
+class OfflineGeocoder:
+
+    def geocode(self, city, country):
+        return None
+
+
+# Nominatim (OpenStreetMap) geocoder, limited to one request every `min_interval` seconds
+# as required by its usage policy
+class NominatimGeocoder:
+
+    def __init__(self, min_interval=1.0):
+        from geopy.geocoders import Nominatim
+        self.geolocator = Nominatim(user_agent='Boletia_GA')
+        self.min_interval = min_interval
+        self.last_request = 0.0
+
+    def geocode(self, city, country):
+        wait = self.last_request + self.min_interval - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        self.last_request = time.monotonic()
+        location = self.geolocator.geocode(f'{city}, {country}', addressdetails=True)
+        if not location:
+            return None
+        address = location.raw.get('address', {})
+        return location.latitude, location.longitude, address.get('state')
+
+
+def create_geocoder(name=None):
+    name = (name or config.GEOCODER).upper()
+    if name == 'NOMINATIM':
+        return NominatimGeocoder(config.GEOCODE_MIN_INTERVAL)
+    if name == 'NONE':
+        return OfflineGeocoder()
+    raise ValueError(f"Unknown geocoder '{name}', expected NOMINATIM or NONE")
+
+
+# Persistent city/country -> lat/lon table (SQLite), seeded from a bundled CSV.
+# Lookups are a single merge against an in-memory copy of the table; cities that are not in it
+# are queued and resolved in the background by the geocoder, so they show up on a later rerun.
+class Gazetteer:
+
+    def __init__(self, path, geocoder, seed_file=SEED_FILE, retry_after=7 * 24 * 3600):
+        self.path = path
+        self.geocoder = geocoder
+        self.retry_after = retry_after
+        self.lock = threading.Lock()
+        self.pending = queue.Queue()
+        self.queued = set()
+        self.worker = None
+        with self.connect() as con:
+            con.execute("""create table if not exists places (
+                            city_key text not null,
+                            country_key text not null,
+                            city text,
+                            country text,
+                            state text,
+                            lat real,
+                            lon real,
+                            updated_at real,
+                            primary key (city_key, country_key))""")
+            empty = con.execute('select count(*) from places').fetchone()[0] == 0
+        if empty and seed_file and os.path.isfile(seed_file):
+            self.seed(pd.read_csv(seed_file))
+        with self.connect() as con:
+            self.places = pd.read_sql_query(
+                'select city_key, country_key, state, lat, lon, updated_at from places', con)
+
+    @contextmanager
+    def connect(self):
+        con = sqlite3.connect(self.path, timeout=30)
+        try:
+            with con:
+                yield con
+        finally:
+            con.close()
+
+    def seed(self, df):
+        rows = self._rows(df['CITY'], df['COUNTRY'], df.get('STATE'), df['LAT'], df['LON'], 0.0)
+        with self.connect() as con:
+            con.executemany('insert or ignore into places values (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+
+    # Add LAT, LON (and STATE when known) to a frame with CITY and COUNTRY columns
+    def locate(self, df):
+        keys = pd.DataFrame({
+            'city_key': normalize_place(df['CITY']).values,
+            'country_key': normalize_place(df['COUNTRY']).values,
+        }, index=df.index)
+        with self.lock:
+            places = self.places
+        found = keys.merge(places, on=['city_key', 'country_key'], how='left')
+        found.index = df.index
+
+        located = df.copy()
+        located['LAT'] = found['lat'].astype(float)
+        located['LON'] = found['lon'].astype(float)
+        if 'STATE' not in located:
+            located['STATE'] = found['state']
+
+        # Unknown cities, and misses old enough to be retried
+        retry = found['updated_at'].notna() & found['lat'].isna() & \
+            (found['updated_at'] < time.time() - self.retry_after)
+        missing = found['updated_at'].isna() | retry
+        if missing.any():
+            self.enqueue(df.loc[missing, ['CITY', 'COUNTRY']].drop_duplicates())
+        return located
+
+    def enqueue(self, df):
+        with self.lock:
+            for city, country in df.itertuples(index=False):
+                key = (city, country)
+                if key not in self.queued:
+                    self.queued.add(key)
+                    self.pending.put(key)
+            if self.worker is None:
+                self.worker = threading.Thread(target=self._resolve_pending, name='geocoder', daemon=True)
+                self.worker.start()
+
+    def _resolve_pending(self):
+        while True:
+            try:
+                city, country = self.pending.get(timeout=5)
+            except queue.Empty:
+                with self.lock:
+                    if self.pending.empty():
+                        self.worker = None
+                        return
+                continue
+            try:
+                result = self.geocoder.geocode(city, country)
+            except Exception as e:
+                # Network errors are not recorded, the city is retried on the next page view
+                logger.warning('Geocoding %s, %s failed: %s', city, country, e)
+                with self.lock:
+                    self.queued.discard((city, country))
+                continue
+            if result is None and isinstance(self.geocoder, OfflineGeocoder):
+                with self.lock:
+                    self.queued.discard((city, country))
+                continue
+            lat, lon, state = result if result else (None, None, None)
+            self._store(city, country, state, lat, lon)
+
+    def _store(self, city, country, state, lat, lon):
+        rows = self._rows([city], [country], [state], [lat], [lon], time.time())
+        with self.connect() as con:
+            con.executemany('insert or replace into places values (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+        row = pd.DataFrame([{
+            'city_key': rows[0][0], 'country_key': rows[0][1], 'state': state,
+            'lat': lat, 'lon': lon, 'updated_at': rows[0][7]}])
+        with self.lock:
+            places = self.places[(self.places['city_key'] != rows[0][0]) |
+                                 (self.places['country_key'] != rows[0][1])]
+            self.places = pd.concat([places, row], ignore_index=True)
+            self.queued.discard((city, country))
+
+    def _rows(self, cities, countries, states, lats, lons, updated_at):
+        cities = list(cities)
+        countries = list(countries)
+        states = list(states) if states is not None else [None] * len(cities)
+        city_keys = normalize_place(cities)
+        country_keys = normalize_place(countries)
+        return [(city_key, country_key, city, country,
+                 None if pd.isna(state) else state,
+                 None if pd.isna(lat) else float(lat),
+                 None if pd.isna(lon) else float(lon),
+                 updated_at)
+                for city_key, country_key, city, country, state, lat, lon
+                in zip(city_keys, country_keys, cities, countries, states, lats, lons)]
@@ -1,22 +1,38 @@
 import streamlit as st
 import pandas as pd
-import plotly.express as px
+import charts
+import geoclusters
 import utils
 import config
 
 utils.load_css()
-utils.draw_header()
-
-event_id = st.session_state["event_id"]
-event_data = st.session_state["event_data"]
-similar_events = st.session_state["similar_events"]
+ctx = utils.event_context()
+utils.draw_header(ctx)
+
+event_id = ctx.event_id
+similar_ids = ctx.similar_ids
+similar_superset = ctx.similar_superset
+
+# Fetch all the data of the page concurrently
+page_data = utils.prefetch({
+    "bookings_by_city": (utils.load_bookings_by_city, event_id),
+    "customers_by_age": (utils.load_customers_by_age, [event_id]),
+    "similar_customers_by_age": (utils.load_similar_aggregate, utils.load_customers_by_age,
+                                 similar_ids, ["AGE_BRACKET"], similar_superset),
+    "customers_by_gender": (utils.load_customers_by_gender, [event_id]),
+    "similar_customers_by_gender": (utils.load_similar_aggregate, utils.load_customers_by_gender,
+                                    similar_ids, ["GENDER"], similar_superset),
+    "customers_by_gender_age": (utils.load_customers_by_gender_age, [event_id]),
+    "similar_customers_by_gender_age": (utils.load_similar_aggregate, utils.load_customers_by_gender_age,
+                                        similar_ids, ["GENDER", "AGE_BRACKET"], similar_superset),
+})
 
 # SALES MAP
 cities_container = st.container()
 with cities_container:
     st.subheader('Ubicación de los compradores')
     st.caption('Mapa de tus compradores por ubicación geográfica')
-    data = utils.load_bookings_by_city(event_id)
+    data = page_data["bookings_by_city"]
     data = utils.get_coordinates(data)
 
     # Metrics
@@ -40,21 +56,27 @@ with cities_container:
     info_3.caption(
         'Total de países desde donde se han comprado boletos para el evento')
 
+    # Drill-down from country to state, nearby cities are grouped to keep the map within the markers budget
+    map_1, map_2 = st.columns(2, gap="small")
+    countries = sorted(data['COUNTRY'].dropna().astype(str).unique())
+    country = map_1.selectbox('País', ['Todos'] + countries, key='map_country')
+    country = None if country == 'Todos' else country
+    states = sorted(geoclusters.drill_down(data, country)['STATE'].dropna().astype(str).unique()) \
+        if country is not None else []
+    state = map_2.selectbox('Estado', ['Todos'] + states, key='map_state', disabled=country is None)
+    state = None if state == 'Todos' else state
+    markers = geoclusters.cluster(geoclusters.drill_down(data, country, state), config.MAP_MAX_MARKERS)
+
     # Visualization
-    if len(data) > 0:
-        fig = px.scatter_geo(data, lat='LAT', lon='LON', size='TOTAL_BOOKINGS',
-                             hover_name='CITY', hover_data={'LAT': False, 'LON': False}, size_max=18,
-                             color_discrete_sequence=[config.ORANGE],
-                             labels={'TOTAL_BOOKINGS': 'COMPRAS'},
-                             fitbounds="geojson",
-                             )
-        fig.update_geos(showcountries=True, showsubunits=True)
-        fig.update_layout({
-            'plot_bgcolor': 'rgba(0, 0, 0, 0)',
-            'paper_bgcolor': 'rgba(0, 0, 0, 0)',
-            'margin': {"r": 0, "t": 0, "l": 0, "b": 0}
-        })
-        st.plotly_chart(fig, use_container_width=True)
+    if len(markers) > 0:
+        charts.plotly_chart('scatter_geo', markers, lat='LAT', lon='LON', size='TOTAL_BOOKINGS',
+                            hover_name='LABEL', hover_data={'LAT': False, 'LON': False, 'CITIES': True}, size_max=18,
+                            color_discrete_sequence=[config.ORANGE],
+                            labels={'TOTAL_BOOKINGS': 'COMPRAS', 'CITIES': 'CIUDADES'},
+                            fitbounds="geojson",
+                            layout={'margin': {"r": 0, "t": 0, "l": 0, "b": 0}},
+                            grid=False,
+                            geos=dict(showcountries=True, showsubunits=True))
     else:
         st.warning("No hay datos en este momento.")
 
@@ -62,15 +84,12 @@ with cities_container:
 age_container = st.container()
 with age_container:
     st.subheader('Edades')
-    data = utils.load_customers_by_age([event_id])
-    similar_data = utils.load_customers_by_age(
-        similar_events["EVENT_ID"].astype(str).values.tolist())
-    comp_data = utils.join_data(data.copy(), similar_data.copy())
+    data = page_data["customers_by_age"]
+    similar_data = page_data["similar_customers_by_age"]
 
-    t1, t2, t3 = st.tabs(
-        ["Este evento", "Eventos similares", "Comparativa"])
+    view = utils.section_view('view_age')
 
-    with t1:
+    if view == "Este evento":
         total = data['TOTAL_BOOKINGS'].sum()
         if len(data["TOTAL_BOOKINGS"] > 0):
             best = f'{data.iloc[data["TOTAL_BOOKINGS"].idxmax(), :]["AGE_BRACKET"]} años'
@@ -98,19 +117,13 @@ with age_container:
 
         # Visualization
         if len(data) > 0:
-            fig = px.histogram(data, x="AGE_BRACKET", y="TOTAL_BOOKINGS", orientation='v',
-                               color='AGE_BRACKET',
-                               labels={'AGE_BRACKET': 'RANGOS DE EDAD', 'TOTAL_BOOKINGS': 'COMPRAS'})
-            fig.update_layout({
-                'plot_bgcolor': 'rgba(0, 0, 0, 0)',
-                'paper_bgcolor': 'rgba(0, 0, 0, 0)',
-            })
-            fig.update_yaxes(gridcolor="rgba(0,0,0,0.1)")
-            st.plotly_chart(fig, use_container_width=True)
+            charts.plotly_chart('histogram', data, x="AGE_BRACKET", y="TOTAL_BOOKINGS", orientation='v',
+                                color='AGE_BRACKET',
+                                labels={'AGE_BRACKET': 'RANGOS DE EDAD', 'TOTAL_BOOKINGS': 'COMPRAS'})
         else:
             st.warning("No hay datos en este momento.")
 
-    with t2:
+    elif view == "Eventos similares":
         # Metrics
         total = similar_data['TOTAL_BOOKINGS'].sum()
         best = f'{similar_data.iloc[similar_data["TOTAL_BOOKINGS"].idxmax(), :]["AGE_BRACKET"]} años'
@@ -132,29 +145,18 @@ with age_container:
 
         # Visualization
         if len(similar_data) > 0:
-            fig = px.histogram(similar_data, x="AGE_BRACKET", y="TOTAL_BOOKINGS", orientation='v',
-                               color='AGE_BRACKET',
-                               labels={'AGE_BRACKET': 'RANGOS DE EDAD', 'TOTAL_BOOKINGS': 'COMPRAS'})
-            fig.update_layout({
-                'plot_bgcolor': 'rgba(0, 0, 0, 0)',
-                'paper_bgcolor': 'rgba(0, 0, 0, 0)',
-            })
-            fig.update_yaxes(gridcolor="rgba(0,0,0,0.1)")
-            st.plotly_chart(fig, use_container_width=True)
+            charts.plotly_chart('histogram', similar_data, x="AGE_BRACKET", y="TOTAL_BOOKINGS", orientation='v',
+                                color='AGE_BRACKET',
+                                labels={'AGE_BRACKET': 'RANGOS DE EDAD', 'TOTAL_BOOKINGS': 'COMPRAS'})
         else:
             st.warning("No hay datos en este momento.")
             st.empty()
 
-    with t3:
+    else:
+        comp_data = utils.join_data(data.copy(), similar_data.copy())
         if len(comp_data) > 0:
-            fig = px.histogram(comp_data, x="AGE_BRACKET", y="TOTAL_BOOKINGS", facet_col="EVENTO", color="AGE_BRACKET",
-                               labels={'AGE_BRACKET': 'RANGOS DE EDAD', 'TOTAL_BOOKINGS': 'COMPRAS'})
-            fig.update_layout({
-                'plot_bgcolor': 'rgba(0, 0, 0, 0)',
-                'paper_bgcolor': 'rgba(0, 0, 0, 0)',
-            })
-            fig.update_yaxes(gridcolor="rgba(0,0,0,0.1)")
-            st.plotly_chart(fig, use_container_width=True)
+            charts.plotly_chart('histogram', comp_data, x="AGE_BRACKET", y="TOTAL_BOOKINGS", facet_col="EVENTO", color="AGE_BRACKET",
+                                labels={'AGE_BRACKET': 'RANGOS DE EDAD', 'TOTAL_BOOKINGS': 'COMPRAS'})
         else:
             st.warning("No hay datos en este momento.")
             st.empty()
@@ -163,15 +165,12 @@ with age_container:
 gender_container = st.container()
 with gender_container:
     st.subheader('Género')
-    data = utils.load_customers_by_gender([event_id])
-    similar_data = utils.load_customers_by_gender(
-        similar_events["EVENT_ID"].astype(str).values.tolist())
-    comp_data = utils.join_data(data.copy(), similar_data.copy())
+    data = page_data["customers_by_gender"]
+    similar_data = page_data["similar_customers_by_gender"]
 
-    t1, t2, t3 = st.tabs(
-        ["Este evento", "Eventos similares", "Comparativa"])
+    view = utils.section_view('view_gender')
 
-    with t1:
+    if view == "Este evento":
         # Metrics
         total_female = data[data['GENDER'] ==
                             'Mujeres']['TOTAL_BOOKINGS'].sum()
@@ -204,19 +203,13 @@ with gender_container:
 
         # Visualization
         if len(data) > 0:
-            fig = px.histogram(data, x="GENDER", y="TOTAL_BOOKINGS", orientation='v',
-                               color='GENDER', color_discrete_map={'Hombres': config.BLUE, 'Mujeres': config.ORANGE},
-                               labels={'TOTAL_BOOKINGS': 'COMPRAS', 'GENDER': 'GENERO'})
-            fig.update_layout({
-                'plot_bgcolor': 'rgba(0, 0, 0, 0)',
-                'paper_bgcolor': 'rgba(0, 0, 0, 0)',
-            })
-            fig.update_yaxes(gridcolor="rgba(0,0,0,0.1)")
-            st.plotly_chart(fig, use_container_width=True)
+            charts.plotly_chart('histogram', data, x="GENDER", y="TOTAL_BOOKINGS", orientation='v',
+                                color='GENDER', color_discrete_map={'Hombres': config.BLUE, 'Mujeres': config.ORANGE},
+                                labels={'TOTAL_BOOKINGS': 'COMPRAS', 'GENDER': 'GENERO'})
         else:
             st.warning("No hay datos en este momento.")
 
-    with t2:
+    elif view == "Eventos similares":
         # Metrics
         total_female = similar_data[similar_data['GENDER']
                                     == 'Mujeres']['TOTAL_BOOKINGS'].sum()
@@ -246,31 +239,20 @@ with gender_container:
 
         # Visualization
         if len(similar_data) > 0:
-            fig = px.histogram(similar_data, x="GENDER", y="TOTAL_BOOKINGS", orientation='v',
-                               color='GENDER', color_discrete_map={'Hombres': config.BLUE, 'Mujeres': config.ORANGE},
-                               labels={'TOTAL_BOOKINGS': 'COMPRAS', 'GENDER': 'GENERO'})
-            fig.update_layout({
-                'plot_bgcolor': 'rgba(0, 0, 0, 0)',
-                'paper_bgcolor': 'rgba(0, 0, 0, 0)',
-            })
-            fig.update_yaxes(gridcolor="rgba(0,0,0,0.1)")
-            st.plotly_chart(fig, use_container_width=True)
+            charts.plotly_chart('histogram', similar_data, x="GENDER", y="TOTAL_BOOKINGS", orientation='v',
+                                color='GENDER', color_discrete_map={'Hombres': config.BLUE, 'Mujeres': config.ORANGE},
+                                labels={'TOTAL_BOOKINGS': 'COMPRAS', 'GENDER': 'GENERO'})
         else:
             st.warning("No hay datos en este momento.")
             st.empty()
 
-    with t3:
+    else:
+        comp_data = utils.join_data(data.copy(), similar_data.copy())
         if len(comp_data) > 0:
-            fig = px.histogram(comp_data, x="GENDER", y="TOTAL_BOOKINGS", facet_col="EVENTO", color="GENDER",
-                               color_discrete_map={
-                                   'Hombres': config.BLUE, 'Mujeres': config.ORANGE},
-                               labels={'TOTAL_BOOKINGS': 'COMPRAS', 'GENDER': 'GENERO'})
-            fig.update_layout({
-                'plot_bgcolor': 'rgba(0, 0, 0, 0)',
-                'paper_bgcolor': 'rgba(0, 0, 0, 0)',
-            })
-            fig.update_yaxes(gridcolor="rgba(0,0,0,0.1)")
-            st.plotly_chart(fig, use_container_width=True)
+            charts.plotly_chart('histogram', comp_data, x="GENDER", y="TOTAL_BOOKINGS", facet_col="EVENTO", color="GENDER",
+                                color_discrete_map={
+                                    'Hombres': config.BLUE, 'Mujeres': config.ORANGE},
+                                labels={'TOTAL_BOOKINGS': 'COMPRAS', 'GENDER': 'GENERO'})
         else:
             st.warning("No hay datos en este momento.")
             st.empty()
@@ -279,15 +261,12 @@ with gender_container:
 gender_and_age_container = st.container()
 with gender_and_age_container:
     st.subheader('Edad y género')
-    data = utils.load_customers_by_gender_age([event_id])
-    similar_data = utils.load_customers_by_gender_age(
-        similar_events["EVENT_ID"].astype(str).values.tolist())
-    comp_data = utils.join_data(data.copy(), similar_data.copy())
+    data = page_data["customers_by_gender_age"]
+    similar_data = page_data["similar_customers_by_gender_age"]
 
-    t1, t2, t3 = st.tabs(
-        ["Este evento", "Eventos similares", "Comparativa"])
+    view = utils.section_view('view_gender_age')
 
-    with t1:
+    if view == "Este evento":
         # Metrics
         total = data['TOTAL_BOOKINGS'].sum()
         if len(data[data["GENDER"] == "Hombres"]) > 0:
@@ -330,19 +309,13 @@ with gender_and_age_container:
 
         # Visualization
         if len(data) > 0:
-            fig = px.histogram(data, x="AGE_BRACKET", y="TOTAL_BOOKINGS", orientation='v', barmode='group',
-                               color='GENDER', color_discrete_map={'Hombres': config.BLUE, 'Mujeres': config.ORANGE},
-                               labels={'AGE_BRACKET': 'RANGOS DE EDAD', 'TOTAL_BOOKINGS': 'COMPRAS', 'GENDER': 'GENERO'})
-            fig.update_layout({
-                'plot_bgcolor': 'rgba(0, 0, 0, 0)',
-                'paper_bgcolor': 'rgba(0, 0, 0, 0)',
-            })
-            fig.update_yaxes(gridcolor="rgba(0,0,0,0.1)")
-            st.plotly_chart(fig, use_container_width=True)
+            charts.plotly_chart('histogram', data, x="AGE_BRACKET", y="TOTAL_BOOKINGS", orientation='v', barmode='group',
+                                color='GENDER', color_discrete_map={'Hombres': config.BLUE, 'Mujeres': config.ORANGE},
+                                labels={'AGE_BRACKET': 'RANGOS DE EDAD', 'TOTAL_BOOKINGS': 'COMPRAS', 'GENDER': 'GENERO'})
         else:
             st.warning("No hay datos en este momento.")
 
-    with t2:
+    elif view == "Eventos similares":
         total = similar_data['TOTAL_BOOKINGS'].sum()
         if len(similar_data[similar_data["GENDER"] == "Hombres"]) > 0:
             best_m = f'{similar_data.iloc[similar_data[similar_data["GENDER"] == "Hombres"]["TOTAL_BOOKINGS"].idxmax(), :]["AGE_BRACKET"]} años'
@@ -384,31 +357,20 @@ with gender_and_age_container:
 
         # Visualization
         if len(similar_data) > 0:
-            fig = px.histogram(similar_data, x="AGE_BRACKET", y="TOTAL_BOOKINGS", orientation='v', barmode='group',
-                               color='GENDER', color_discrete_map={'Hombres': config.BLUE, 'Mujeres': config.ORANGE},
-                               labels={'AGE_BRACKET': 'RANGOS DE EDAD', 'TOTAL_BOOKINGS': 'COMPRAS', 'GENDER': 'GENERO'})
-            fig.update_layout({
-                'plot_bgcolor': 'rgba(0, 0, 0, 0)',
-                'paper_bgcolor': 'rgba(0, 0, 0, 0)',
-            })
-            fig.update_yaxes(gridcolor="rgba(0,0,0,0.1)")
-            st.plotly_chart(fig, use_container_width=True)
+            charts.plotly_chart('histogram', similar_data, x="AGE_BRACKET", y="TOTAL_BOOKINGS", orientation='v', barmode='group',
+                                color='GENDER', color_discrete_map={'Hombres': config.BLUE, 'Mujeres': config.ORANGE},
+                                labels={'AGE_BRACKET': 'RANGOS DE EDAD', 'TOTAL_BOOKINGS': 'COMPRAS', 'GENDER': 'GENERO'})
         else:
             st.warning("No hay datos en este momento.")
             st.empty()
 
-    with t3:
+    else:
+        comp_data = utils.join_data(data.copy(), similar_data.copy())
         if len(comp_data) > 0:
-            fig = px.histogram(comp_data, x="AGE_BRACKET", y="TOTAL_BOOKINGS", facet_col="EVENTO", color="GENDER",
-                               color_discrete_map={
-                                   'Hombres': config.BLUE, 'Mujeres': config.ORANGE},
-                               labels={'AGE_BRACKET': 'RANGOS DE EDAD', 'TOTAL_BOOKINGS': 'COMPRAS', 'GENDER': 'GENERO'})
-            fig.update_layout({
-                'plot_bgcolor': 'rgba(0, 0, 0, 0)',
-                'paper_bgcolor': 'rgba(0, 0, 0, 0)',
-            })
-            fig.update_yaxes(gridcolor="rgba(0,0,0,0.1)")
-            st.plotly_chart(fig, use_container_width=True)
+            charts.plotly_chart('histogram', comp_data, x="AGE_BRACKET", y="TOTAL_BOOKINGS", facet_col="EVENTO", color="GENDER",
+                                color_discrete_map={
+                                    'Hombres': config.BLUE, 'Mujeres': config.ORANGE},
+                                labels={'AGE_BRACKET': 'RANGOS DE EDAD', 'TOTAL_BOOKINGS': 'COMPRAS', 'GENDER': 'GENERO'})
         else:
             st.warning("No hay datos en este momento.")
             st.empty()
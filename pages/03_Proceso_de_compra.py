@@ -1,14 +1,14 @@
 import streamlit as st
-import plotly.express as px
+import charts
 import utils
+import funnel
 import config
 
 utils.load_css()
-utils.draw_header()
+ctx = utils.event_context()
+utils.draw_header(ctx)
 
-event_id = st.session_state["event_id"]
-event_data = st.session_state["event_data"]
-similar_events = st.session_state["similar_events"]
+event_id = ctx.event_id
 
 # SALES FUNNEL GENERAL AND BY MEDIUM
 sources_dict = {
@@ -43,11 +43,16 @@ sources_dict = {
 }
 funnel_medium_container = st.container()
 with funnel_medium_container:
-    funnel_order = {"PAGE_PATH": ["Inicio", "Info", "Checkout", "Pago"]}
+    funnel_order = {"PAGE_PATH": funnel.STAGES}
+    stage_labels = ["Landing del evento", "Información del cliente",
+                    "Selección de método de pago", "Compra finalizada"]
     st.subheader('Proceso de compra')
     st.caption(
         "Representación visual de la proporción de usuarios que proceden a cada fase del proceso de compra de boletos")
     data = utils.load_pageviews_by_medium(event_id)
+    # Stage counts and rates of every medium, computed at once
+    medium_funnels = funnel.FunnelMatrix.from_frame(data, 'MEDIUM')
+    general_funnel = funnel.FunnelMatrix.from_frame(utils.load_pageviews(event_id))
     tabs_names = utils.get_5_sources_mediums(data, 'MEDIUM')
     tabs_names.insert(0, 'General')
     tabs = st.tabs(tabs_names)
@@ -61,31 +66,21 @@ with funnel_medium_container:
             else:
                 st.subheader(tabs_names[i])
 
-            # Slicing the specific source data
+            # Selecting the funnel of the specific source
             if i == 0:
                 # for general funnel
-                source_data = utils.load_pageviews(event_id)
+                funnel_matrix = general_funnel
+                position = 0
             else:
                 # for mediums funnels
-                source_data = data[data['MEDIUM'] == tabs_names[i]]
+                funnel_matrix = medium_funnels
+                position = medium_funnels.position(tabs_names[i])
 
             # Metrics
             info_1, info_2, info_3 = st.columns(3, gap="small")
-            try:
-                total_users = int(
-                    source_data[source_data['PAGE_PATH'] == 'Inicio']['PAGEVIEWS'])
-            except Exception:
-                total_users = 0
-            try:
-                total_sells = int(
-                    source_data[source_data['PAGE_PATH'] == 'Pago']['PAGEVIEWS'])
-            except Exception:
-                total_sells = 0
-            if total_users == 0:
-                CR = 0
-            else:
-                CR = total_sells / total_users * 100
-            CR = "%.2f" % CR  # formating to 2 decimals
+            total_users = int(funnel_matrix.users[position])
+            total_sells = int(funnel_matrix.sales[position])
+            CR = "%.2f" % funnel_matrix.conversion_rates()[position]  # formating to 2 decimals
             info_1.metric(label='Total de usuarios',
                           value=f'{total_users}')
             info_1.caption(
@@ -99,61 +94,25 @@ with funnel_medium_container:
                 'Porcentaje total de usuarios que concretan la compra de boletos')
 
             # Visualization
-            if len(source_data) > 0:
+            if funnel_matrix.rows[position] > 0:
                 # Completing the funnel data
-                funnel_data = utils.convert_to_funnel(source_data)
-                fig = px.bar(funnel_data, x="PAGE_PATH", y="PAGEVIEWS", orientation='v', height=300,
-                             color_discrete_sequence=[
-                                 config.ORANGE, config.ORANGE_TRANS], category_orders=funnel_order,
-                             labels={'PAGE_PATH': 'ETAPA', 'PAGEVIEWS': 'USUARIOS'}, color='DATOS',
-                             hover_name='DATOS', hover_data={'DATOS': False, 'PAGEVIEWS': True, 'PAGE_PATH': False})
-                fig.update_layout({
-                    "showlegend": False,
-                    "xaxis_visible": False,
-                    'plot_bgcolor': 'rgba(0, 0, 0, 0)',
-                    'paper_bgcolor': 'rgba(0, 0, 0, 0)',
-                    'margin': {"r": 0, "t": 0, "l": 0, "b": 0}
-                })
-                fig.update_yaxes(gridcolor="rgba(0,0,0,0.1)")
-                st.plotly_chart(fig, use_container_width=True)
+                funnel_data = funnel_matrix.plot_frame(position)
+                charts.plotly_chart('bar', funnel_data, x="PAGE_PATH", y="PAGEVIEWS", orientation='v', height=300,
+                                    color_discrete_sequence=[
+                                        config.ORANGE, config.ORANGE_TRANS], category_orders=funnel_order,
+                                    labels={'PAGE_PATH': 'ETAPA', 'PAGEVIEWS': 'USUARIOS'}, color='DATOS',
+                                    hover_name='DATOS', hover_data={'DATOS': False, 'PAGEVIEWS': True, 'PAGE_PATH': False},
+                                    layout={"showlegend": False, "xaxis_visible": False, 'margin': {"r": 0, "t": 0, "l": 0, "b": 0}})
             else:
                 st.warning("No hay datos en este momento.")
             # Dummy container so we can add margin to this info without affecting other containers
             funnel_stages_dummy_container = st.container()
             with funnel_stages_dummy_container:
-                stage1, stage2, stage3, stage4 = st.columns(4)
-                with stage1:
-                    st.caption(":orange[Paso 1]")
-                    st.caption("**Landing del evento**")
-                    num_users = int(source_data[source_data["PAGE_PATH"] == "Inicio"]["PAGEVIEWS"].values[0] if len(
-                        source_data[source_data["PAGE_PATH"] == "Inicio"]) > 0 else 0)
-                    pct_users = "%.1f" % (100 * num_users / total_users)
-                    st.markdown(f'**{pct_users}%**')
-                    st.caption(f'{num_users}')
-
-                with stage2:
-                    st.caption(":orange[Paso 2]")
-                    st.caption("**Información del cliente**")
-                    num_users = int(source_data[source_data["PAGE_PATH"] == "Info"]["PAGEVIEWS"].values[0] if len(
-                        source_data[source_data["PAGE_PATH"] == "Info"]) > 0 else 0)
-                    pct_users = "%.1f" % (100 * num_users / total_users)
-                    st.markdown(f'**{pct_users}%**')
-                    st.caption(f'{num_users}')
-
-                with stage3:
-                    st.caption(":orange[Paso 3]")
-                    st.caption("**Selección de método de pago**")
-                    num_users = int(source_data[source_data["PAGE_PATH"] == "Checkout"]["PAGEVIEWS"].values[0] if len(
-                        source_data[source_data["PAGE_PATH"] == "Checkout"]) > 0 else 0)
-                    pct_users = "%.1f" % (100 * num_users / total_users)
-                    st.markdown(f'**{pct_users}%**')
-                    st.caption(f'{num_users}')
-
-                with stage4:
-                    st.caption(":orange[Paso 4]")
-                    st.caption("**Compra finalizada**")
-                    num_users = int(source_data[source_data["PAGE_PATH"] == "Pago"]["PAGEVIEWS"].values[0] if len(
-                        source_data[source_data["PAGE_PATH"] == "Pago"]) > 0 else 0)
-                    pct_users = "%.1f" % (100 * num_users / total_users)
-                    st.markdown(f'**{pct_users}%**')
-                    st.caption(f'{num_users}')
+                stage_columns = st.columns(4)
+                stage_percentages = funnel_matrix.stage_percentages()[position]
+                for stage, stage_column in enumerate(stage_columns):
+                    with stage_column:
+                        st.caption(f":orange[Paso {stage + 1}]")
+                        st.caption(f"**{stage_labels[stage]}**")
+                        st.markdown(f'**{"%.1f" % stage_percentages[stage]}%**')
+                        st.caption(f'{funnel_matrix.counts[position, stage]}')
@@ -0,0 +1,145 @@
+import threading
+import time
+from contextlib import contextmanager
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+# Bounded pool of database connections shared by every Streamlit session in the process.
+# Connections are opened lazily up to `size`, checked out one per query, health checked when
+# they have been idle for a while and closed once they stay idle longer than `idle_timeout`.
+class ConnectionPool:
+
+    def __init__(self, connect, size=8, idle_timeout=600, checkout_timeout=30, health_check_interval=60):
+        self.connect = connect
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.checkout_timeout = checkout_timeout
+        self.health_check_interval = health_check_interval
+        self.idle = []  # (connection, last time it was returned), most recent last
+        self.opened = 0
+        self.closed = False
+        self.cond = threading.Condition()
+        self.reaper = threading.Thread(target=self._reap_forever, name='pool-reaper', daemon=True)
+        self.reaper.start()
+
+    def acquire(self):
+        deadline = time.monotonic() + self.checkout_timeout
+        with self.cond:
+            while True:
+                if self.closed:
+                    raise RuntimeError('Connection pool is closed')
+                if self.idle:
+                    conn, last_used = self.idle.pop()
+                    break
+                if self.opened < self.size:
+                    self.opened += 1
+                    conn, last_used = None, None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolTimeout(
+                        f'No connection available after {self.checkout_timeout}s (pool size {self.size})')
+                self.cond.wait(remaining)
+
+        if conn is not None and not self._healthy(conn, last_used):
+            # Reuse the slot of the broken connection for a fresh one
+            self._close_quietly(conn)
+            conn = None
+        if conn is None:
+            try:
+                conn = self.connect()
+            except Exception:
+                with self.cond:
+                    self.opened -= 1
+                    self.cond.notify()
+                raise
+        return conn
+
+    def release(self, conn):
+        if self._is_closed(conn):
+            self._discard(conn)
+            return
+        with self.cond:
+            if not self.closed:
+                self.idle.append((conn, time.monotonic()))
+                self.cond.notify()
+                return
+        self._discard(conn)
+
+    @contextmanager
+    def cursor(self):
+        conn = self.acquire()
+        try:
+            cur = conn.cursor()
+            try:
+                yield cur
+            finally:
+                cur.close()
+        finally:
+            self.release(conn)
+
+    def reap(self):
+        cutoff = time.monotonic() - self.idle_timeout
+        with self.cond:
+            expired = [conn for conn, last_used in self.idle if last_used < cutoff]
+            self.idle = [(conn, last_used) for conn, last_used in self.idle if last_used >= cutoff]
+        for conn in expired:
+            self._discard(conn)
+        return len(expired)
+
+    def stats(self):
+        with self.cond:
+            return {'size': self.size, 'open': self.opened, 'idle': len(self.idle)}
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            idle, self.idle = self.idle, []
+            self.cond.notify_all()
+        for conn, _ in idle:
+            self._discard(conn)
+
+    def _reap_forever(self):
+        interval = max(1, self.idle_timeout / 2)
+        while True:
+            time.sleep(interval)
+            if self.closed:
+                return
+            self.reap()
+
+    def _healthy(self, conn, last_used):
+        if self._is_closed(conn):
+            return False
+        if time.monotonic() - last_used < self.health_check_interval:
+            return True
+        try:
+            cur = conn.cursor()
+            try:
+                cur.execute('select 1')
+                cur.fetchone()
+            finally:
+                cur.close()
+            return True
+        except Exception:
+            return False
+
+    def _is_closed(self, conn):
+        try:
+            return conn.is_closed()
+        except Exception:
+            return True
+
+    def _close_quietly(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _discard(self, conn):
+        self._close_quietly(conn)
+        with self.cond:
+            self.opened -= 1
+            self.cond.notify()
@@ -0,0 +1,65 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+logger = logging.getLogger(__name__)
+
+
+# Fills the caches of the process in the background so the first page view of an event is as fast
+# as the next ones. `list_events` returns the IDs to warm and `warm(event_id)` runs the loaders of
+# one event; up to `workers` events are warmed at once. With an `interval` (seconds) the whole
+# list is warmed again on that schedule, otherwise only once at start.
+class Prewarmer:
+
+    def __init__(self, warm, list_events, workers=4, interval=0):
+        self.warm = warm
+        self.list_events = list_events
+        self.workers = workers
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.thread = None
+        self.progress = {'total': 0, 'done': 0, 'failed': 0, 'running': False,
+                         'started_at': None, 'finished_at': None}
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run_forever, name='prewarm', daemon=True)
+                self.thread.start()
+
+    def _run_forever(self):
+        while True:
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception('Cache prewarming failed')
+            if not self.interval:
+                return
+            time.sleep(self.interval)
+
+    def run_once(self):
+        event_ids = list(dict.fromkeys(str(i) for i in self.list_events()))
+        with self.lock:
+            self.progress.update(total=len(event_ids), done=0, failed=0, running=True,
+                                 started_at=time.time(), finished_at=None)
+        logger.info('Prewarming the caches of %s events', len(event_ids))
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='prewarm') as pool:
+            futures = {pool.submit(self.warm, event_id): event_id for event_id in event_ids}
+            for future in as_completed(futures):
+                failed = future.exception() is not None
+                if failed:
+                    logger.warning('Could not prewarm event %s: %s', futures[future], future.exception())
+                with self.lock:
+                    self.progress['done'] += 1
+                    self.progress['failed'] += failed
+                    done, total = self.progress['done'], self.progress['total']
+                logger.info('Prewarmed %s/%s events', done, total)
+        with self.lock:
+            self.progress.update(running=False, finished_at=time.time())
+            elapsed = self.progress['finished_at'] - self.progress['started_at']
+        logger.info('Prewarmed %s events in %.1f s', len(event_ids), elapsed)
+
+    def status(self):
+        with self.lock:
+            return dict(self.progress)
@@ -0,0 +1,113 @@
+import json
+import logging
+import sys
+import threading
+import time
+from collections import defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger('smart_events.queries')
+
+# Totals kept per loader and exported to Prometheus: (metric, record field, help)
+COUNTERS = [
+    ('smart_events_query_execute_seconds_total', 'execute_seconds', 'Seconds spent executing warehouse queries'),
+    ('smart_events_query_fetch_seconds_total', 'fetch_seconds', 'Seconds spent fetching query results'),
+    ('smart_events_query_rows_total', 'rows', 'Rows fetched from the warehouse'),
+    ('smart_events_query_bytes_total', 'bytes', 'Bytes fetched from the warehouse'),
+]
+
+
+# Record of every loader call of the process: loader, SQL fingerprint, warehouse query ID, execute
+# and fetch time, rows, bytes and whether the result came from the cache. The latest records are
+# kept for the DEV profiler panel and the totals per loader for the Prometheus endpoint.
+class QueryProfiler:
+
+    def __init__(self, history=1000):
+        self.records = deque(maxlen=history)
+        self.calls = defaultdict(int)  # (loader, cache) -> calls
+        self.totals = defaultdict(float)  # (loader, field) -> total
+        self.lock = threading.Lock()
+        self.log = False
+
+    def record(self, loader, fingerprint, cache, session=None, query_id=None, execute_seconds=0.0,
+               fetch_seconds=0.0, rows=0, bytes=0):
+        record = {
+            'time': time.time(),
+            'session': session,
+            'loader': loader,
+            'fingerprint': fingerprint,
+            'query_id': query_id,
+            'cache': cache,
+            'execute_seconds': round(execute_seconds, 6),
+            'fetch_seconds': round(fetch_seconds, 6),
+            'rows': rows,
+            'bytes': bytes,
+        }
+        with self.lock:
+            self.records.append(record)
+            self.calls[(loader, cache)] += 1
+            for _, field, _ in COUNTERS:
+                self.totals[(loader, field)] += record[field]
+        if self.log:
+            logger.info(json.dumps(record))
+        return record
+
+    def session_records(self, session):
+        with self.lock:
+            return [record for record in self.records if record['session'] == session]
+
+    # Structured logs: one JSON line per query on stderr
+    def enable_logging(self):
+        if not self.log:
+            handler = logging.StreamHandler(sys.stderr)
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            logger.addHandler(handler)
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+            self.log = True
+
+    # Prometheus text exposition format. `gauges` are extra (name, value) pairs, like the cache stats.
+    def prometheus(self, gauges=()):
+        with self.lock:
+            calls = dict(self.calls)
+            totals = dict(self.totals)
+        lines = ['# HELP smart_events_loader_calls_total Loader calls by cache result',
+                 '# TYPE smart_events_loader_calls_total counter']
+        for (loader, cache), value in sorted(calls.items()):
+            lines.append(f'smart_events_loader_calls_total{{loader="{loader}",cache="{cache}"}} {value}')
+        for metric, field, description in COUNTERS:
+            lines += [f'# HELP {metric} {description}', f'# TYPE {metric} counter']
+            for (loader, total_field), value in sorted(totals.items()):
+                if total_field == field:
+                    lines.append(f'{metric}{{loader="{loader}"}} {value}')
+        for name, value in gauges:
+            lines += [f'# TYPE {name} gauge', f'{name} {value}']
+        return '\n'.join(lines) + '\n'
+
+    # Serve /metrics from a daemon thread. `gauges` is called on every scrape.
+    def serve_metrics(self, port, gauges=lambda: ()):
+        profiler = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path != '/metrics':
+                    self.send_error(404)
+                    return
+                body = profiler.prometheus(gauges()).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        try:
+            server = ThreadingHTTPServer(('', port), MetricsHandler)
+        except OSError as e:
+            logger.warning('Could not serve metrics on port %s: %s', port, e)
+            return None
+        threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+        return server
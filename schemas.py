@@ -0,0 +1,111 @@
+import numpy as np
+import pandas as pd
+from pandas.api.types import CategoricalDtype
+
+# Labels with a fixed set of values, in display order
+STAGES = CategoricalDtype(['Inicio', 'Info', 'Checkout', 'Pago'], ordered=True)
+WEEK_DAYS = CategoricalDtype(['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun'], ordered=True)
+EVENTO = CategoricalDtype(['Este evento', 'Similares'], ordered=True)
+
+# Open sets of labels (cities, mediums...), stored as categoricals ordered by value
+LABEL = 'label'
+# Counts, summed later on, never stored below int32 so the sums cannot overflow
+COUNT = 'count'
+# Days since the sale started (0 to 180, null for the bookings left out of the chart)
+DAYS = 'Int16'
+
+BOOKINGS_CUBE = {'EVENTO': EVENTO, 'DIAS_A_LA_VENTA': DAYS, 'DIA': WEEK_DAYS, 'PAYMENT_METHOD': LABEL,
+                 'COMPRAS': COUNT}
+DEMOGRAPHICS = {'AGE_BRACKET': LABEL, 'GENDER': LABEL, 'CITY': LABEL, 'STATE': LABEL, 'COUNTRY': LABEL,
+                'TOTAL_BOOKINGS': COUNT}
+FUNNELS = {'GRAIN': LABEL, 'PAGE_PATH': STAGES, 'BREAKDOWN': LABEL, 'MEDIUM': LABEL, 'SOURCE_MEDIUM': LABEL,
+           'PAGEVIEWS': COUNT}
+
+# Columns of the result of every loader, cast right after the fetch so the cached frames are compact.
+# Columns that are not in the result are skipped.
+SCHEMAS = {
+    'load_bookings_cube': BOOKINGS_CUBE,
+    'load_bookings_cube_by_event': BOOKINGS_CUBE,
+    'load_customers_by_age': DEMOGRAPHICS,
+    'load_customers_by_gender': DEMOGRAPHICS,
+    'load_customers_by_gender_age': DEMOGRAPHICS,
+    'load_bookings_by_city': DEMOGRAPHICS,
+    'load_funnel_cube': FUNNELS,
+    'load_pageviews': FUNNELS,
+    'load_pageviews_by_medium': FUNNELS,
+    'load_pageviews_by_source_medium': FUNNELS,
+}
+
+# Display names of the labels coming from the warehouse
+LABELS = {
+    'DIA': {'Mon': 'Lunes', 'Tue': 'Martes', 'Wed': 'Miercoles', 'Thu': 'Jueves', 'Fri': 'Viernes',
+            'Sat': 'Sabado', 'Sun': 'Domingo'},
+    'PAYMENT_METHOD': {'Banwire': 'Tarjeta de crédito', 'PhysicalTicket': 'Boleto físico', 'Cash': 'Efectivo'},
+    'GENDER': {'female': 'Mujeres', 'male': 'Hombres'},
+    'MEDIUM': {'(none)': 'Directo', 'referral': 'Referido', 'organic': 'Orgánico', 'paid social': 'Paid Social',
+               'sendgrid': 'Sendgrid'},
+    'SOURCE_MEDIUM': {'(direct) / (none)': 'directo'},
+}
+
+
+def smallest_count_type(values):
+    if values.isna().any() or values.dtype.kind not in 'iuf':
+        return values
+    if len(values) == 0 or values.max() <= np.iinfo(np.int32).max:
+        return values.astype(np.int32)
+    return values.astype(np.int64)
+
+
+def label_type(values):
+    if isinstance(values.dtype, CategoricalDtype):
+        return values
+    return values.astype(CategoricalDtype(sorted(values.dropna().unique()), ordered=True))
+
+
+def cast_column(values, dtype):
+    if dtype == COUNT:
+        return smallest_count_type(values)
+    if dtype == LABEL:
+        return label_type(values)
+    if isinstance(dtype, CategoricalDtype) and values.dtype == dtype:
+        return values
+    return values.astype(dtype)
+
+
+# Cast the columns of a loader result to the types of its schema
+def cast(df, loader):
+    schema = SCHEMAS.get(loader, {})
+    for column in df.columns:
+        if column in schema:
+            df[column] = cast_column(df[column], schema[column])
+    return df
+
+
+# Replace the warehouse labels of the given columns by their display names, renaming the
+# categories instead of every value. Labels that would merge two categories fall back to a replace.
+def translate(df, columns):
+    for column in columns:
+        if column not in df:
+            continue
+        values = label_type(df[column])
+        labels = {k: v for k, v in LABELS[column].items() if k in values.cat.categories}
+        kept = set(values.cat.categories) - set(labels)
+        if kept & set(labels.values()):
+            values = label_type(values.astype(object).replace(labels))
+        else:
+            values = values.cat.rename_categories(labels)
+        df[column] = values
+    return df
+
+
+# Sum `value` by `keys`, keeping null keys as a group of their own. Keys are grouped by their integer
+# codes, so categorical and nullable keys behave the same on every pandas version.
+def sum_by(df, keys, value):
+    factorized = [pd.factorize(df[key], sort=True) for key in keys]
+    sums = df[value].groupby([codes for codes, _ in factorized]).sum()
+    result = {}
+    for level, (key, (_, uniques)) in enumerate(zip(keys, factorized)):
+        codes = sums.index.get_level_values(level)
+        result[key] = pd.Series(uniques).reindex(codes).reset_index(drop=True)
+    result[value] = sums.reset_index(drop=True)
+    return pd.DataFrame(result)
@@ -0,0 +1,21 @@
+import sys
+
+from streamlit.web import cli
+
+import utils
+
+# Runs the dashboard like `streamlit run smart_events.py`, in the same process, after starting the
+# cache prewarming, so the caches are warming before the first visitor arrives. Streamlit options
+# are passed through:
+#
+#   python serve.py --server.port 8501
+
+
+def main():
+    utils.start_prewarm()
+    sys.argv = ['streamlit', 'run', 'smart_events.py'] + sys.argv[1:]
+    return cli.main()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,18 +1,25 @@
 import streamlit as st
-import plotly.express as px
+import charts
+import curves
 import pandas as pd
 import utils
 import config
 
 utils.load_css()
-utils.env_config()
+ctx = utils.event_context()
+utils.draw_header(ctx)
 
-event_id = st.session_state["event_id"]
-price_threshold = st.session_state["price_threshold"]
-event_data = st.session_state["event_data"]
-similar_events = st.session_state["similar_events"]
+event_id = ctx.event_id
+event_data = ctx.event_data
 
-utils.draw_header()
+# All the booking charts of the page are rolled up from the bookings cube, whose 'Similares' half is
+# summed from the same per-event cohort cube as the sales curves. Both are fetched concurrently, so
+# the event's own bookings are queried while the cohort is scanned once for both.
+page_data = utils.prefetch({
+    "bookings_cube": (utils.load_bookings_cube, event_id, ctx.similar_ids, ctx.similar_superset),
+    "similar_curves": (utils.load_similar_sales_curves, ctx.similar_ids, ctx.similar_superset),
+})
+bookings_cube = page_data["bookings_cube"]
 
 # Metrics
 c1, c2, c3 = st.columns(3, gap="large")
@@ -40,50 +47,60 @@ bookings_container = st.container()
 with bookings_container:
     st.subheader('Momento de compra')
     st.caption('Compra de boletos por cada día desde el inicio de la venta')
-    data = utils.load_bookings_by_date([event_id])
-    similar_data = utils.load_bookings_by_date(
-        similar_events["EVENT_ID"].astype(str).values.tolist())
-    comp_data = utils.join_data(data.copy(), similar_data.copy())
-
-    t1, t2, t3 = st.tabs(
-        ["Este evento", "Eventos similares", "Comparativa"])
-
-    with t1:
+    data = utils.cube_bookings_by_date(bookings_cube, 'Este evento')
+    # One cumulative curve per similar event, so a large cohort does not dwarf this event
+    similar_curves = page_data["similar_curves"]
+    curves_chart = dict(
+        x="DIAS_A_LA_VENTA", y="VENTAS", color='CURVA',
+        color_discrete_map={'Percentil 10': config.BLUE_TRANS, 'Percentil 90': config.BLUE_TRANS,
+                            'Mediana de similares': config.BLUE, 'Este evento': config.ORANGE},
+        labels={"DIAS_A_LA_VENTA": "DIAS A LA VENTA", "VENTAS": "% DE VENTAS ACUMULADAS", "CURVA": ""},
+        traces=[({'name': 'Percentil 90'}, {'fill': 'tonexty', 'fillcolor': 'rgba(94, 159, 236, 0.2)'})])
+
+    view = utils.section_view('view_bookings_by_date')
+
+    if view == "Este evento":
         if len(data) > 0:
-            fig = px.line(data, x="DIAS_A_LA_VENTA", y="COMPRAS", color_discrete_sequence=[config.ORANGE],
-                          labels={"DIAS_A_LA_VENTA": "DIAS A LA VENTA"})
-            fig.update_layout({
-                'plot_bgcolor': 'rgba(0, 0, 0, 0)',
-                'paper_bgcolor': 'rgba(0, 0, 0, 0)',
-            })
-            fig.update_yaxes(gridcolor="rgba(0,0,0,0.1)")
-            st.plotly_chart(fig, use_container_width=True)
+            charts.plotly_chart('line', data, x="DIAS_A_LA_VENTA", y="COMPRAS", color_discrete_sequence=[config.ORANGE],
+                                labels={"DIAS_A_LA_VENTA": "DIAS A LA VENTA"})
         else:
             st.warning("No hay datos en este momento.")
 
-    with t2:
-        if len(similar_data) > 0:
-            fig = px.line(similar_data, x="DIAS_A_LA_VENTA", y="COMPRAS", color_discrete_sequence=[config.ORANGE],
-                          labels={"DIAS_A_LA_VENTA": "DIAS A LA VENTA"})
-            fig.update_layout({
-                'plot_bgcolor': 'rgba(0, 0, 0, 0)',
-                'paper_bgcolor': 'rgba(0, 0, 0, 0)',
-            })
-            fig.update_yaxes(gridcolor="rgba(0,0,0,0.1)")
-            st.plotly_chart(fig, use_container_width=True)
+    elif view == "Eventos similares":
+        if len(similar_curves) > 0:
+            st.caption(f'Ventas acumuladas de {len(similar_curves)} eventos similares: mediana y rango '
+                       'del percentil 10 al 90')
+            charts.plotly_chart('line', similar_curves.plot_frame(), **curves_chart)
         else:
             st.warning("No hay datos en este momento.")
 
-    with t3:
-        if len(comp_data) > 0:
-            fig = px.line(comp_data, x="DIAS_A_LA_VENTA", y="COMPRAS", color='EVENTO',
-                          color_discrete_sequence=[config.ORANGE, config.BLUE], labels={"DIAS_A_LA_VENTA": "DIAS A LA VENTA"})
-            fig.update_layout({
-                'plot_bgcolor': 'rgba(0, 0, 0, 0)',
-                'paper_bgcolor': 'rgba(0, 0, 0, 0)',
-            })
-            fig.update_yaxes(gridcolor="rgba(0,0,0,0.1)")
-            st.plotly_chart(fig, use_container_width=True)
+    else:
+        event_curve = curves.SalesCurves.from_frame(data, group_by=None)
+        cohort = similar_curves
+        sold = 'sus boletos'
+        # The curve of an event still on sale is its share of the sales to date, so the similar
+        # events are compared over the same days, by what they had sold by then
+        if len(event_curve) > 0 and utils.event_on_sale(event_data):
+            cohort = similar_curves.truncated(event_curve.last_days[0])
+            sold = 'lo vendido a la fecha'
+        if len(cohort) > 0 and len(event_curve) > 0:
+            half_day = int(event_curve.half_sold_days()[0])
+            info_1, info_2 = st.columns(2, gap="small")
+            info_1.metric(
+                label="Días para vender la mitad",
+                value=f"{half_day}",
+                delta=None)
+            info_1.caption(
+                f"Mediana de los eventos similares: {pd.Series(cohort.half_sold_days()).median():.0f} días")
+            info_2.metric(
+                label="Ritmo de venta",
+                value=f"{cohort.slower_than(half_day):.0f}%",
+                delta=None)
+            info_2.caption(f'Eventos similares que tardaron más en vender la mitad de {sold}')
+            if cohort is not similar_curves:
+                st.caption(f'El evento sigue a la venta: las curvas son el porcentaje de lo vendido en los primeros '
+                           f'{cohort.days} días de venta de cada evento')
+            charts.plotly_chart('line', cohort.plot_frame(event_curve), **curves_chart)
         else:
             st.warning("No hay datos en este momento.")
 
@@ -94,66 +111,45 @@ with dow_container:
     st.caption('Preferencia de compra por dia de la semana.')
     dow_order = {"DIA": ["Lunes", "Martes", "Miercoles",
                          "Jueves", "Viernes", "Sabado", "Domingo"]}
-    data = utils.load_bookings_by_week_day([event_id])
-    similar_data = utils.load_bookings_by_week_day(
-        similar_events["EVENT_ID"].astype(str).values.tolist())
-
-    # Normalizing data for comparing
-    normalized_data = data.copy()
-    normalized_similar_data = similar_data.copy()
-    normalized_data['TOTAL_BOOKINGS'] = normalized_data['TOTAL_BOOKINGS'] / \
-        normalized_data['TOTAL_BOOKINGS'].sum() * 100
-    normalized_data['TOTAL_BOOKINGS'] = round(
-        normalized_data['TOTAL_BOOKINGS'], 2)
-    normalized_similar_data['TOTAL_BOOKINGS'] = normalized_similar_data['TOTAL_BOOKINGS'] / \
-        normalized_similar_data['TOTAL_BOOKINGS'].sum() * 100
-    normalized_similar_data['TOTAL_BOOKINGS'] = round(
-        normalized_similar_data['TOTAL_BOOKINGS'], 2)
-    comp_data = utils.join_data(normalized_data, normalized_similar_data)
+    data = utils.cube_bookings_by_week_day(bookings_cube, 'Este evento')
+    similar_data = utils.cube_bookings_by_week_day(bookings_cube, 'Similares')
 
-    t1, t2, t3 = st.tabs(
-        ["Este evento", "Eventos similares", "Comparativa"])
+    view = utils.section_view('view_bookings_by_week_day')
 
-    with t1:
+    if view == "Este evento":
         if len(data) > 0:
-            fig = px.bar(data, x="DIA", y="TOTAL_BOOKINGS",
-                         orientation='v', category_orders=dow_order, color_discrete_sequence=[config.ORANGE],
-                         labels={"TOTAL_BOOKINGS": "COMPRAS"})
-            fig.update_layout({
-                'plot_bgcolor': 'rgba(0, 0, 0, 0)',
-                'paper_bgcolor': 'rgba(0, 0, 0, 0)',
-            })
-            fig.update_yaxes(gridcolor="rgba(0,0,0,0.1)")
-            st.plotly_chart(fig, use_container_width=True)
+            charts.plotly_chart('bar', data, x="DIA", y="TOTAL_BOOKINGS",
+                                orientation='v', category_orders=dow_order, color_discrete_sequence=[config.ORANGE],
+                                labels={"TOTAL_BOOKINGS": "COMPRAS"})
         else:
             st.warning("No hay datos en este momento.")
 
-    with t2:
+    elif view == "Eventos similares":
         if len(similar_data) > 0:
-            fig = px.bar(similar_data, x="DIA", y="TOTAL_BOOKINGS",
-                         orientation='v', category_orders=dow_order, color_discrete_sequence=[config.ORANGE],
-                         labels={"TOTAL_BOOKINGS": "COMPRAS"})
-            fig.update_layout({
-                'plot_bgcolor': 'rgba(0, 0, 0, 0)',
-                'paper_bgcolor': 'rgba(0, 0, 0, 0)',
-            })
-            fig.update_yaxes(gridcolor="rgba(0,0,0,0.1)")
-            st.plotly_chart(fig, use_container_width=True)
+            charts.plotly_chart('bar', similar_data, x="DIA", y="TOTAL_BOOKINGS",
+                                orientation='v', category_orders=dow_order, color_discrete_sequence=[config.ORANGE],
+                                labels={"TOTAL_BOOKINGS": "COMPRAS"})
         else:
             st.warning("No hay datos en este momento.")
 
-    with t3:
+    else:
+        # Normalizing data for comparing
+        normalized_data = data.copy()
+        normalized_similar_data = similar_data.copy()
+        normalized_data['TOTAL_BOOKINGS'] = normalized_data['TOTAL_BOOKINGS'] / \
+            normalized_data['TOTAL_BOOKINGS'].sum() * 100
+        normalized_data['TOTAL_BOOKINGS'] = round(
+            normalized_data['TOTAL_BOOKINGS'], 2)
+        normalized_similar_data['TOTAL_BOOKINGS'] = normalized_similar_data['TOTAL_BOOKINGS'] / \
+            normalized_similar_data['TOTAL_BOOKINGS'].sum() * 100
+        normalized_similar_data['TOTAL_BOOKINGS'] = round(
+            normalized_similar_data['TOTAL_BOOKINGS'], 2)
+        comp_data = utils.join_data(normalized_data, normalized_similar_data)
         if len(comp_data) > 0:
-            fig = px.bar(comp_data, x="DIA", y="TOTAL_BOOKINGS", color='EVENTO', barmode='group',
-                         category_orders=dow_order, color_discrete_sequence=[
-                             config.ORANGE, config.BLUE],
-                         labels={"TOTAL_BOOKINGS": "% DE VENTAS"})
-            fig.update_layout({
-                'plot_bgcolor': 'rgba(0, 0, 0, 0)',
-                'paper_bgcolor': 'rgba(0, 0, 0, 0)',
-            })
-            fig.update_yaxes(gridcolor="rgba(0,0,0,0.1)")
-            st.plotly_chart(fig, use_container_width=True)
+            charts.plotly_chart('bar', comp_data, x="DIA", y="TOTAL_BOOKINGS", color='EVENTO', barmode='group',
+                                category_orders=dow_order, color_discrete_sequence=[
+                                    config.ORANGE, config.BLUE],
+                                labels={"TOTAL_BOOKINGS": "% DE VENTAS"})
         else:
             st.warning("No hay datos en este momento.")
 
@@ -162,35 +158,18 @@ payment_method_container = st.container()
 with payment_method_container:
     st.subheader('Métodos de pago')
     st.caption('Preferencia en métodos de pago.')
-    data = utils.load_bookings_by_payment_method([event_id])
-    similar_data = utils.load_bookings_by_payment_method(
-        similar_events["EVENT_ID"].astype(str).values.tolist())
+    data = utils.cube_bookings_by_payment_method(bookings_cube, 'Este evento')
+    similar_data = utils.cube_bookings_by_payment_method(bookings_cube, 'Similares')
     comp_data = utils.join_data(data.copy(), similar_data.copy()).sort_values(
         by='COMPRAS', ascending=False).reset_index()
 
-    # Normalizing data for comparing
-    normalized_data = data.copy()
-    normalized_similar_data = similar_data.copy()
-    normalized_data['COMPRAS'] = normalized_data['COMPRAS'] / \
-        normalized_data['COMPRAS'].sum() * 100
-    normalized_data['COMPRAS'] = round(normalized_data['COMPRAS'], 2)
-    normalized_similar_data['COMPRAS'] = normalized_similar_data['COMPRAS'] / \
-        normalized_similar_data['COMPRAS'].sum() * 100
-    normalized_similar_data['COMPRAS'] = round(
-        normalized_similar_data['COMPRAS'], 2)
-    normalized_comp_data = utils.join_data(
-        normalized_data, normalized_similar_data)
-
     # Building the legend for te plot
-    comp_data['PM'] = ''
-    for i in comp_data.index:
-        comp_data['PM'][i] = comp_data['PAYMENT_METHOD'][i] + \
-            '\t' + str(comp_data['COMPRAS'][i])
+    comp_data['PM'] = comp_data['PAYMENT_METHOD'].astype(str) + \
+        '\t' + comp_data['COMPRAS'].astype(str)
 
-    t1, t2, t3 = st.tabs(
-        ["Este evento", "Eventos similares", "Comparativa"])
+    view = utils.section_view('view_payment_methods')
 
-    with t1:
+    if view == "Este evento":
         # Metrics
         info_1, info_2, info_3 = st.columns(3, gap="small")
         info_1.metric(
@@ -212,21 +191,15 @@ with payment_method_container:
 
         # Visualization
         if len(data) > 0:
-            fig = px.bar(comp_data[comp_data['EVENTO'] == 'Este evento'], y='EVENTO', x="COMPRAS", barmode='stack',
-                         color='PM', labels={"PAYMENT_METHOD": "METODO DE COMPRA", "PM": "METODO DE PAGO"},
-                         hover_name='PAYMENT_METHOD', hover_data={'PM': False, 'COMPRAS': True, 'EVENTO': False})
-            # Option-3: using fig.update_layout() + dict-flattening shorthand
-            fig.update_layout({
-                "yaxis_visible": False,
-                "xaxis_visible": False,
-                'plot_bgcolor': 'rgba(0, 0, 0, 0)',
-                'paper_bgcolor': 'rgba(0, 0, 0, 0)',
-            })
-            st.plotly_chart(fig, use_container_width=True)
+            charts.plotly_chart('bar', comp_data[comp_data['EVENTO'] == 'Este evento'], y='EVENTO', x="COMPRAS", barmode='stack',
+                                color='PM', labels={"PAYMENT_METHOD": "METODO DE COMPRA", "PM": "METODO DE PAGO"},
+                                hover_name='PAYMENT_METHOD', hover_data={'PM': False, 'COMPRAS': True, 'EVENTO': False},
+                                layout={"yaxis_visible": False, "xaxis_visible": False},
+                                grid=False)
         else:
             st.warning("No hay datos en este momento.")
 
-    with t2:
+    elif view == "Eventos similares":
         # Metrics
         info_1, info_2, info_3 = st.columns(3, gap="small")
         info_1.metric(
@@ -248,29 +221,32 @@ with payment_method_container:
 
         # Visualization
         if len(similar_data) > 0:
-            fig = px.bar(comp_data[comp_data['EVENTO'] == 'Similares'], y='EVENTO', x="COMPRAS", barmode='stack',
-                         color='PM', labels={"PAYMENT_METHOD": "METODO DE COMPRA", "PM": "METODO DE PAGO"},
-                         hover_name='PAYMENT_METHOD', hover_data={'PM': False, 'COMPRAS': True, 'EVENTO': False})
-            fig.update_layout({
-                "yaxis_visible": False,
-                "xaxis_visible": False,
-                'plot_bgcolor': 'rgba(0, 0, 0, 0)',
-                'paper_bgcolor': 'rgba(0, 0, 0, 0)',
-            })
-            st.plotly_chart(fig, use_container_width=True)
+            charts.plotly_chart('bar', comp_data[comp_data['EVENTO'] == 'Similares'], y='EVENTO', x="COMPRAS", barmode='stack',
+                                color='PM', labels={"PAYMENT_METHOD": "METODO DE COMPRA", "PM": "METODO DE PAGO"},
+                                hover_name='PAYMENT_METHOD', hover_data={'PM': False, 'COMPRAS': True, 'EVENTO': False},
+                                layout={"yaxis_visible": False, "xaxis_visible": False},
+                                grid=False)
         else:
             st.warning("No hay datos en este momento.")
 
-    with t3:
+    else:
+        # Normalizing data for comparing
+        normalized_data = data.copy()
+        normalized_similar_data = similar_data.copy()
+        normalized_data['COMPRAS'] = normalized_data['COMPRAS'] / \
+            normalized_data['COMPRAS'].sum() * 100
+        normalized_data['COMPRAS'] = round(normalized_data['COMPRAS'], 2)
+        normalized_similar_data['COMPRAS'] = normalized_similar_data['COMPRAS'] / \
+            normalized_similar_data['COMPRAS'].sum() * 100
+        normalized_similar_data['COMPRAS'] = round(
+            normalized_similar_data['COMPRAS'], 2)
+        normalized_comp_data = utils.join_data(
+            normalized_data, normalized_similar_data)
         if len(normalized_comp_data) > 0:
-            fig = px.bar(normalized_comp_data.sort_values(by='COMPRAS', ascending=False), y='EVENTO', x='COMPRAS', barmode='stack', color='PAYMENT_METHOD',
-                         labels={'PAYMENT_METHOD': 'METODO DE COMPRA',
-                                 'COMPRAS': '% DE VENTAS'},
-                         hover_name='PAYMENT_METHOD', hover_data={'COMPRAS': True, 'EVENTO': False, 'PAYMENT_METHOD': False})
-            fig.update_layout({
-                'plot_bgcolor': 'rgba(0, 0, 0, 0)',
-                'paper_bgcolor': 'rgba(0, 0, 0, 0)',
-            })
-            st.plotly_chart(fig, use_container_width=True)
+            charts.plotly_chart('bar', normalized_comp_data.sort_values(by='COMPRAS', ascending=False), y='EVENTO', x='COMPRAS', barmode='stack', color='PAYMENT_METHOD',
+                                labels={'PAYMENT_METHOD': 'METODO DE COMPRA',
+                                        'COMPRAS': '% DE VENTAS'},
+                                hover_name='PAYMENT_METHOD', hover_data={'COMPRAS': True, 'EVENTO': False, 'PAYMENT_METHOD': False},
+                                grid=False)
         else:
             st.warning("No hay datos en este momento.")
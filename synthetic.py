@@ -0,0 +1,285 @@
+import argparse
+import logging
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Synthetic data in the shape of the warehouse tables the dashboard reads, for the DuckDB backend.
+# The same seed and options always produce the same files. Every table is written as Parquet parts
+# (<data_dir>/<TABLE>/part-<n>.parquet) of at most `chunk_rows` rows, generated one chunk at a time,
+# so tens of millions of bookings never have to fit in memory at once.
+#
+#   python synthetic.py --out data --events 20000 --bookings 20000000 --cohort-size 2000 --source-mediums 400
+
+# Event every benchmark looks at: it has the most common subcategory and channel type,
+# so it gets the largest cohort of similar events
+TARGET_EVENT_ID = 100000
+
+SUBCATEGORIES = ['Conciertos', 'Teatro', 'Deportes', 'Festivales', 'Stand up', 'Conferencias']
+CHANNEL_TYPES = ['ONLINE', 'HYBRID', 'BOX_OFFICE']
+PAYMENT_METHODS = ['Banwire', 'Cash', 'PhysicalTicket', 'PosCard', 'PosCash', 'Paypal', 'Deposit', 'Oxxo']
+AGE_BRACKETS = ['18-24', '25-34', '35-44', '45-54', '55-64', '65+']
+GENDERS = ['female', 'male']
+SOURCE_MEDIUMS = ['(direct) / (none)', 'google / organic', 'google / cpc', 'facebook / paid social',
+                  'instagram / paid social', 'm.facebook.com / referral', 'sendgrid / email', 'bing / organic',
+                  't.co / referral', 'newsletter / sendgrid']
+PAGES = ['', 'info', 'pay', 'finish']
+OTHER_PAGES = ['faq', 'terms', 'seats']
+CITIES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'resources', 'gazetteer_seed.csv')
+
+
+# Microsecond timestamps: DuckDB reads nanosecond ones as TIMESTAMP_NS, which it cannot compare
+# with current_timestamp or the aggregate store watermarks
+PARQUET_OPTIONS = {'coerce_timestamps': 'us', 'allow_truncated_timestamps': True}
+
+
+# Writes the parts of one table, replacing whatever was there
+class PartWriter:
+
+    def __init__(self, data_dir, table):
+        self.folder = os.path.join(data_dir, table)
+        shutil.rmtree(self.folder, ignore_errors=True)
+        os.makedirs(self.folder)
+        self.parts = 0
+        self.rows = 0
+
+    def write(self, df):
+        if len(df) == 0:
+            return
+        df.to_parquet(os.path.join(self.folder, f'part-{self.parts:05d}.parquet'), index=False,
+                      **PARQUET_OPTIONS)
+        self.parts += 1
+        self.rows += len(df)
+
+    # DuckDB needs at least one file to know the columns of an empty table
+    def close(self, columns):
+        if self.parts == 0:
+            pd.DataFrame(columns=columns).to_parquet(os.path.join(self.folder, 'part-00000.parquet'), index=False,
+                                                     **PARQUET_OPTIONS)
+
+
+def generate_events(rng, events, cohort_size=0):
+    ids = TARGET_EVENT_ID + np.arange(events)
+    created_at = pd.Timestamp('2022-01-01') + pd.to_timedelta(rng.integers(0, 700, events), unit='D')
+    first_booking = created_at + pd.to_timedelta(rng.integers(0, 72, events), unit='h')
+    started_at = first_booking + pd.to_timedelta(rng.integers(7, 181, events), unit='D')
+    df = pd.DataFrame({
+        'EVENT_ID': ids,
+        'NAME': [f'Evento {i}' for i in ids],
+        'SUBCATEGORY': rng.choice(SUBCATEGORIES, events, p=[0.4, 0.2, 0.15, 0.1, 0.1, 0.05]),
+        'CHANNEL_TYPE': rng.choice(CHANNEL_TYPES, events, p=[0.7, 0.2, 0.1]),
+        'AVERAGE_TICKET_PRICE': np.round(rng.lognormal(6.3, 0.5, events), 2),
+        'SUBDOMAIN': [f'evento{i}' for i in ids],
+        'CREATED_AT': created_at,
+        'ACTIVATED_AT': created_at + pd.Timedelta(hours=1),
+        'FIRST_BOOKING_INTENDED_AT': first_booking,
+        'STARTED_AT': started_at,
+        'ENDED_AT': started_at + pd.Timedelta(hours=5),
+    })
+    df.loc[0, ['SUBCATEGORY', 'CHANNEL_TYPE']] = [SUBCATEGORIES[0], CHANNEL_TYPES[0]]
+    # Worst case cohort: the next `cohort_size` events are all similar to the target event
+    # (same subcategory and channel type, price within +/- 10%)
+    cohort = df.index[1:cohort_size + 1]
+    df.loc[cohort, 'SUBCATEGORY'] = SUBCATEGORIES[0]
+    df.loc[cohort, 'CHANNEL_TYPE'] = CHANNEL_TYPES[0]
+    df.loc[cohort, 'AVERAGE_TICKET_PRICE'] = np.round(
+        df.loc[0, 'AVERAGE_TICKET_PRICE'] * rng.uniform(0.9, 1.1, len(cohort)), 2)
+    cities = pd.read_csv(CITIES)
+    picked = cities.iloc[rng.integers(0, len(cities), events)].reset_index(drop=True)
+    df['CITY'] = picked['CITY']
+    df['STATE'] = picked['STATE']
+    return df
+
+
+# Share of the bookings of every event: a long tail where a few events sell most of the tickets,
+# with the target event among the largest
+def booking_weights(rng, events):
+    weights = rng.permutation(1.0 / np.arange(1, len(events) + 1) ** 0.8)
+    weights[0] = weights.max()
+    return weights / weights.sum()
+
+
+# One chunk of bookings, with IDs from `first_id`
+def generate_bookings(rng, events, weights, first_id, bookings):
+    event = rng.choice(len(events), bookings, p=weights)
+    start = events['FIRST_BOOKING_INTENDED_AT'].to_numpy()[event]
+    window = (events['STARTED_AT'] - events['FIRST_BOOKING_INTENDED_AT']).to_numpy()[event]
+    # More sales close to the event
+    offset = (window.astype('int64') * rng.beta(2.0, 1.2, bookings)).astype('int64').astype('timedelta64[ns]')
+    method = rng.choice(PAYMENT_METHODS, bookings, p=[0.45, 0.15, 0.05, 0.1, 0.05, 0.1, 0.05, 0.05])
+    payment_method = pd.Series(np.char.add('Payment::', method.astype(str)), dtype=object)
+    payment_method[rng.random(bookings) < 0.02] = None
+    return pd.DataFrame({
+        'BOOKING_ID': np.arange(first_id, first_id + bookings),
+        'EVENT_ID': events['EVENT_ID'].to_numpy()[event],
+        'PAID_AT': start + offset,
+        'PAYMENT_METHOD': payment_method,
+    })
+
+
+def add_event_totals(rng, events, counts):
+    events['BOOKINGS_COMPLETED'] = counts
+    events['TICKETS_SOLD'] = counts + rng.binomial(counts, 0.6)
+    events['TICKETS_SOLD_WITH_COST'] = events['TICKETS_SOLD']
+    events['TOTAL_TICKET_SALES'] = np.round(events['TICKETS_SOLD'] * events['AVERAGE_TICKET_PRICE'], 2)
+    return events
+
+
+# Split the bookings of every event among the values of a dimension, (events x values) counts
+def split_counts(rng, totals, values):
+    shares = rng.dirichlet(np.ones(len(values)), len(totals))
+    return rng.multinomial(totals, shares).astype(np.int64).reshape(len(totals), len(values))
+
+
+# Long (EVENT_ID, <names>..., TOTAL_BOOKINGS) table from (events x values) counts,
+# where every value is a tuple with one item per name
+def counts_frame(ids, counts, names, values):
+    df = pd.DataFrame({'EVENT_ID': np.repeat(ids, len(values))})
+    for i, name in enumerate(names):
+        df[name] = np.tile([value[i] for value in values], len(ids))
+    df['TOTAL_BOOKINGS'] = counts.ravel()
+    return df[df['TOTAL_BOOKINGS'] > 0].reset_index(drop=True)
+
+
+def demographic_dimensions():
+    cities = pd.read_csv(CITIES)
+    places = list(zip(cities['CITY'], cities['COUNTRY']))[:20] + [('(not set)', '(not set)')]
+    return {
+        'CUSTOMER_DEMOGRAPHICS_AGE': (['AGE_BRACKET'], [(age,) for age in AGE_BRACKETS]),
+        'CUSTOMER_DEMOGRAPHICS_GENDER': (['GENDER'], [(gender,) for gender in GENDERS]),
+        'CUSTOMER_DEMOGRAPHICS_GENDER_AGE': (['GENDER', 'AGE_BRACKET'],
+                                             [(gender, age) for gender in GENDERS for age in AGE_BRACKETS]),
+        'CUSTOMER_DEMOGRAPHICS_CITY': (['CITY', 'COUNTRY'], places),
+    }
+
+
+def generate_demographics(rng, events, dimensions):
+    ids = events['EVENT_ID'].to_numpy()
+    totals = events['BOOKINGS_COMPLETED'].to_numpy()
+    return {table: counts_frame(ids, split_counts(rng, totals, values), names, values)
+            for table, (names, values) in dimensions.items()}
+
+
+# Source/mediums of an event heavily tagged with campaigns
+def campaign_source_mediums(count):
+    mediums = ['email', 'cpc', 'paid social', 'referral']
+    return SOURCE_MEDIUMS + [f'campaign-{i} / {mediums[i % len(mediums)]}'
+                             for i in range(max(0, count - len(SOURCE_MEDIUMS)))]
+
+
+# Google Analytics pageviews of each event page, from the landing to the purchase confirmation
+# (every stage keeps part of the users of the previous one), plus pages outside the funnel
+def generate_source_medium_funnels(rng, events, source_mediums):
+    if len(events) == 0:
+        return pd.DataFrame(columns=COLUMNS['SALES_FUNNELS_BY_SOURCE_MEDIUM'])
+    subdomains = events['SUBDOMAIN'].to_numpy()
+    sales = events['BOOKINGS_COMPLETED'].to_numpy()
+    landing = split_counts(rng, sales * rng.integers(8, 30, len(sales)), source_mediums)
+    stages = [landing]
+    for rate in (0.6, 0.5, 0.7):
+        stages.append(rng.binomial(stages[-1], rate))
+    stages += [rng.binomial(landing, 0.1) for _ in OTHER_PAGES]
+    frames = []
+    for page, counts in zip(PAGES + OTHER_PAGES, stages):
+        frames.append(pd.DataFrame({
+            'SUBDOMAIN': np.repeat(subdomains, len(source_mediums)),
+            'PAGE_PATH': np.repeat([f'{s}.boletia.com/{page}' for s in subdomains], len(source_mediums)),
+            'SOURCE_MEDIUM': np.tile(source_mediums, len(subdomains)),
+            'PAGEVIEWS': counts.ravel(),
+        }))
+    df = pd.concat(frames, ignore_index=True)
+    return df[df['PAGEVIEWS'] > 0].reset_index(drop=True)
+
+
+def generate_funnels(rng, events, target_source_mediums):
+    target = events['EVENT_ID'] == TARGET_EVENT_ID
+    frames = [generate_source_medium_funnels(rng, events[~target], SOURCE_MEDIUMS)]
+    if target.any():
+        frames.append(generate_source_medium_funnels(
+            rng, events[target], campaign_source_mediums(target_source_mediums)))
+    by_source_medium = pd.concat(frames, ignore_index=True)
+    by_medium = by_source_medium.assign(MEDIUM=by_source_medium['SOURCE_MEDIUM'].str.split(' / ').str[1])
+    by_medium = by_medium.groupby(['SUBDOMAIN', 'PAGE_PATH', 'MEDIUM'], as_index=False)['PAGEVIEWS'].sum()
+    general = by_source_medium.groupby(['SUBDOMAIN', 'PAGE_PATH'], as_index=False)['PAGEVIEWS'].sum()
+    return {
+        'SALES_FUNNELS': general,
+        'SALES_FUNNELS_BY_MEDIUM': by_medium,
+        'SALES_FUNNELS_BY_SOURCE_MEDIUM': by_source_medium,
+    }
+
+
+COLUMNS = {
+    'CUSTOMER_DEMOGRAPHICS_AGE': ['EVENT_ID', 'AGE_BRACKET', 'TOTAL_BOOKINGS'],
+    'CUSTOMER_DEMOGRAPHICS_GENDER': ['EVENT_ID', 'GENDER', 'TOTAL_BOOKINGS'],
+    'CUSTOMER_DEMOGRAPHICS_GENDER_AGE': ['EVENT_ID', 'GENDER', 'AGE_BRACKET', 'TOTAL_BOOKINGS'],
+    'CUSTOMER_DEMOGRAPHICS_CITY': ['EVENT_ID', 'CITY', 'COUNTRY', 'TOTAL_BOOKINGS'],
+    'SALES_FUNNELS': ['SUBDOMAIN', 'PAGE_PATH', 'PAGEVIEWS'],
+    'SALES_FUNNELS_BY_MEDIUM': ['SUBDOMAIN', 'PAGE_PATH', 'MEDIUM', 'PAGEVIEWS'],
+    'SALES_FUNNELS_BY_SOURCE_MEDIUM': ['SUBDOMAIN', 'PAGE_PATH', 'SOURCE_MEDIUM', 'PAGEVIEWS'],
+}
+
+
+# Write every table the dashboard reads under `data_dir`. Bookings are generated `chunk_rows` at a
+# time; the per-event tables are generated for slices of events sized to stay around `chunk_rows` rows.
+def generate(data_dir, events=500, bookings=200_000, seed=0, chunk_rows=1_000_000, cohort_size=0,
+             source_mediums=len(SOURCE_MEDIUMS)):
+    event_rng, detail_rng = [np.random.default_rng(s) for s in np.random.SeedSequence(seed).spawn(2)]
+    os.makedirs(data_dir, exist_ok=True)
+
+    event_table = generate_events(event_rng, events, cohort_size)
+    weights = booking_weights(event_rng, event_table)
+    counts = np.zeros(events, dtype=np.int64)
+    writer = PartWriter(data_dir, 'COMPLETED_BOOKINGS')
+    for chunk, first in enumerate(range(0, bookings, chunk_rows)):
+        rng = np.random.default_rng([seed, chunk])
+        size = min(chunk_rows, bookings - first)
+        df = generate_bookings(rng, event_table, weights, first + 1, size)
+        counts += np.bincount(df['EVENT_ID'].to_numpy() - TARGET_EVENT_ID, minlength=events)
+        writer.write(df)
+        logger.info('COMPLETED_BOOKINGS: %s of %s rows', first + size, bookings)
+    writer.close(['BOOKING_ID', 'EVENT_ID', 'PAID_AT', 'PAYMENT_METHOD'])
+
+    event_table = add_event_totals(event_rng, event_table, counts)
+    writer = PartWriter(data_dir, 'EVENTS')
+    writer.write(event_table)
+    writer.close(list(event_table.columns))
+
+    dimensions = demographic_dimensions()
+    writers = {table: PartWriter(data_dir, table) for table in COLUMNS}
+    # Rows per event of the largest per-event table (source/medium funnel, 7 pages)
+    events_per_chunk = max(1, chunk_rows // (len(SOURCE_MEDIUMS) * (len(PAGES) + len(OTHER_PAGES))))
+    for first in range(0, events, events_per_chunk):
+        part = event_table.iloc[first:first + events_per_chunk]
+        tables = generate_demographics(detail_rng, part, dimensions)
+        tables.update(generate_funnels(detail_rng, part, source_mediums))
+        for table, df in tables.items():
+            writers[table].write(df)
+        logger.info('Per-event tables: %s of %s events', min(first + events_per_chunk, events), events)
+    for table, writer in writers.items():
+        writer.close(COLUMNS[table])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Generate synthetic warehouse tables as Parquet for the DuckDB backend')
+    parser.add_argument('--out', default='data', help='Data directory (BLT_SMART_EVENTS_LOCAL_DATA_DIR)')
+    parser.add_argument('--events', type=int, default=500)
+    parser.add_argument('--bookings', type=int, default=200_000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--chunk-rows', type=int, default=1_000_000, help='Rows per Parquet part')
+    parser.add_argument('--cohort-size', type=int, default=0,
+                        help=f'Events made similar to the target event {TARGET_EVENT_ID} (worst case cohort)')
+    parser.add_argument('--source-mediums', type=int, default=len(SOURCE_MEDIUMS),
+                        help='Source/mediums of the target event, to emulate heavy campaign tagging')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    generate(args.out, args.events, args.bookings, args.seed, args.chunk_rows, args.cohort_size,
+             args.source_mediums)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,17 @@
+import access
+
+
+def test_signed_token_is_verified():
+    token = access.sign_event('208150', 'secret')
+    assert token.startswith('208150.')
+    assert access.verify_token(token, 'secret') == '208150'
+
+
+def test_tampered_tokens_are_rejected():
+    token = access.sign_event('208150', 'secret')
+    signature = token.partition('.')[2]
+    assert access.verify_token(f'208151.{signature}', 'secret') is None
+    assert access.verify_token(token, 'other secret') is None
+    assert access.verify_token('208150', 'secret') is None
+    assert access.verify_token(f'20815x.{signature}', 'secret') is None
+    assert access.verify_token(None, 'secret') is None
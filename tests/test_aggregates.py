@@ -0,0 +1,114 @@
+import json
+import os
+
+import pandas as pd
+import pytest
+
+import aggregates
+
+
+def bookings(rows):
+    return pd.DataFrame(rows, columns=['EVENT_ID', 'DIAS_A_LA_VENTA', 'DIA', 'PAYMENT_METHOD', 'COMPRAS'])
+
+
+def stored_counts(store, event_ids):
+    df = store.read('bookings_cube', event_ids)
+    return df.set_index(['EVENT_ID', 'DIA'])['COMPRAS'].sort_index().to_dict()
+
+
+# Backend that answers every query with the next frame and keeps the SQL it was sent
+class FakeBackend:
+
+    def __init__(self, *frames):
+        self.frames = list(frames)
+        self.queries = []
+
+    def query(self, sql, max_rows=None, max_bytes=None, stats=None):
+        self.queries.append(sql)
+        return self.frames.pop(0)
+
+
+def test_replace_and_read_by_event(tmp_path):
+    store = aggregates.AggregateStore(str(tmp_path), buckets=4)
+    store.replace('bookings_cube', bookings([[1, 0, 'Mon', 'Cash', 2], [2, 1, 'Tue', 'Cash', 3],
+                                             [5, 2, 'Wed', 'Cash', 4]]))
+    assert store.has('bookings_cube')
+    assert stored_counts(store, [1, 5]) == {(1, 'Mon'): 2, (5, 'Wed'): 4}
+    assert not os.path.exists(tmp_path / 'bookings_cube.staging')
+    assert not os.path.exists(tmp_path / 'bookings_cube.old')
+    # A new store on the same directory reads the committed state
+    assert aggregates.AggregateStore(str(tmp_path)).buckets == 4
+
+
+def test_merge_counts_adds_to_the_stored_counts(tmp_path):
+    store = aggregates.AggregateStore(str(tmp_path), buckets=4)
+    store.replace('bookings_cube', bookings([[1, 0, 'Mon', 'Cash', 2]]), bookings_watermark='a')
+    store.merge_counts('bookings_cube', bookings([[1, 0, 'Mon', 'Cash', 3], [2, 0, 'Mon', 'Cash', 1]]),
+                       aggregates.BOOKINGS_CUBE_KEYS, 'COMPRAS', bookings_watermark='b')
+    assert stored_counts(store, [1, 2]) == {(1, 'Mon'): 5, (2, 'Mon'): 1}
+    assert store.state['bookings_watermark'] == 'b'
+    assert not list(tmp_path.glob('bookings_cube/*/*.pending'))
+
+
+def test_refresh_bookings_continues_from_the_watermark(tmp_path):
+    store = aggregates.AggregateStore(str(tmp_path), buckets=4)
+    first = bookings([[1, 0, 'Mon', 'Cash', 2]]).assign(MAX_PAID_AT=pd.Timestamp('2024-01-01 10:00'))
+    second = bookings([[1, 0, 'Mon', 'Cash', 1]]).assign(MAX_PAID_AT=pd.Timestamp('2024-01-02 10:00'))
+    backend = FakeBackend(first, second, first.iloc[:0])
+
+    assert aggregates.refresh_bookings(backend, store) == 1
+    assert 'where cb.paid_at >' not in backend.queries[0]
+    assert store.state['bookings_watermark'] == '2024-01-01 10:00:00+00:00'
+
+    assert aggregates.refresh_bookings(backend, store) == 1
+    assert "'2024-01-01 10:00:00+00:00'" in backend.queries[1]
+    assert stored_counts(store, [1]) == {(1, 'Mon'): 3}
+    assert store.state['bookings_watermark'] == '2024-01-02 10:00:00+00:00'
+
+    # Nothing new: the store and the watermark stay as they are
+    assert aggregates.refresh_bookings(backend, store) == 0
+    assert store.state['bookings_watermark'] == '2024-01-02 10:00:00+00:00'
+
+
+def test_to_watermark_is_utc():
+    assert aggregates.to_watermark('2024-01-01 10:00') == '2024-01-01 10:00:00+00:00'
+    assert aggregates.to_watermark(pd.Timestamp('2024-01-01 04:00', tz='America/Mexico_City')) == \
+        '2024-01-01 10:00:00+00:00'
+
+
+def test_recover_finishes_a_commit_interrupted_after_its_journal(tmp_path, monkeypatch):
+    store = aggregates.AggregateStore(str(tmp_path), buckets=4)
+    store.replace('bookings_cube', bookings([[1, 0, 'Mon', 'Cash', 2]]), bookings_watermark='a')
+
+    # The job dies right after writing the journal of the merge
+    def crash(journal):
+        raise SystemExit('killed')
+
+    monkeypatch.setattr(store, '_apply', crash)
+    with pytest.raises(SystemExit):
+        store.merge_counts('bookings_cube', bookings([[1, 0, 'Mon', 'Cash', 3]]),
+                           aggregates.BOOKINGS_CUBE_KEYS, 'COMPRAS', bookings_watermark='b')
+    with open(tmp_path / '_state.json') as f:
+        assert json.load(f)['bookings_watermark'] == 'a'
+
+    recovered = aggregates.AggregateStore(str(tmp_path))
+    recovered.recover()
+    assert recovered.state['bookings_watermark'] == 'b'
+    assert stored_counts(recovered, [1]) == {(1, 'Mon'): 5}
+    assert not os.path.exists(tmp_path / '_journal.json')
+    # Recovering again changes nothing
+    recovered.recover()
+    assert stored_counts(aggregates.AggregateStore(str(tmp_path)), [1]) == {(1, 'Mon'): 5}
+
+
+def test_recover_drops_files_staged_before_the_journal(tmp_path):
+    store = aggregates.AggregateStore(str(tmp_path), buckets=4)
+    store.replace('bookings_cube', bookings([[1, 0, 'Mon', 'Cash', 2]]))
+    pending = tmp_path / 'bookings_cube' / 'EVENT_BUCKET=1' / 'part.parquet.pending'
+    pending.write_bytes(b'partial')
+    (tmp_path / 'bookings_cube.staging').mkdir()
+
+    store.recover()
+    assert not pending.exists()
+    assert not (tmp_path / 'bookings_cube.staging').exists()
+    assert stored_counts(store, [1]) == {(1, 'Mon'): 2}
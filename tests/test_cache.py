@@ -0,0 +1,120 @@
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+import cache
+
+
+def test_fingerprint_ignores_whitespace():
+    assert cache.fingerprint('select 1\n  from t') == cache.fingerprint('select 1 from t')
+    assert cache.fingerprint('select 1', [1]) != cache.fingerprint('select 1', [2])
+
+
+def test_sizeof_counts_frames_and_arrays():
+    df = pd.DataFrame({'a': np.arange(1000, dtype=np.int64)})
+    assert cache.sizeof(df) >= 8000
+    assert cache.sizeof(np.zeros(100)) == 800
+    assert cache.sizeof({'df': df}) > cache.sizeof(df)
+
+
+def test_get_or_load_loads_once():
+    c = cache.QueryCache(10 ** 6)
+    loads = []
+    for _ in range(3):
+        assert c.get_or_load('k', lambda: loads.append(1) or 'value', 60) == 'value'
+    assert len(loads) == 1
+    assert c.stats()['hits'] == 2
+    assert c.stats()['misses'] == 1
+
+
+def test_expired_entries_are_loaded_again():
+    c = cache.QueryCache(10 ** 6)
+    c.put('k', 'old', 0)
+    assert c.get('k') is None
+    assert c.stats()['expirations'] == 1
+    assert c.get_or_load('k', lambda: 'new', 60) == 'new'
+
+
+def test_least_recently_used_entry_is_evicted():
+    c = cache.QueryCache(3 * cache.sizeof(np.zeros(100)))
+    for key in ['a', 'b', 'c']:
+        c.put(key, np.zeros(100), 60)
+    c.get('a')
+    c.put('d', np.zeros(100), 60)
+    assert c.get('b') is None
+    assert c.get('a') is not None
+    assert c.stats()['evictions'] == 1
+    assert c.stats()['bytes'] <= c.max_bytes
+
+
+def test_values_larger_than_the_cache_are_not_stored():
+    c = cache.QueryCache(100)
+    c.put('k', np.zeros(100), 60)
+    assert c.get('k') is None
+    assert c.stats()['bytes'] == 0
+
+
+def test_concurrent_misses_share_one_load():
+    c = cache.QueryCache(10 ** 6)
+    loads = []
+    results = []
+
+    def load():
+        loads.append(1)
+        time.sleep(0.2)
+        return 'value'
+
+    threads = [threading.Thread(target=lambda: results.append(c.get_or_load('k', load, 60))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(loads) == 1
+    assert results == ['value'] * 5
+    # One miss per call, and the calls that waited count as coalesced
+    stats = c.stats()
+    assert stats['misses'] == 5
+    assert stats['coalesced'] == 4
+    assert stats['hits'] == 0
+
+
+def test_failed_load_is_not_cached_and_waiters_retry():
+    c = cache.QueryCache(10 ** 6)
+    calls = []
+
+    def load():
+        calls.append(1)
+        raise RuntimeError('backend down')
+
+    try:
+        c.get_or_load('k', load, 60)
+    except RuntimeError:
+        pass
+    assert c.get_or_load('k', lambda: 'value', 60) == 'value'
+    assert len(calls) == 1
+    assert not c.inflight
+
+
+def test_the_largest_partition_is_evicted_first():
+    size = cache.sizeof(np.zeros(100))
+    c = cache.QueryCache(4 * size)
+    c.put('busy 1', np.zeros(100), 60, partition='1')
+    c.put('busy 2', np.zeros(100), 60, partition='1')
+    c.put('busy 3', np.zeros(100), 60, partition='1')
+    c.put('quiet', np.zeros(100), 60, partition='2')
+    c.get('busy 1')
+    c.put('busy 4', np.zeros(100), 60, partition='1')
+    # The other event keeps its entry even though it was used least recently
+    assert c.get('quiet') is not None
+    assert c.get('busy 2') is None
+    assert c.stats()['partitions'] == 2
+
+
+def test_empty_partitions_are_dropped():
+    c = cache.QueryCache(10 ** 6)
+    c.put('k', 'value', 60, partition='1')
+    c.invalidate('k')
+    assert c.stats()['partitions'] == 0
+    assert c.stats()['bytes'] == 0
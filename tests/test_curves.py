@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+
+import curves
+
+
+def daily(rows):
+    return pd.DataFrame(rows, columns=['EVENT_ID', 'DIAS_A_LA_VENTA', 'COMPRAS'])
+
+
+def test_curves_are_the_share_of_the_bookings_sold_by_each_day():
+    c = curves.SalesCurves.from_frame(daily([[1, 0, 1], [1, 2, 3], [2, 1, 10], [3, 5, 0]]), days=4)
+    # Events without bookings in the window are left out
+    assert list(c.events) == [1, 2]
+    np.testing.assert_allclose(c.curves, [[25, 25, 100, 100], [0, 100, 100, 100]])
+    assert list(c.last_days) == [2, 1]
+    assert list(c.half_sold_days()) == [2, 1]
+
+
+def test_days_out_of_the_window_are_ignored():
+    c = curves.SalesCurves.from_frame(daily([[1, 0, 1], [1, -1, 5], [1, 4, 5], [1, None, 5]]), days=4)
+    np.testing.assert_allclose(c.curves, [[100, 100, 100, 100]])
+
+
+def test_single_event_curve():
+    df = daily([[None, 0, 2], [None, 3, 2]]).drop(columns=['EVENT_ID'])
+    c = curves.SalesCurves.from_frame(df, group_by=None, days=5)
+    assert list(c.events) == ['Este evento']
+    np.testing.assert_allclose(c.curves, [[50, 50, 50, 100, 100]])
+    assert c.last_days[0] == 3
+
+
+def test_bands_and_position_in_the_cohort():
+    rows = [[event, event, 1] for event in range(10)]
+    c = curves.SalesCurves.from_frame(daily(rows), days=12)
+    assert len(c) == 10
+    low, median, high = c.bands()
+    np.testing.assert_allclose(median, np.percentile(c.curves, 50, axis=0))
+    assert (low <= median).all() and (median <= high).all()
+    assert c.slower_than(4) == 50.0
+    assert curves.SalesCurves(np.array([]), np.zeros((0, 3)), np.array([])).slower_than(1) == 0.0
+
+
+def test_truncated_compares_the_same_window():
+    c = curves.SalesCurves.from_frame(daily([[1, 0, 1], [1, 1, 1], [1, 9, 2], [2, 3, 4], [3, 0, 4]]), days=10)
+    t = c.truncated(1)
+    # Event 2 had sold nothing by day 1, so it has nothing to compare
+    assert list(t.events) == [1, 3]
+    assert t.days == 2
+    np.testing.assert_allclose(t.curves, [[50, 100], [100, 100]])
+    assert list(t.last_days) == [1, 0]
+    assert list(t.half_sold_days()) == [0, 0]
+    # A day past the window keeps the whole curves
+    np.testing.assert_allclose(c.truncated(100).curves, c.curves)
+
+
+def test_plot_frame_draws_the_event_up_to_its_last_sale():
+    cohort = curves.SalesCurves.from_frame(daily([[1, 0, 1], [2, 2, 1]]), days=5)
+    event = curves.SalesCurves.from_frame(daily([[None, 1, 1]]).drop(columns=['EVENT_ID']), group_by=None, days=5)
+    df = cohort.plot_frame(event)
+    counts = df['CURVA'].value_counts()
+    assert counts['Mediana de similares'] == 5
+    assert counts['Percentil 10'] == 5
+    assert counts['Este evento'] == 2
+    assert 'Este evento' not in cohort.plot_frame()['CURVA'].values
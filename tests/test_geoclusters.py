@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+
+import geoclusters
+
+
+def cities(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'CITY': [f'Ciudad {i}' for i in range(n)],
+        'STATE': rng.choice(['Jalisco', 'Nuevo León'], n),
+        'COUNTRY': 'México',
+        'LAT': rng.uniform(15, 30, n),
+        'LON': rng.uniform(-110, -90, n),
+        'TOTAL_BOOKINGS': rng.integers(1, 100, n),
+    })
+
+
+def test_one_marker_per_city_within_the_budget():
+    df = cities(20)
+    markers = geoclusters.cluster(df, 50)
+    assert len(markers) == 20
+    assert (markers['CITIES'] == 1).all()
+    assert set(markers['LABEL']) == set(df['CITY'])
+
+
+def test_markers_stay_within_the_budget_and_keep_the_bookings():
+    df = cities(500)
+    markers = geoclusters.cluster(df, 30)
+    assert 0 < len(markers) <= 30
+    assert markers['TOTAL_BOOKINGS'].sum() == df['TOTAL_BOOKINGS'].sum()
+    assert markers['CITIES'].sum() == len(df)
+    # Grouped markers are labeled with their top city and how many more they hold
+    grouped = markers[markers['CITIES'] > 1].iloc[0]
+    assert grouped['LABEL'].endswith(f" y {grouped['CITIES'] - 1} más")
+
+
+def test_markers_are_at_the_weighted_center_of_their_cities():
+    df = pd.DataFrame({'CITY': ['A', 'B'], 'LAT': [20.0, 20.02], 'LON': [-100.0, -100.0],
+                       'TOTAL_BOOKINGS': [3, 1]})
+    markers = geoclusters.cluster(df, 1)
+    assert len(markers) == 1
+    assert markers['LABEL'][0] == 'A y 1 más'
+    assert np.isclose(markers['LAT'][0], 20.005)
+
+
+def test_cities_without_coordinates_are_left_out():
+    df = cities(5)
+    df.loc[0, 'LAT'] = np.nan
+    assert geoclusters.cluster(df, 10)['CITIES'].sum() == 4
+
+
+def test_drill_down():
+    df = cities(50)
+    assert len(geoclusters.drill_down(df)) == 50
+    assert len(geoclusters.drill_down(df, 'Colombia')) == 0
+    jalisco = geoclusters.drill_down(df, 'México', 'Jalisco')
+    assert (jalisco['STATE'] == 'Jalisco').all()
+    assert len(jalisco) == (df['STATE'] == 'Jalisco').sum()
@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+
+import schemas
+
+
+def test_cast_counts_and_labels():
+    df = pd.DataFrame({'DIA': ['Tue', 'Mon', 'Tue'], 'PAYMENT_METHOD': ['Cash', 'Banwire', None],
+                       'COMPRAS': np.array([1, 2, 3], dtype=np.int64), 'OTHER': [1.5, 2.5, 3.5]})
+    df = schemas.cast(df, 'load_bookings_cube')
+    assert df['COMPRAS'].dtype == np.int32
+    assert list(df['DIA'].cat.categories) == list(schemas.WEEK_DAYS.categories)
+    assert df['PAYMENT_METHOD'].cat.ordered
+    assert list(df['PAYMENT_METHOD'].cat.categories) == ['Banwire', 'Cash']
+    assert df['PAYMENT_METHOD'].isna().sum() == 1
+    # Columns out of the schema are left as they are
+    assert df['OTHER'].dtype == np.float64
+
+
+def test_counts_keep_nulls_and_large_values():
+    with_nulls = schemas.cast_column(pd.Series([1.0, None]), schemas.COUNT)
+    assert with_nulls.dtype == np.float64
+    large = schemas.cast_column(pd.Series([2 ** 40]), schemas.COUNT)
+    assert large.dtype == np.int64
+
+
+def test_unknown_loaders_are_not_cast():
+    df = pd.DataFrame({'COMPRAS': np.array([1], dtype=np.int64)})
+    assert schemas.cast(df, 'not_a_loader')['COMPRAS'].dtype == np.int64
+
+
+def test_translate_renames_the_categories():
+    df = schemas.cast(pd.DataFrame({'DIA': ['Mon', 'Sun', 'Mon']}), 'load_bookings_cube')
+    df = schemas.translate(df, ['DIA'])
+    assert list(df['DIA']) == ['Lunes', 'Domingo', 'Lunes']
+    # The week keeps its order after the translation
+    assert list(df['DIA'].cat.categories[:2]) == ['Lunes', 'Martes']
+
+
+def test_translate_merges_labels_that_already_exist():
+    df = pd.DataFrame({'PAYMENT_METHOD': ['Cash', 'Efectivo', 'Oxxo']})
+    df = schemas.translate(df, ['PAYMENT_METHOD'])
+    assert list(df['PAYMENT_METHOD']) == ['Efectivo', 'Efectivo', 'Oxxo']
+    assert list(df['PAYMENT_METHOD'].cat.categories) == ['Efectivo', 'Oxxo']
+
+
+def test_translate_skips_missing_columns():
+    df = pd.DataFrame({'GENDER': ['female']})
+    assert list(schemas.translate(df, ['DIA', 'GENDER'])['GENDER']) == ['Mujeres']
+
+
+def test_sum_by_keeps_null_keys_as_a_group():
+    df = pd.DataFrame({'DIAS_A_LA_VENTA': pd.array([0, 0, None, None, 1], dtype='Int16'),
+                       'DIA': pd.Categorical(['Mon', 'Mon', 'Tue', 'Tue', 'Mon'], categories=['Mon', 'Tue']),
+                       'COMPRAS': [1, 2, 3, 4, 5]})
+    result = schemas.sum_by(df, ['DIAS_A_LA_VENTA', 'DIA'], 'COMPRAS')
+    sums = {(None if pd.isna(d) else int(d), dia): n
+            for d, dia, n in result[['DIAS_A_LA_VENTA', 'DIA', 'COMPRAS']].itertuples(index=False)}
+    assert sums == {(0, 'Mon'): 3, (1, 'Mon'): 5, (None, 'Tue'): 7}
+    assert result['COMPRAS'].sum() == df['COMPRAS'].sum()
@@ -1,26 +1,165 @@
-import snowflake.connector
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 import config
+import backends
+import cache
+import geocoding
+import event_index
+import aggregates
+import schemas
+import profiling
+import access
+import prewarm
+import charts
+import context
+import curves
 import streamlit as st
-import numpy as np
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 import pandas as pd
-from pandas.api.types import CategoricalDtype
-from geopy.geocoders import Nominatim
 
 
-ctx = snowflake.connector.connect(
-    user=config.USER,
-    password=config.PASSWORD,
-    account=config.ACCOUNT,
-    warehouse=config.WAREHOUSE,
-    database=config.DATABASE,
-    schema=config.SCHEMA
-)
-cur = ctx.cursor()
+backend = backends.create_backend()
+query_cache = cache.QueryCache(config.CACHE_MAX_BYTES)
+profiler = profiling.QueryProfiler()
+if config.TARGET == 'PROD':
+    profiler.enable_logging()
+    if config.METRICS_PORT:
+        profiler.serve_metrics(config.METRICS_PORT, lambda: [
+            (f'smart_events_cache_{name}', value) for name, value in query_cache.stats().items()] + [
+            (f'smart_events_chart_cache_{name}', value) for name, value in charts.figure_cache.stats().items()] + [
+            (f'smart_events_prewarm_{name}', int(prewarmer.status()[name])) for name in ['total', 'done', 'failed', 'running']])
+aggregate_store = aggregates.AggregateStore(config.AGGREGATE_STORE) if config.AGGREGATE_STORE else None
+gazetteer = geocoding.Gazetteer(config.GAZETTEER_PATH, geocoding.create_geocoder())
+
+
+# Every event that can be used as a similar event: finished and with paid tickets
+def load_similar_event_candidates():
+    sql = """select
+                event_id,
+                name,
+                subcategory,
+                city,
+                state,
+                average_ticket_price,
+                channel_type
+            from PROD.EVENTS.EVENTS
+            where tickets_sold_with_cost > 0
+            and ended_at < current_timestamp
+            """
+    return run_query('load_similar_event_candidates', sql)
+
+
+similar_index = event_index.SimilarEventsIndex(
+    load_similar_event_candidates, config.SIMILAR_INDEX_REFRESH)
+
+# Seconds the results of each loader stay cached, event metadata and live sales change
+# more often than the similar events, which have already finished
+CACHE_TTLS = {
+    'load_event_data': 300,
+    'load_event_context': 300,
+    'load_static_event_list': 3600,
+    'load_customers_by_age': 3600,
+    'load_customers_by_gender': 3600,
+    'load_customers_by_gender_age': 3600,
+    'load_bookings_by_city': 3600,
+}
+
+
+# Session of the running page, None in the prewarm, similar index and geocoder threads
+def current_session():
+    ctx = get_script_run_ctx(suppress_warning=True)
+    return ctx.session_id if ctx is not None else None
+
+
+# Run a query on the backend, recording it in the profiler
+def run_query(loader, sql, cache_result='none'):
+    stats = {}
+    df = backend.query(sql, stats=stats)
+    profiler.record(loader, cache.fingerprint(sql), cache_result, current_session(), **stats)
+    return df
+
+
+# Run a loader query through the shared result cache, cast to the loader schema. Callers get
+# their own copy of the result, so they can modify it without touching the cached frame.
+def cached_query(loader, sql, partition=cache.SHARED):
+    key = cache.fingerprint(sql)
+    loaded = []
+
+    def load():
+        loaded.append(True)
+        return schemas.cast(run_query(loader, sql, 'miss'), loader)
+
+    df = query_cache.get_or_load(key, load, CACHE_TTLS.get(loader, config.CACHE_TTL), partition)
+    if not loaded:
+        profiler.record(loader, key, 'hit', current_session())
+    return df.copy()
+
+
+# Canonical form of a list of event IDs: unique and sorted, so the same cohort always builds the
+# same query (and cache key) no matter the order it came in
+def cohort_ids(ids):
+    return [str(i) for i in sorted({int(i) for i in ids})]
+
+
+# Cache key of a cohort-level result, shared by every event whose similar events are `ids`
+def cohort_key(name, ids):
+    return cache.fingerprint(f'cohort {name}', cohort_ids(ids))
+
+
+# Cache partition of a result: the event's own partition when it covers a single event,
+# the shared one for cohorts
+def partition_of(ids):
+    ids = cohort_ids(ids if isinstance(ids, (list, tuple)) else [ids])
+    return ids[0] if len(ids) == 1 else cache.SHARED
+
+
+# Whether a loader can read `table` from the local pre-aggregated store instead of the warehouse
+def use_store(table):
+    return aggregate_store is not None and aggregate_store.has(table)
+
+
+# Read the rows of some events from the local pre-aggregated store, through the result cache
+def cached_store_read(loader, table, event_ids):
+    key = cache.fingerprint(f'store {table}', cohort_ids(event_ids))
+    partition = partition_of(event_ids)
+    loaded = []
+
+    def load():
+        start = time.perf_counter()
+        df = schemas.cast(aggregate_store.read(table, event_ids), loader)
+        loaded.append(True)
+        profiler.record(loader, key, 'miss', current_session(), fetch_seconds=time.perf_counter() - start,
+                        rows=len(df), bytes=cache.sizeof(df))
+        return df
+
+    df = query_cache.get_or_load(key, load, CACHE_TTLS.get(loader, config.CACHE_TTL), partition)
+    if not loaded:
+        profiler.record(loader, key, 'hit', current_session())
+    return df.copy()
+
+
+prefetch_executor = ThreadPoolExecutor(
+    max_workers=config.PREFETCH_WORKERS, thread_name_prefix='prefetch')
+
+
+# Run every loader a page needs at once, so the page waits for the slowest query instead of the sum.
+# `requests` maps a name to a (loader, *args) tuple, the results come back under the same names.
+def prefetch(requests):
+    ctx = get_script_run_ctx()
+
+    def run(loader, args):
+        # Let the worker thread talk to the session that asked for the data (spinners, caches)
+        add_script_run_ctx(threading.current_thread(), ctx)
+        return loader(*args)
+
+    futures = {name: prefetch_executor.submit(run, loader, args)
+               for name, (loader, *args) in requests.items()}
+    return {name: future.result() for name, future in futures.items()}
 
 # Get event metadata
 
 
-@st.cache
 def load_event_data(event_id):
     # Execute a query to extract the data
     sql = f"""select
@@ -32,50 +171,31 @@ def load_event_data(event_id):
                 convert_timezone('UTC', 'America/Mexico_City', started_at) as started_at,
                 bookings_completed,
                 tickets_sold,
-                total_ticket_sales
+                total_ticket_sales,
+                average_ticket_price,
+                channel_type,
+                subdomain
             from EVENTS.EVENTS
             where event_id = {event_id}
             """
-    cur.execute(sql)
-    # Converting data into a dataframe
-    df = cur.fetch_pandas_all()
+    df = cached_query('load_event_data', sql, partition_of(event_id))
     return df.to_dict('records')[0] if len(df) > 0 else None
 
 
-# Get comparable events
-@st.cache
+# Get comparable events from the in-process similar events index
 def load_similar_events(event_id, price_threshold):
-    # Execute a query to extract the data
-    sql = f"""with base_event as
-                (select event_id, subcategory, city, state, average_ticket_price, channel_type
-                from PROD.EVENTS.EVENTS
-                where event_id = {event_id}
-                )
-            select
-                event_id,
-                name,
-                subcategory,
-                city,
-                state,
-                average_ticket_price,
-                channel_type
-            from PROD.EVENTS.EVENTS
-            where subcategory = (select subcategory from base_event)
-            --and state = (select state from base_event)
-            and channel_type = (select channel_type from base_event)
-            and average_ticket_price between (select average_ticket_price from base_event) * {1.0 - price_threshold} and (select average_ticket_price from base_event) * {1.0 + price_threshold}
-            and tickets_sold_with_cost > 0
-            and event_id <> (select event_id from base_event)
-            and ended_at < current_timestamp
-            """
-    cur.execute(sql)
-    # Converting data into a dataframe
-    df = cur.fetch_pandas_all()
-    return df
+    event_data = load_event_data(event_id)
+    if event_data is None:
+        return pd.DataFrame(columns=event_index.COLUMNS)
+    return similar_index.lookup(
+        event_data['SUBCATEGORY'],
+        event_data['CHANNEL_TYPE'],
+        event_data['AVERAGE_TICKET_PRICE'],
+        price_threshold,
+        exclude_id=event_id)
 
 
 # Get a static set events from a list of IDs
-@st.cache
 def load_static_event_list(id_list):
     # Execute a query to extract the data
     sql = f"""
@@ -88,293 +208,294 @@ def load_static_event_list(id_list):
                 average_ticket_price,
                 channel_type
             from PROD.EVENTS.EVENTS
-            where event_id in ({",".join(id_list)})
+            where event_id in ({",".join(cohort_ids(id_list))})
             """
-    cur.execute(sql)
-    # Converting data into a dataframe
-    df = cur.fetch_pandas_all()
+    df = cached_query('load_static_event_list', sql)
     return df
 
 
-# Function to get the total number of bookings by date
-@st.cache
-def load_bookings_by_date(event_id):
+# Function to get the total number of customers by age bracket
+def load_customers_by_age(event_id):
+    if use_store('customers_by_age'):
+        df = cached_store_read('load_customers_by_age', 'customers_by_age', event_id)
+        return df.sort_values('AGE_BRACKET').reset_index(drop=True)
+    # Execute a query to extract the data
+    sql = f"""select *
+                from EVENTS.CUSTOMER_DEMOGRAPHICS_AGE
+                where event_id in ({','.join(cohort_ids(event_id))})
+                order by age_bracket
+                """
+    df = cached_query('load_customers_by_age', sql, partition_of(event_id))
+    return df
+
+
+# Function to get the total number of customer by gender
+def load_customers_by_gender(event_id):
+    if use_store('customers_by_gender'):
+        df = cached_store_read('load_customers_by_gender', 'customers_by_gender', event_id)
+        return schemas.translate(df, ['GENDER'])
+    # Execute a query to extract the data
+    sql = f"""select *
+                    from EVENTS.CUSTOMER_DEMOGRAPHICS_GENDER
+                    where event_id in ({','.join(cohort_ids(event_id))})
+                    """
+    df = cached_query('load_customers_by_gender', sql, partition_of(event_id))
+    return schemas.translate(df, ['GENDER'])
+
+
+# Function to get all the bookings of the event and its similar events, aggregated at the grain
+# (EVENTO, DIAS_A_LA_VENTA, DIA, PAYMENT_METHOD).
+# DIAS_A_LA_VENTA and PAYMENT_METHOD are null for the bookings that the by-date and
+# by-payment-method charts leave out, so every chart can be rolled up from this result.
+def load_bookings_cube(event_id, similar_ids, superset_ids=None):
+    similar_ids = cohort_ids(similar_ids)
+    halves = [event_bookings_cube(event_id), similar_bookings_cube(similar_ids, superset_ids)]
+    # Both halves are concatenated untranslated and translated once, leaving out an empty half
+    return translate_bookings_cube(pd.concat([df for df in halves if len(df)] or halves[:1], ignore_index=True))
+
+
+# Dimensions of the bookings cube, every chart of the purchase timing is a rollup of one of them
+BOOKINGS_CUBE_KEYS = ['DIAS_A_LA_VENTA', 'DIA', 'PAYMENT_METHOD']
+
+
+# Untranslated 'Este evento' half of the bookings cube
+def event_bookings_cube(event_id):
+    if use_store('bookings_cube'):
+        df = schemas.sum_by(load_bookings_cube_by_event([event_id]), BOOKINGS_CUBE_KEYS, 'COMPRAS')
+        df.insert(0, 'EVENTO', 'Este evento')
+        return df
     # Execute a query to extract the data
     sql = f"""
             select
-                timestampdiff(
-                    day,
-                    convert_timezone('America/Mexico_City', coalesce(e.first_booking_intended_at, e.created_at)),
-                    convert_timezone('America/Mexico_City', cb.paid_at)
-                    ) as dias_a_la_venta,
+                'Este evento' as evento,
+                {aggregates.BOOKINGS_CUBE_DIMENSIONS},
                 count(*) as compras
             from PROD.EVENTS.COMPLETED_BOOKINGS cb
             left join prod.events.events e on e.event_id = cb.event_id
-            where cb.event_id in ({','.join(event_id)})
-            and cb.paid_at > coalesce(e.first_booking_intended_at, e.created_at)
-            and timestampdiff(
-                    day,
-                    convert_timezone('America/Mexico_City', coalesce(e.first_booking_intended_at, e.created_at)),
-                    convert_timezone('America/Mexico_City', cb.paid_at)
-                    ) between 0 and 180
-            group by 1
-            order by 1
+            where cb.event_id = {int(event_id)}
+            group by 1, 2, 3, 4
             """
-    cur.execute(sql)
-    # Converting data into a dataframe
-    df = cur.fetch_pandas_all()
-    return df
-
-
-@st.cache
-def load_bookings_by_payment_method(event_id):
+    return cached_query('load_bookings_cube', sql, partition_of(event_id))
+
+
+# Untranslated 'Similares' half of the bookings cube, summed in memory from the per-event cube of the
+# similar events that the sales curves also use, so the cohort is scanned once for both. The sums are
+# cached once for every event with the same cohort.
+def similar_bookings_cube(similar_ids, superset_ids=None):
+    def load():
+        df = schemas.sum_by(similar_bookings_by_event(similar_ids, superset_ids), BOOKINGS_CUBE_KEYS, 'COMPRAS')
+        df.insert(0, 'EVENTO', 'Similares')
+        return df
+
+    key = cohort_key('load_bookings_cube', similar_ids)
+    return query_cache.get_or_load(key, load, CACHE_TTLS.get('load_bookings_cube', config.CACHE_TTL)).copy()
+
+
+# Per-event bookings cube of the similar events. With `superset_ids` the cube of the whole superset
+# is loaded once and the cohort filtered in memory.
+def similar_bookings_by_event(similar_ids, superset_ids=None):
+    if not similar_ids:
+        return schemas.cast(pd.DataFrame(columns=['EVENT_ID'] + BOOKINGS_CUBE_KEYS + ['COMPRAS']),
+                            'load_bookings_cube_by_event')
+    if superset_ids is None:
+        return load_bookings_cube_by_event(similar_ids)
+    per_event = load_bookings_cube_by_event(superset_ids)
+    return per_event[per_event['EVENT_ID'].astype('int64').isin([int(i) for i in similar_ids])]
+
+
+# Function to get the bookings cube of each event separately (EVENT_ID, DIAS_A_LA_VENTA, DIA, PAYMENT_METHOD)
+def load_bookings_cube_by_event(event_ids):
+    if use_store('bookings_cube'):
+        return cached_store_read('load_bookings_cube_by_event', 'bookings_cube', event_ids)
     # Execute a query to extract the data
     sql = f"""
             select
-                case
-                    when split_part(payment_method, '::', 2) in ('PosCard', 'PosCash') then 'Insiders'
-                    when split_part(payment_method, '::', 2) in ('Paypal', 'BoletiaDeposit', 'Deposit', 'TicketBooth', 'Innova') then 'Inactivos'
-                    ELSE split_part(payment_method, '::', 2)
-                end as payment_method,
+                cb.event_id,
+                {aggregates.BOOKINGS_CUBE_DIMENSIONS},
                 count(*) as compras
             from PROD.EVENTS.COMPLETED_BOOKINGS cb
             left join prod.events.events e on e.event_id = cb.event_id
-            where cb.event_id in ({','.join(event_id)})
-            and cb.paid_at > coalesce(e.activated_at, e.created_at)
-            and payment_method is not null
-            group by 1
-            order by 1
+            where cb.event_id in ({','.join(cohort_ids(event_ids))})
+            group by 1, 2, 3, 4
             """
-    cur.execute(sql)
-    # Converting data into a dataframe
-    df = cur.fetch_pandas_all()
-    df = df.replace(['Banwire', 'PhysicalTicket', 'Cash'], [
-                    'Tarjeta de crédito', 'Boleto físico', 'Efectivo'])
-    return df
+    return cached_query('load_bookings_cube_by_event', sql, partition_of(event_ids))
 
 
-# Function to get the total number of customers by age bracket
-@st.cache
-def load_customers_by_age(event_id):
-    # Execute a query to extract the data
-    sql = f"""select *
-                from EVENTS.CUSTOMER_DEMOGRAPHICS_AGE
-                where event_id in ({','.join(event_id)})
-                order by age_bracket
-                """
-    cur.execute(sql)
-    # Converting data into a dataframe
-    df = cur.fetch_pandas_all()
-    return df
+# The halves of a cube are cast again after being put together, since categoricals with
+# different categories are concatenated as plain objects
+def translate_bookings_cube(df):
+    df = schemas.cast(df, 'load_bookings_cube')
+    return schemas.translate(df, ['DIA', 'PAYMENT_METHOD'])
 
 
-# Function to get the total number of customer by gender
-@st.cache
-def load_customers_by_gender(event_id):
-    # Execute a query to extract the data
-    sql = f"""select *
-                    from EVENTS.CUSTOMER_DEMOGRAPHICS_GENDER
-                    where event_id in ({','.join(event_id)})
-                    """
-    print(sql)
-    cur.execute(sql)
-    # Converting data into a dataframe
-    df = cur.fetch_pandas_all()
-    df = df.replace(['female', 'male'], ['Mujeres', 'Hombres'])
-    return df
+# Function to sum the bookings cube of 'Este evento' or 'Similares' by one of its columns
+def rollup_bookings_cube(cube, evento, column):
+    df = cube[(cube['EVENTO'] == evento) & cube[column].notna()]
+    return df.groupby(column, as_index=False, observed=True)['COMPRAS'].sum()
 
 
-# Function to get the total number of bookings by day of the week
-@st.cache
-def load_bookings_by_week_day(event_id):
-    # Execute a query to extract the data
-    sql = f"""select dayname(convert_timezone('America/Mexico_City', paid_at)) as dia, count(booking_id) as total_bookings
-                from EVENTS.COMPLETED_BOOKINGS
-                where event_id in ({','.join(event_id)})
-                group by dia
-                order by total_bookings
-                """
-    cur.execute(sql)
-    # Converting data into a dataframe
-    df = cur.fetch_pandas_all()
-    df = df.replace(['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun'],
-                    ['Lunes', 'Martes', 'Miercoles', 'Jueves', 'Viernes', 'Sabado', 'Domingo'])
+# Bookings of 'Este evento' or 'Similares' by day since the start of the sale, from the bookings cube
+def cube_bookings_by_date(cube, evento):
+    df = rollup_bookings_cube(cube, evento, 'DIAS_A_LA_VENTA')
+    df['DIAS_A_LA_VENTA'] = df['DIAS_A_LA_VENTA'].astype(int)
     return df
 
 
-# Function to get the coordinates (lat and long) of each city
-@st.cache
+# Cumulative sales curve of every similar event (events x days), from the per-event bookings cube
+def load_similar_sales_curves(similar_ids, superset_ids=None):
+    similar_ids = cohort_ids(similar_ids)
+
+    def load():
+        return curves.SalesCurves.from_frame(similar_bookings_by_event(similar_ids, superset_ids))
+
+    key = cohort_key('load_similar_sales_curves', similar_ids)
+    return query_cache.get_or_load(key, load, CACHE_TTLS.get('load_similar_sales_curves', config.CACHE_TTL))
+
+
+# Bookings of 'Este evento' or 'Similares' by day of the week, from the bookings cube
+def cube_bookings_by_week_day(cube, evento):
+    df = rollup_bookings_cube(cube, evento, 'DIA')
+    df = df.rename(columns={'COMPRAS': 'TOTAL_BOOKINGS'})
+    return df.sort_values('TOTAL_BOOKINGS').reset_index(drop=True)
+
+
+# Bookings of 'Este evento' or 'Similares' by payment method, from the bookings cube
+def cube_bookings_by_payment_method(cube, evento):
+    return rollup_bookings_cube(cube, evento, 'PAYMENT_METHOD')
+
+
+# Function to get the coordinates (lat and long) of each city from the local gazetteer.
+# Cities it does not know yet are geocoded in the background and appear on a later rerun.
 def get_coordinates(df):
-    geolocator = Nominatim(user_agent='Boletia_GA')
-    df['LAT'] = np.nan
-    df['LON'] = np.nan
-    for i in df.index:
-        city = df['CITY'][i] + ', ' + df['COUNTRY'][i]
-        location = geolocator.geocode(city)
-        if location:
-            df['LAT'][i] = location.latitude
-            df['LON'][i] = location.longitude
+    return gazetteer.locate(df)
+
+
+# Function to get the funnel pageviews of the event with a single query: the general funnel
+# (GRAIN 'General') and the finest breakdown, by source/medium (GRAIN 'SOURCE_MEDIUM').
+# The funnel by medium is rolled up from the source/medium rows, since GA source/medium is
+# "<source> / <medium>"; with BLT_SMART_EVENTS_FUNNEL_MEDIUM_ROLLUP=0 it is read from its own
+# table in the same query instead (GRAIN 'MEDIUM').
+def load_funnel_cube(event_id):
+    event_data = load_event_data(event_id)
+    if event_data is None or pd.isna(event_data['SUBDOMAIN']):
+        return schemas.cast(pd.DataFrame(columns=['GRAIN', 'PAGE_PATH', 'BREAKDOWN', 'PAGEVIEWS']),
+                            'load_funnel_cube')
+    subdomain = str(event_data['SUBDOMAIN']).replace("'", "''")
+    sources = [('General', 'SALES_FUNNELS', 'null'),
+               ('SOURCE_MEDIUM', 'SALES_FUNNELS_BY_SOURCE_MEDIUM', 'f.SOURCE_MEDIUM')]
+    if not config.FUNNEL_MEDIUM_ROLLUP:
+        sources.append(('MEDIUM', 'SALES_FUNNELS_BY_MEDIUM', 'f.MEDIUM'))
+    # Execute a query to extract the data
+    sql = "\n            union all\n".join(f"""
+            select
+                '{grain}' as GRAIN,
+                {aggregates.FUNNEL_STAGE} as PAGE_PATH,
+                {breakdown} as BREAKDOWN,
+                f.PAGEVIEWS
+            from EVENTS.{table} f
+            where f.SUBDOMAIN = '{subdomain}'
+            and {aggregates.FUNNEL_PATHS}""" for grain, table, breakdown in sources)
+    return cached_query('load_funnel_cube', sql, partition_of(event_id))
 
-    return df
+
+def funnel_cube_grain(event_id, grain, column):
+    df = load_funnel_cube(event_id)
+    df = df[df['GRAIN'] == grain].rename(columns={'BREAKDOWN': column})
+    return df[['PAGE_PATH', column, 'PAGEVIEWS']].sort_values('PAGEVIEWS', ascending=False).reset_index(drop=True)
 
 
 # Function to get the events pageviews
-@st.cache
 def load_pageviews(event_id):
-    # Execute a query to extract the data
-    sql = f"""with pv as (select
-                case
-                    when PAGE_PATH like '%/finish' then 'Pago'
-                    when PAGE_PATH like '%/pay' then 'Checkout'
-                    when PAGE_PATH like '%/info' then 'Info'
-                    else 'Inicio'
-                end as PAGE_PATH,
-                PAGEVIEWS
-                from EVENTS.SALES_FUNNELS
-                where SUBDOMAIN =
-                    (select subdomain
-                    from EVENTS.EVENTS
-                    where EVENT_ID = {event_id})
-                and PAGE_PATH in (
-                                  SUBDOMAIN || '.boletia.com/',
-                                  SUBDOMAIN || '.boletia.com/info',
-                                  SUBDOMAIN || '.boletia.com/pay',
-                                  SUBDOMAIN || '.boletia.com/finish')
-                order by PAGEVIEWS DESC),
-                default_pv as (
-                    select $1 as PAGE_PATH, $2 as PAGEVIEWS from (values ('Inicio', 0), ('Info', 0), ('Checkout', 0), ('Pago', 0))
-                )
-                select d.PAGE_PATH, coalesce(pv.PAGEVIEWS, d.PAGEVIEWS) as PAGEVIEWS
-                from default_pv as d
-                left join pv on pv.PAGE_PATH = d.PAGE_PATH
-                """
-    cur.execute(sql)
-    # Converting data into a dataframe
-    df = cur.fetch_pandas_all()
-    stages = CategoricalDtype(
-        ["Inicio", "Info", "Checkout", "Pago"], ordered=True)
-    df["PAGE_PATH"] = df["PAGE_PATH"].astype(stages)
+    if use_store('pageviews'):
+        df = cached_store_read('load_pageviews', 'pageviews', [event_id])
+    else:
+        df = load_funnel_cube(event_id)
+        df = df[df['GRAIN'] == 'General']
+    # Every stage is present, with 0 pageviews when the event has none
+    df = df.groupby('PAGE_PATH', observed=True)['PAGEVIEWS'].sum()
+    df = df.reindex(list(schemas.STAGES.categories), fill_value=0).reset_index()
+    df = schemas.cast(df, 'load_pageviews')
     df = df.sort_values('PAGE_PATH')
     return df
 
 
-# Function to get the events pageviews by source/medium
-@st.cache
+# Function to get the events pageviews by medium
 def load_pageviews_by_medium(event_id):
-    # Execute a query to extract the data
-    sql = f"""select
-                case
-                    when PAGE_PATH like '%/finish' then 'Pago'
-                    when PAGE_PATH like '%/pay' then 'Checkout'
-                    when PAGE_PATH like '%/info' then 'Info'
-                    else 'Inicio'
-                end as PAGE_PATH,
-                MEDIUM,
-                PAGEVIEWS
-                from EVENTS.SALES_FUNNELS_BY_MEDIUM
-                where SUBDOMAIN =
-                    (select subdomain
-                    from EVENTS.EVENTS
-                    where EVENT_ID = {event_id})
-                and PAGE_PATH in (
-                                  SUBDOMAIN || '.boletia.com/',
-                                  SUBDOMAIN || '.boletia.com/info',
-                                  SUBDOMAIN || '.boletia.com/pay',
-                                  SUBDOMAIN || '.boletia.com/finish')
-                order by PAGEVIEWS desc
-                    """
-    cur.execute(sql)
-    # Converting data into a dataframe
-    df = cur.fetch_pandas_all()
-    df = df.replace(['(none)', 'referral', 'organic', 'paid social', 'sendgrid'], [
-                    'Directo', 'Referido', 'Orgánico', 'Paid Social', 'Sendgrid'])
-    return df
+    if use_store('pageviews_by_medium'):
+        df = cached_store_read('load_pageviews_by_medium', 'pageviews_by_medium', [event_id])
+        df = df.drop(columns=['EVENT_ID']).sort_values('PAGEVIEWS', ascending=False).reset_index(drop=True)
+    elif config.FUNNEL_MEDIUM_ROLLUP:
+        df = funnel_cube_grain(event_id, 'SOURCE_MEDIUM', 'MEDIUM')
+        # The medium of each source/medium category, mapped once per category
+        source_medium = df['MEDIUM'].cat.categories.to_series()
+        parts = source_medium.str.split(' / ', n=1)
+        df['MEDIUM'] = df['MEDIUM'].map(parts.str[1].fillna(parts.str[0]))
+        df = schemas.sum_by(df, ['PAGE_PATH', 'MEDIUM'], 'PAGEVIEWS')
+        df = schemas.cast(df, 'load_pageviews_by_medium')
+        df = df.sort_values('PAGEVIEWS', ascending=False).reset_index(drop=True)
+    else:
+        df = funnel_cube_grain(event_id, 'MEDIUM', 'MEDIUM')
+    return schemas.translate(df, ['MEDIUM'])
 
 
 # Function to get the events pageviews by source/medium
-@st.cache
 def load_pageviews_by_source_medium(event_id):
-    # Execute a query to extract the data
-    sql = f"""select
-                case
-                    when PAGE_PATH like '%/finish' then 'Pago'
-                    when PAGE_PATH like '%/pay' then 'Checkout'
-                    when PAGE_PATH like '%/info' then 'Info'
-                    else 'Inicio'
-                end as PAGE_PATH,
-                SOURCE_MEDIUM,
-                PAGEVIEWS
-                from EVENTS.SALES_FUNNELS_BY_SOURCE_MEDIUM
-                where SUBDOMAIN =
-                    (select subdomain
-                    from EVENTS.EVENTS
-                    where EVENT_ID = {event_id})
-                and PAGE_PATH in (
-                                  SUBDOMAIN || '.boletia.com/',
-                                  SUBDOMAIN || '.boletia.com/info',
-                                  SUBDOMAIN || '.boletia.com/pay',
-                                  SUBDOMAIN || '.boletia.com/finish')
-                order by PAGEVIEWS desc
-                    """
-    cur.execute(sql)
-    # Converting data into a dataframe
-    df = cur.fetch_pandas_all()
-    df = df.replace('(direct) / (none)', 'directo')
-    return df
-
-
-# Function to pivot the data and process the table
-@st.cache
-def get_funnel(df, group_by_field):
-    stages = CategoricalDtype(
-        ["Inicio", "Info", "Checkout", "Pago"], ordered=True)
-    df["PAGE_PATH"] = df["PAGE_PATH"].astype(stages)
-    df = df.sort_values('PAGE_PATH')
-    # pivot the source_medium values into columns
-    df = df.pivot_table('PAGEVIEWS', 'PAGE_PATH', group_by_field)
-    # replacing nan values to zeros
-    df = df.fillna(0)
-    df = df.T
-    df['Tasa de conversión'] = df.apply(
-        lambda x: f"{round(x['Pago'] / x['Inicio'] * 100,2)}%", axis=1)
-    df = df.astype('str')
-    df = df.T
-    return df
+    if use_store('pageviews_by_source_medium'):
+        df = cached_store_read('load_pageviews_by_source_medium', 'pageviews_by_source_medium', [event_id])
+        df = df.drop(columns=['EVENT_ID']).sort_values('PAGEVIEWS', ascending=False).reset_index(drop=True)
+    else:
+        df = funnel_cube_grain(event_id, 'SOURCE_MEDIUM', 'SOURCE_MEDIUM')
+    return schemas.translate(df, ['SOURCE_MEDIUM'])
 
 
 # Function to get the total number of bookings by city
-@st.cache(allow_output_mutation=True)
 def load_bookings_by_city(event_id):
+    if use_store('bookings_by_city'):
+        df = cached_store_read('load_bookings_by_city', 'bookings_by_city', [event_id])
+        df = df[df['CITY'] != '(not set)']
+        return df.sort_values('TOTAL_BOOKINGS', ascending=False).reset_index(drop=True)
     # Execute a query to extract the data
     sql = f"""select *
                 from EVENTS.CUSTOMER_DEMOGRAPHICS_CITY
                 where event_id = {event_id} and CITY <> '(not set)'
                 order by TOTAL_BOOKINGS DESC
                 """
-    cur.execute(sql)
-    # Converting data into a dataframe
-    df = cur.fetch_pandas_all()
+    df = cached_query('load_bookings_by_city', sql, partition_of(event_id))
     return df
 
 
-# Function to adjust the data for the pie chart
-# grouping the rows under <min_value> in a new row named 'others'
+# Function to keep the <n> largest values of a series and add the rest up in a single
+# <other_label> entry (only when there is something left)
+def top_n_with_others(values, n, other_label):
+    values = values.sort_values(ascending=False, kind='stable')
+    top = values.iloc[:n]
+    rest = values.iloc[n:].sum()
+    if len(values) > n and rest > 0:
+        top = pd.concat([top, pd.Series([rest], index=[other_label])])
+    return top
+
+
+# Function to adjust the data for the pie chart: the <num_cat> sources/mediums with more
+# purchases plus 'otros fuentes/medios', from a frame indexed by SOURCE_MEDIUM with a Compras column
 def adjust_to_piechart(df, num_cat):
-    others_count = 0
-    df = df.sort_values(by='Compras', ascending=False).reset_index()
-    df['SM'] = ''
-    for i in df.index:
-        if i >= num_cat:
-            others_count += df['Compras'][i]
-            df.drop(i, inplace=True)
-        else:
-            df['SM'][i] = df['SOURCE_MEDIUM'][i] + '\t' + str(df['Compras'][i])
-    if others_count > 0:
-        df = df.append({'SOURCE_MEDIUM': 'otros fuentes/medios', 'Compras': others_count,
-                        'SM': f'otros fuentes/medios\t{others_count}'}, ignore_index=True)
+    purchases = top_n_with_others(df['Compras'], num_cat, 'otros fuentes/medios')
+    df = purchases.rename('Compras').rename_axis('SOURCE_MEDIUM').reset_index()
+    df['SM'] = df['SOURCE_MEDIUM'].astype(str) + '\t' + df['Compras'].astype(str)
     return df
 
 
+# Function to get the per-event rows of a demographics loader for the similar events, summed by
+# `dimensions`. With `superset_ids` the rows of the whole superset are loaded once (and cached) and
+# the similar events are filtered in memory.
+def load_similar_aggregate(loader, similar_ids, dimensions, superset_ids=None):
+    if superset_ids is None:
+        df = loader(similar_ids)
+    else:
+        df = loader(superset_ids)
+        df = df[df['EVENT_ID'].astype('int64').isin([int(i) for i in similar_ids])]
+    return df.groupby(dimensions, as_index=False, observed=True)['TOTAL_BOOKINGS'].sum()
+
+
 # Function to join the main event data with the similar events data
 def join_data(df1, df2):
     df1['EVENTO'] = 'Este evento'
@@ -383,30 +504,22 @@ def join_data(df1, df2):
     return df3
 
 
-@st.cache
 def load_customers_by_gender_age(event_id):
+    if use_store('customers_by_gender_age'):
+        df = cached_store_read('load_customers_by_gender_age', 'customers_by_gender_age', event_id)
+        return schemas.translate(df, ['GENDER'])
     # Execute a query to extract the data
     sql = f"""select *
                     from EVENTS.CUSTOMER_DEMOGRAPHICS_GENDER_AGE
-                    where event_id in ({','.join(event_id)})
+                    where event_id in ({','.join(cohort_ids(event_id))})
                     """
-    cur.execute(sql)
-    # Converting data into a dataframe
-    df = cur.fetch_pandas_all()
-    df = df.replace(['female', 'male'], ['Mujeres', 'Hombres'])
-    return df
+    df = cached_query('load_customers_by_gender_age', sql, partition_of(event_id))
+    return schemas.translate(df, ['GENDER'])
 
 
 def get_5_sources_mediums(df, column):
     df = df[df['PAGE_PATH'] == 'Inicio']
-    df = df.sort_values(by='PAGEVIEWS', ascending=False)
-    names = []
-    for i in df.index:
-        names.append(df[column][i])
-    if len(names) > 5:
-        return names[:5]
-    else:
-        return names
+    return df.sort_values(by='PAGEVIEWS', ascending=False, kind='stable')[column].head(5).tolist()
 
 
 def local_css(file_name):
@@ -424,33 +537,43 @@ def icon(icon_name):
         f'<i class="material-icons">{icon_name}</i>', unsafe_allow_html=True)
 
 
-def convert_to_funnel(df):
-    # First complete the data with all the stages of the funnel
-    stages = ['Inicio', 'Info', 'Checkout', 'Pago']
-    funnel = df.copy()
-    for s in stages:
-        if s not in funnel['PAGE_PATH'].values:
-            funnel = funnel.append(
-                {'PAGE_PATH': s, 'PAGEVIEWS': 0}, ignore_index=True)
-
-    # Then add the 'shadow' data (difference between stages) to be display in the funnel chart
-    funnel['DATOS'] = 'Etapa actual'
-    for i in range(1, 4):
-        previous_stage = int(funnel.loc[(
-            funnel['PAGE_PATH'] == stages[i - 1]) & (funnel['DATOS'] == 'Etapa actual')]['PAGEVIEWS'])
-        current_stage = int(
-            funnel.loc[funnel['PAGE_PATH'] == stages[i]]['PAGEVIEWS'])
-        dif = previous_stage - current_stage
-        funnel = funnel.append(
-            {'PAGE_PATH': stages[i], 'PAGEVIEWS': dif, 'DATOS': 'Diferencia con etapa anterior'}, ignore_index=True)
-    return funnel
-
-
-def draw_header():
+# DEV sidebar panel with the queries of this session, newest first: the current run up to the
+# header and the runs before it
+def draw_profiler():
+    records = profiler.session_records(current_session())[::-1][:200]
+    with st.sidebar.expander('Perfilador de consultas'):
+        warmed = prewarmer.status()
+        if warmed['total']:
+            st.caption(f"Precarga: {warmed['done']}/{warmed['total']} eventos"
+                       f"{' (en curso)' if warmed['running'] else ''}, {warmed['failed']} con error")
+        if not records:
+            st.caption('Sin consultas todavía')
+            return
+        df = pd.DataFrame(records)
+        misses = df[df['cache'] != 'hit']
+        st.caption(f"{len(misses)} consultas, {len(df) - len(misses)} desde caché, "
+                   f"{misses['execute_seconds'].sum() + misses['fetch_seconds'].sum():.2f} s")
+        df['time'] = pd.to_datetime(df['time'], unit='s').dt.strftime('%H:%M:%S')
+        st.dataframe(df[['time', 'loader', 'cache', 'execute_seconds', 'fetch_seconds', 'rows', 'bytes',
+                         'query_id', 'fingerprint']], use_container_width=True)
+
+
+SECTION_VIEWS = ["Este evento", "Eventos similares", "Comparativa"]
+
+
+# View selector of a chart section. Unlike st.tabs, which builds and sends the figures of every
+# tab on each run, the page only builds the figure of the selected view.
+def section_view(key):
+    return st.radio('Vista', SECTION_VIEWS, key=key, horizontal=True, label_visibility='collapsed')
+
+
+def draw_header(ctx):
+    if config.TARGET == 'DEV':
+        draw_profiler()
     st.image(f"frontend/{config.LOGO}", width=250)
     header = st.container()
     with header:
-        event_data = st.session_state["event_data"]
+        event_data = ctx.event_data
         # Streamlit page title
         st.title(
             f"{event_data['NAME'] if config.TARGET != 'DEMO' else 'Ejemplo'}")
@@ -477,25 +600,134 @@ def load_css():
     remote_css('https://fonts.googleapis.com/icon?family=Material+Icons')
 
 
-def env_config():
-    # Read variables from config if prod deployment, else let the user write it in
+PRICE_SLIDER_MAX = 1.0
+
+
+# Event of the session in the multi-event mode, from the URL (?event_id=<id>, or ?token=<id>.<signature>
+# when links have to be signed). The other pages and reruns without the parameter keep the session's event.
+def requested_event_id():
+    if config.EVENT_TOKEN_SECRET:
+        token = st.query_params.get('token')
+        event_id = access.verify_token(token) if token else None
+    else:
+        event_id = st.query_params.get('event_id')
+    if event_id is None and 'token' not in st.query_params and 'event_id' not in st.query_params:
+        event_id = st.session_state.get("event_id")
+    if event_id is None or not str(event_id).isdigit():
+        st.error('El enlace del evento no es válido.')
+        st.stop()
+    return str(event_id)
+
+
+# Default DEV inputs of a new session
+DEV_SESSION_DEFAULTS = {"event_id": "208150", "price_threshold": 0.1}
+
+
+# Event ID and price threshold of the session: from the sidebar in DEV, from the deployment (or the URL
+# in the multi-event mode) otherwise. Every page shows the DEV inputs, so any page can be opened first.
+def session_event():
     if config.TARGET == 'DEV':
-        st.session_state["event_id"] = st.sidebar.text_input(
-            "Event ID", "208150")
-        st.session_state["price_threshold"] = st.sidebar.slider(
-            "% rango de precio", min_value=0.0, max_value=1.0, value=0.1)
-    elif config.TARGET in ['PROD', 'DEMO']:
-        st.session_state["event_id"] = config.EVENT_ID
-        st.session_state["price_threshold"] = config.PRICE_RANGE
-
-    # Load event data
-    st.session_state["event_data"] = load_event_data(
-        st.session_state["event_id"])
-
-    # If hardcoded similar events are set, use them
-    if config.SIMILAR_EVENTS == '':
-        st.session_state["similar_events"] = load_similar_events(
-            st.session_state["event_id"], st.session_state["price_threshold"])
+        # The inputs are bound to the session state by key, so they keep their identity across reruns.
+        # Streamlit drops the state of widgets that a page run does not draw, so their values are
+        # written back as plain session state before drawing them, which keeps them across pages.
+        for key, default in DEV_SESSION_DEFAULTS.items():
+            st.session_state[key] = st.session_state.get(key, default)
+        event_id = st.sidebar.text_input("Event ID", key="event_id")
+        price_threshold = st.sidebar.slider(
+            "% rango de precio", min_value=0.0, max_value=PRICE_SLIDER_MAX, key="price_threshold")
     else:
-        st.session_state["similar_events"] = load_static_event_list(
-            config.SIMILAR_EVENTS.split(','))
+        event_id = requested_event_id() if config.MULTI_EVENT else config.EVENT_ID
+        price_threshold = config.PRICE_RANGE
+        st.session_state["event_id"] = event_id
+        st.session_state["price_threshold"] = price_threshold
+    return event_id, price_threshold
+
+
+# Context of an event, through the result cache so the sessions viewing the same event share it
+def load_event_context(event_id, price_threshold):
+    def load():
+        event_data = load_event_data(event_id)
+        # If hardcoded similar events are set, use them
+        if config.SIMILAR_EVENTS == '':
+            similar_events = load_similar_events(event_id, price_threshold)
+        else:
+            similar_events = load_static_event_list(config.SIMILAR_EVENTS.split(','))
+        # In DEV the similar events aggregates are loaded for the widest price band of the slider
+        # and the current band is filtered in memory, so moving the slider does not query anything
+        similar_superset = None
+        if config.TARGET == 'DEV' and config.SIMILAR_EVENTS == '':
+            similar_superset = load_similar_events(
+                event_id, PRICE_SLIDER_MAX)["EVENT_ID"].astype(str).values.tolist()
+        return context.EventContext(event_id, price_threshold, event_data, similar_events, similar_superset)
+
+    key = cache.fingerprint('event context', [event_id, price_threshold, config.SIMILAR_EVENTS])
+    return query_cache.get_or_load(key, load, CACHE_TTLS['load_event_context'], partition_of(event_id))
+
+
+# Event context of the session, loaded on whichever page the session starts. The session keeps it
+# while it views the same event and price threshold, so moving between pages loads nothing again.
+def event_context():
+    event_id, price_threshold = session_event()
+    ctx = st.session_state.get("event_context")
+    if ctx is None or ctx.key != (str(event_id), price_threshold):
+        ctx = load_event_context(event_id, price_threshold)
+        st.session_state["event_context"] = ctx
+    if config.MULTI_EVENT and ctx.event_data is None:
+        st.error('No se encontró el evento.')
+        st.stop()
+    return ctx
+
+
+# Whether the event is still on sale, i.e. it has not started yet, as in load_on_sale_event_ids.
+# STARTED_AT is in Mexico City time.
+def event_on_sale(event_data):
+    started_at = event_data['STARTED_AT']
+    now = pd.Timestamp.now(tz='America/Mexico_City').tz_localize(None)
+    return pd.notna(started_at) and pd.Timestamp(started_at) > now
+
+
+# Events on sale right now
+def load_on_sale_event_ids():
+    sql = """select event_id
+            from PROD.EVENTS.EVENTS
+            where activated_at <= current_timestamp
+            and started_at > current_timestamp
+            """
+    return run_query('load_on_sale_event_ids', sql)['EVENT_ID'].astype(str).tolist()
+
+
+def prewarm_event_ids():
+    if config.PREWARM_EVENTS.strip().upper() == 'ON_SALE':
+        return load_on_sale_event_ids()
+    return [i.strip() for i in config.PREWARM_EVENTS.split(',') if i.strip()]
+
+
+# Run the loaders of every page for an event, as a PROD page view would
+def prewarm_event(event_id):
+    ctx = load_event_context(event_id, config.PRICE_RANGE)
+    if ctx.event_data is None:
+        return
+    similar_ids = ctx.similar_ids
+    load_bookings_cube(event_id, similar_ids)
+    load_similar_sales_curves(similar_ids)
+    get_coordinates(load_bookings_by_city(event_id))
+    for loader in [load_customers_by_age, load_customers_by_gender, load_customers_by_gender_age]:
+        loader([event_id])
+        if similar_ids:
+            loader(similar_ids)
+    load_pageviews(event_id)
+    load_pageviews_by_medium(event_id)
+    load_pageviews_by_source_medium(event_id)
+
+
+prewarmer = prewarm.Prewarmer(prewarm_event, prewarm_event_ids, config.PREWARM_WORKERS, config.PREWARM_INTERVAL)
+
+
+# Start prewarming once per process. serve.py calls it before the server accepts connections; with a
+# plain `streamlit run` it only happens when the first page view imports this module.
+def start_prewarm():
+    if config.PREWARM_EVENTS:
+        prewarmer.start()
+
+
+start_prewarm()